@@ -0,0 +1,209 @@
+"""Benchmark of the transports between services and callbacks.
+
+Sends float64 payloads from this process to consumer processes through the
+`ConcurrentTask` comms - one transport per consumer, as for callbacks - and
+measures throughput, delivery, latency (from the `send` to the consumer having
+the data) and the time the producer is blocked in `send`. Sweeps payload size,
+producer rate and number of consumers:
+
+    python benchmarks/ipc.py --output ipc_rig1.json
+    python benchmarks/ipc.py --transports queue array --sizes 131072 --rates 0 1000
+"""
+
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import defopt
+import numpy as np
+
+from etho.services.utils import concurrent_task
+from etho.services.utils.stats import LogHistogram
+
+
+# name -> f(payload shape) -> (sender, receiver)
+TRANSPORTS: Dict[str, Callable[[Tuple[int, ...]], Tuple[Any, Any]]] = {
+    "queue": lambda shape: concurrent_task.Queue(),
+    "pipe": lambda shape: concurrent_task.Pipe(),
+    "array": lambda shape: concurrent_task.NumpyArray(shape),
+}
+
+# payload sizes in bytes
+SIZES = {
+    "DAQ chunk 10x8": 10 * 8 * 8,
+    "DAQ chunk 1000x16": 1000 * 16 * 8,
+    "VGA mono": 640 * 480,
+    "SXGA RGB": 1280 * 1024 * 3,
+    "4K RGB": 3840 * 2160 * 3,
+}
+
+POLL_INTERVAL = 0.0001  # seconds between polls of shared arrays
+
+
+def _histogram() -> LogHistogram:
+    return LogHistogram(1e-7, 1e2, buckets_per_decade=50)
+
+
+def consume(receiver, transport: str, barrier, results):
+    """Receive until a payload with a negative sequence number arrives.
+
+    The first two values of each payload are the sequence number and the
+    `time.perf_counter` of the send.
+    """
+    latency = _histogram()
+    nb_received = 0
+    barrier.wait()
+    while True:
+        if transport == "array":
+            if not receiver.poll():
+                time.sleep(POLL_INTERVAL)
+                continue
+            data = receiver.get()
+        else:
+            data, _ = receiver.get()
+        seq, sent = data[0], data[1]  # read before a shared array is overwritten
+        now = time.perf_counter()
+        if seq < 0:
+            break
+        latency.add(now - sent)
+        nb_received += 1
+    results.put((nb_received, latency))
+
+
+def run_case(transport: str, payload_bytes: int, rate: float, nb_consumers: int, duration: float, max_megabytes: float = 1000) -> Dict[str, Any]:
+    """Send payloads of `payload_bytes` at `rate` (0 for as fast as possible) for `duration` seconds.
+
+    Stops early once `max_megabytes` were sent to all consumers together - queues
+    buffer everything the consumers have not read yet in the producer.
+    """
+    max_messages = max(1, int(max_megabytes * 1e6 / payload_bytes / nb_consumers))
+    shape = (max(2, payload_bytes // 8),)
+    payload = np.random.default_rng(0).standard_normal(shape)
+    comms = [TRANSPORTS[transport](shape) for _ in range(nb_consumers)]
+    barrier = mp.Barrier(nb_consumers + 1)
+    results = mp.Queue()
+    consumers = [mp.Process(target=consume, args=(receiver, transport, barrier, results), daemon=True) for _, receiver in comms]
+    for consumer in consumers:
+        consumer.start()
+    barrier.wait()
+
+    blocking = _histogram()
+    nb_sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration and nb_sent < max_messages:
+        if rate:
+            time.sleep(max(0, start + nb_sent / rate - time.perf_counter()))
+        message = payload.copy()  # queues pickle in a background thread - do not reuse the buffer
+        message[0] = nb_sent
+        message[1] = time.perf_counter()
+        for sender, _ in comms:
+            t0 = time.perf_counter()
+            sender.send((message, None))
+            blocking.add(time.perf_counter() - t0)
+        nb_sent += 1
+    send_time = time.perf_counter() - start
+
+    stop = payload.copy()
+    stop[0] = -1
+    for sender, _ in comms:
+        sender.send((stop, None))
+    received = []
+    latency = _histogram()
+    for _ in consumers:
+        nb_received, consumer_latency = results.get()
+        received.append(nb_received)
+        latency.merge(consumer_latency)
+    elapsed = time.perf_counter() - start
+    for consumer in consumers:
+        consumer.join()
+    for sender, receiver in comms:
+        sender.close()
+        if receiver is not sender:
+            receiver.close()
+
+    nb_delivered = sum(received)
+    return {
+        "transport": transport,
+        "payload_bytes": payload_bytes,
+        "rate": rate,
+        "consumers": nb_consumers,
+        "duration": duration,
+        "sent": nb_sent,
+        "send_rate": nb_sent / send_time,
+        "delivered_fraction": nb_delivered / nb_sent / nb_consumers if nb_sent else None,
+        "messages_per_second": nb_delivered / elapsed,
+        "megabytes_per_second": nb_delivered * payload_bytes / elapsed / 1e6,
+        "latency": latency.summary(),
+        "send_blocking": blocking.summary(),
+    }
+
+
+def _ms(stats: Dict[str, Any], key: str) -> str:
+    return f"{1000 * stats[key]:1.3f}" if stats["count"] else "-"
+
+
+def machine() -> Dict[str, Any]:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version,
+        "numpy": np.__version__,
+        "start_method": mp.get_start_method(),
+    }
+
+
+def main(
+    *,
+    output: str = "ipc.json",
+    transports: Optional[List[str]] = None,
+    sizes: Optional[List[int]] = None,
+    rates: Optional[List[float]] = None,
+    consumers: Optional[List[int]] = None,
+    duration: float = 2.0,
+    max_megabytes: float = 1000,
+    quick: bool = False,
+):
+    """Benchmark the ConcurrentTask transports.
+
+    Args:
+        output (str): JSON file for the results.
+        transports (Optional[List[str]]): Transports to test. Defaults to all (queue, pipe, array).
+        sizes (Optional[List[int]]): Payload sizes in bytes. Defaults to DAQ chunks to 4K RGB frames.
+        rates (Optional[List[float]]): Producer rates in messages per second - 0 sends as fast as possible. Defaults to 0, 100 and 1000.
+        consumers (Optional[List[int]]): Numbers of consumers. Defaults to 1 and 4.
+        duration (float): Send time per case in seconds.
+        max_megabytes (float): Stop sending after this many megabytes in total, to limit the memory used by queues.
+        quick (bool): Test fewer sizes, rates and consumers unless given explicitly.
+    """
+    transports = transports or list(TRANSPORTS)
+    sizes = sizes or ([SIZES["DAQ chunk 1000x16"], SIZES["SXGA RGB"]] if quick else list(SIZES.values()))
+    rates = rates or ([0] if quick else [0, 100, 1000])
+    consumers = consumers or ([1] if quick else [1, 4])
+
+    results = []
+    print(f"{'transport':<10} {'bytes':>10} {'rate':>6} {'cons':>4} {'msg/s':>9} {'MB/s':>8} {'deliv':>6} {'p50 [ms]':>9} {'p99 [ms]':>9} {'block p99':>10}")
+    for transport, payload_bytes, rate, nb_consumers in itertools.product(transports, sizes, rates, consumers):
+        result = run_case(transport, payload_bytes, rate, nb_consumers, duration, max_megabytes)
+        results.append(result)
+        latency, blocking = result["latency"], result["send_blocking"]
+        print(
+            f"{transport:<10} {payload_bytes:>10} {rate:>6g} {nb_consumers:>4}"
+            f" {result['messages_per_second']:>9.1f} {result['megabytes_per_second']:>8.1f} {result['delivered_fraction']:>6.2f}"
+            f" {_ms(latency, 'p50'):>9} {_ms(latency, 'p99'):>9} {_ms(blocking, 'p99'):>10}"
+        )
+
+    report = {"date": datetime.now().isoformat(), "machine": machine(), "sizes": SIZES, "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}.")
+
+
+if __name__ == "__main__":
+    defopt.run(main)
@@ -0,0 +1,239 @@
+"""Micro-benchmarks of the data writer callbacks.
+
+Drives the writers directly through `_loop` and `_cleanup` - without processes
+and queues - and records throughput and bytes on disk for a sweep of data
+shapes, chunk sizes and codecs. Results are saved as JSON; pass a previous result
+file with `--compare-to` to flag cases that got slower:
+
+    python benchmarks/writers.py --output writers_rig1.json
+    python benchmarks/writers.py --quick --compare-to writers_rig1.json
+"""
+
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import defopt
+import numpy as np
+
+from etho.services.callbacks import callbacks
+
+
+def frames(shape, nb_frames: int, dtype=np.uint8) -> Iterator[np.ndarray]:
+    """Noisy frames on a static gradient - compressible about as well as camera frames."""
+    rng = np.random.default_rng(0)
+    background = np.linspace(0, 128, shape[1], dtype=np.float32)[np.newaxis, :]
+    if len(shape) == 3:
+        background = background[..., np.newaxis]
+    pool = [(background + rng.integers(0, 32, size=shape)).astype(dtype) for _ in range(16)]
+    for cnt in range(nb_frames):
+        yield pool[cnt % len(pool)]
+
+
+def traces(nb_channels: int, nb_chunks: int, chunk_size: int, rate: float = 10_000) -> Iterator[np.ndarray]:
+    """Sines plus noise [chunk_size, nb_channels]."""
+    rng = np.random.default_rng(0)
+    t = np.arange(chunk_size)[:, np.newaxis] / rate
+    freqs = 100 * (1 + np.arange(nb_channels))[np.newaxis, :]
+    for cnt in range(nb_chunks):
+        yield np.sin(2 * np.pi * freqs * (t + cnt * chunk_size / rate)) + 0.01 * rng.standard_normal((chunk_size, nb_channels))
+
+
+def image_cases(quick: bool) -> Iterator[Dict[str, Any]]:
+    sizes = [(480, 640)] if quick else [(480, 640), (1024, 1280), (2048, 2048)]
+    channels = [1] if quick else [1, 3]
+    for size, nb_channels in itertools.product(sizes, channels):
+        shape = size if nb_channels == 1 else (*size, nb_channels)
+        for chunk_frames, complib in itertools.product([1, 10] if quick else [1, 10, 30], ["zlib", "blosc:zstd", "blosc:lz4"]):
+            yield {"writer": "saveimg_h5", "shape": shape, "params": {"chunk_frames": chunk_frames, "complib": complib}}
+        for chunk_frames, cname in itertools.product([10] if quick else [10, 30], ["zstd", "lz4"]):
+            yield {"writer": "saveimg_zarr", "shape": shape, "params": {"chunk_frames": chunk_frames, "cname": cname}}
+        for codec in ["libx264"] if quick else ["libx264", "mpeg4"]:
+            yield {"writer": "save_pyav", "shape": shape, "params": {"codec": codec}}
+    for increment in [100, 1000]:
+        yield {"writer": "save_timestamps", "shape": (2,), "params": {"increment": increment}}
+
+
+def trace_cases(quick: bool) -> Iterator[Dict[str, Any]]:
+    channels = [1, 16] if quick else [1, 8, 32, 64]
+    chunk_bytes = [1 << 16, 1 << 20] if quick else [1 << 16, 1 << 20, 1 << 23]
+    for nb_channels, nb_bytes in itertools.product(channels, chunk_bytes):
+        for complib in ["zlib", "blosc:zstd"]:
+            yield {"writer": "save_h5", "shape": (1000, nb_channels), "params": {"chunk_bytes": nb_bytes, "complib": complib}}
+        for cname in ["zstd", "lz4"]:
+            yield {"writer": "save_zarr", "shape": (1000, nb_channels), "params": {"chunk_bytes": nb_bytes, "cname": cname}}
+    yield {"writer": "savedlp_h5", "shape": (3, 4), "params": {}}
+
+
+def items(case: Dict[str, Any], nb_items: int) -> Iterator[Any]:
+    """Data as sent to the writer by the services."""
+    writer, shape = case["writer"], case["shape"]
+    if writer == "save_timestamps":
+        for cnt in range(nb_items):
+            yield 0, (1000.0 + cnt / 100, cnt / 100)
+    elif writer == "savedlp_h5":
+        nb_groups, nb_values = shape
+        for cnt in range(nb_items):
+            yield {f"group{grp}": {f"value{val}": float(cnt + val) for val in range(nb_values)} for grp in range(nb_groups)}, 1000.0 + cnt / 100
+    elif writer in ("save_h5", "save_zarr"):
+        for cnt, chunk in enumerate(traces(shape[1], nb_items, shape[0])):
+            yield chunk, 1000.0 + cnt / 10
+    else:
+        for cnt, frame in enumerate(frames(shape, nb_items)):
+            yield frame, (1000.0 + cnt / 100, cnt / 100)
+
+
+def _nbytes(data) -> int:
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, dict):
+        return sum(_nbytes(val) for val in data.values())
+    if isinstance(data, (tuple, list)):
+        return sum(_nbytes(val) for val in data)
+    return 8  # scalars
+
+
+def _size_on_disk(folder: str) -> int:
+    nb_bytes = 0
+    for root, _, files in os.walk(folder):
+        nb_bytes += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return nb_bytes
+
+
+def run_case(case: Dict[str, Any], nb_items: int, folder: str) -> Dict[str, Any]:
+    """Write `nb_items` with the case's writer and measure time and size."""
+    data = list(items(case, nb_items))  # generate before timing
+    case_folder = tempfile.mkdtemp(dir=folder)
+    writer = callbacks[case["writer"]](None, file_name=os.path.join(case_folder, "bench"), frame_rate=100, **case["params"])
+
+    start = time.perf_counter()
+    for item in data:
+        writer._loop(item)
+    writer._cleanup()
+    seconds = time.perf_counter() - start
+
+    nb_bytes_in = sum(_nbytes(item) for item in data)
+    nb_bytes_on_disk = _size_on_disk(case_folder)
+    shutil.rmtree(case_folder, ignore_errors=True)
+    return {
+        **case,
+        "shape": list(case["shape"]),
+        "nb_items": nb_items,
+        "seconds": seconds,
+        "items_per_second": nb_items / seconds,
+        "megabytes_per_second": nb_bytes_in / seconds / 1e6,
+        "bytes_in": nb_bytes_in,
+        "bytes_on_disk": nb_bytes_on_disk,
+        "compression_ratio": nb_bytes_in / nb_bytes_on_disk if nb_bytes_on_disk else None,
+    }
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    return json.dumps([result["writer"], list(result["shape"]), result["params"]], sort_keys=True)
+
+
+def machine() -> Dict[str, Any]:
+    import tables
+    import zarr
+
+    try:
+        import av
+
+        av_version = av.__version__
+    except ImportError:
+        av_version = None
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version,
+        "numpy": np.__version__,
+        "tables": tables.__version__,
+        "zarr": zarr.__version__,
+        "av": av_version,
+    }
+
+
+def compare(results: List[Dict[str, Any]], previous: List[Dict[str, Any]], tolerance: float) -> List[Dict[str, Any]]:
+    """Cases whose throughput dropped by more than `tolerance` (fraction) relative to `previous`."""
+    previous = {case_key(result): result for result in previous}
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is not None and result["items_per_second"] < (1 - tolerance) * before["items_per_second"]:
+            regressions.append({**result, "previous_items_per_second": before["items_per_second"]})
+    return regressions
+
+
+def main(
+    *,
+    output: str = "writers.json",
+    writers: Optional[List[str]] = None,
+    quick: bool = False,
+    nb_frames: int = 200,
+    nb_chunks: int = 600,
+    folder: Optional[str] = None,
+    compare_to: Optional[str] = None,
+    tolerance: float = 0.2,
+):
+    """Benchmark the writer callbacks.
+
+    Args:
+        output (str): JSON file for the results.
+        writers (Optional[List[str]]): Benchmark only these writers (friendly names, like `saveimg_h5`). Defaults to all.
+        quick (bool): Sweep fewer shapes, chunk sizes and codecs.
+        nb_frames (int): Images, timestamps or DLP rows written per case.
+        nb_chunks (int): Analog input chunks (of 1000 samples) written per case.
+        folder (Optional[str]): Folder for the written files - on the disk used for recording. Defaults to the system's temp folder.
+        compare_to (Optional[str]): Previous result file - cases that got slower by more than `tolerance` are listed.
+        tolerance (float): Relative drop in throughput counted as regression.
+    """
+    logging.basicConfig(level=logging.ERROR)
+    folder = tempfile.mkdtemp(prefix="etho_writers_", dir=folder)
+
+    results = []
+    for case in itertools.chain(image_cases(quick), trace_cases(quick)):
+        if writers is not None and case["writer"] not in writers:
+            continue
+        nb_items = nb_chunks if case["writer"] in ("save_h5", "save_zarr") else nb_frames
+        try:
+            result = run_case(case, nb_items, folder)
+        except Exception as e:  # missing codec or optional dependency
+            print(f"{case['writer']} {case['shape']} {case['params']}: failed ({e})")
+            continue
+        results.append(result)
+        print(
+            f"{result['writer']:<16} {str(tuple(result['shape'])):<18} {json.dumps(result['params']):<48}"
+            f" {result['items_per_second']:10.1f} items/s {result['megabytes_per_second']:8.1f} MB/s"
+            f" {result['bytes_on_disk'] / 1e6:8.1f} MB on disk"
+        )
+    shutil.rmtree(folder, ignore_errors=True)
+
+    report = {"date": datetime.now().isoformat(), "machine": machine(), "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}.")
+
+    if compare_to is not None:
+        with open(compare_to) as f:
+            previous = json.load(f)["results"]
+        regressions = compare(results, previous, tolerance)
+        for result in regressions:
+            print(
+                f"SLOWER: {result['writer']} {tuple(result['shape'])} {json.dumps(result['params'])}:"
+                f" {result['items_per_second']:1.1f} items/s, was {result['previous_items_per_second']:1.1f}"
+            )
+        if not regressions:
+            print(f"No case got slower by more than {100 * tolerance:g}%.")
+
+
+if __name__ == "__main__":
+    defopt.run(main)
@@ -0,0 +1,268 @@
+"""Benchmark of the camera pipeline with a synthetic camera."""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import psutil
+import rich
+from rich.table import Table
+
+from .services.resumable import ResumableGCM
+from .services.utils.stats import LogHistogram
+
+
+logger = logging.getLogger(__name__)
+
+
+def _folder_size(path: str, prefix: str) -> int:
+    """Bytes in files and folders in `path` whose name starts with `prefix`."""
+    nb_bytes = 0
+    for entry in os.scandir(path):
+        if not entry.name.startswith(prefix):
+            continue
+        if entry.is_file():
+            nb_bytes += entry.stat().st_size
+        else:
+            for root, _, files in os.walk(entry.path):
+                nb_bytes += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return nb_bytes
+
+
+def _histogram() -> LogHistogram:
+    return LogHistogram(1e-6, 1e2, buckets_per_decade=100)  # 2% resolution
+
+
+class StageTimer:
+    """Times the stages of the camera worker by wrapping the camera and the callbacks.
+
+    Stages are the interval between frames, the `send` of each callback, and the
+    delay from the frame timestamp until the frame was sent to all callbacks. Frames
+    sent while the run is stopped are not timed.
+    """
+
+    def __init__(self, service):
+        self._stopped = service._thread_stopper.is_set
+        self.stages = {"frame interval": _histogram(), "sent to all callbacks": _histogram()}
+        self.first_frame = None
+        self.last_frame = None
+        self._system_ts = None
+
+        get = service.c.get
+
+        def timed_get(*args, **kwargs):
+            out = get(*args, **kwargs)
+            now = time.perf_counter()
+            if self.last_frame is not None:
+                self.stages["frame interval"].add(now - self.last_frame)
+            else:
+                self.first_frame = now
+            self.last_frame = now
+            self._system_ts = out[2]
+            return out
+
+        service.c.get = timed_get
+        for cnt, (name, callback) in enumerate(zip(service.callback_names, service.callbacks)):
+            callback.send = self._timed_send(callback.send, f"send {name}", last=cnt == len(service.callbacks) - 1)
+
+    def _timed_send(self, send, stage, last):
+        self.stages[stage] = _histogram()
+
+        def timed_send(data, *args):
+            start = time.perf_counter()
+            send(data, *args)
+            if self._stopped():
+                return
+            self.stages[stage].add(time.perf_counter() - start)
+            if last:
+                self.stages["sent to all callbacks"].add(time.time() - self._system_ts)
+
+        return timed_send
+
+
+class ProcessSampler(threading.Thread):
+    """Samples CPU, memory and queue size of the camera and callback processes.
+
+    Args:
+        processes (Dict[str, int]): Process ids by name.
+        queues (Dict[str, Any]): Callback comms with `qsize` by name.
+        interval (float, optional): Sampling interval in seconds. Defaults to 0.5.
+    """
+
+    def __init__(self, processes: Dict[str, int], queues: Dict[str, Any], interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.processes = {name: psutil.Process(pid) for name, pid in processes.items()}
+        self.queues = queues
+        self.interval = interval
+        self.samples = {name: {"cpu": [], "rss": [], "queue": []} for name in self.processes}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        for process in self.processes.values():
+            process.cpu_percent()  # first call starts the measurement
+        while not self._stop_event.wait(self.interval):
+            for name, process in self.processes.items():
+                try:
+                    with process.oneshot():
+                        self.samples[name]["cpu"].append(process.cpu_percent())
+                        self.samples[name]["rss"].append(process.memory_info().rss)
+                except psutil.Error:  # process finished
+                    continue
+                if name in self.queues:
+                    try:
+                        self.samples[name]["queue"].append(self.queues[name].qsize())
+                    except (NotImplementedError, OSError, ValueError):  # macOS or closed queue
+                        pass
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        summary = {}
+        for name, samples in self.samples.items():
+            summary[name] = {
+                "pid": self.processes[name].pid,
+                "cpu_mean": sum(samples["cpu"]) / len(samples["cpu"]) if samples["cpu"] else None,
+                "cpu_max": max(samples["cpu"], default=None),
+                "rss_max": max(samples["rss"], default=None),
+                "queue_max": max(samples["queue"], default=None),
+            }
+        return summary
+
+
+def run(
+    *,
+    width: int = 640,
+    height: int = 480,
+    fps: float = 100.0,
+    duration: float = 10.0,
+    callbacks: Sequence[str] = ("save_avi",),
+    cam_type: str = "Synthetic",
+    save_folder: Optional[str] = None,
+    output: Optional[str] = None,
+    sample_interval: float = 0.5,
+    show: bool = True,
+) -> Dict[str, Any]:
+    """Run the camera with `callbacks` for `duration` seconds and report throughput and resource use.
+
+    Args:
+        width (int, optional): Frame width. Defaults to 640.
+        height (int, optional): Frame height. Defaults to 480.
+        fps (float, optional): Frame rate. Defaults to 100.0.
+        duration (float, optional): Acquisition time in seconds. Defaults to 10.0.
+        callbacks (Sequence[str], optional): Names of camera callbacks (with default parameters). Defaults to ("save_avi",).
+        cam_type (str, optional): Camera backend. Defaults to "Synthetic".
+        save_folder (str, optional): Folder for the files written by the callbacks - kept after the run.
+                                     Defaults to None (temporary folder, deleted after the run).
+        output (str, optional): JSON file for the results. Defaults to None (`bench_<callbacks>_<width>x<height>_<fps>fps.json`).
+        sample_interval (float, optional): Interval for sampling CPU and memory in seconds. Defaults to 0.5.
+        show (bool, optional): Print the results as tables. Defaults to True.
+
+    Returns:
+        Dict[str, Any]: Results, as saved to `output`.
+    """
+    callbacks = list(callbacks)
+    params = {
+        "cam_type": cam_type,
+        "cam_serialnumber": "bench",
+        "frame_width": width,
+        "frame_height": height,
+        "frame_rate": fps,
+        "shutter_speed": 1000,
+        "callbacks": {name: None for name in callbacks},
+        "telemetry_interval": 0,  # sampled by `ProcessSampler`, and the file would count as written
+    }
+    folder = save_folder if save_folder is not None else tempfile.mkdtemp(prefix="etho_bench_")
+    os.makedirs(folder, exist_ok=True)
+    savefilename = os.path.join(folder, "bench")
+
+    service = ResumableGCM(params).setup_hardware()
+    try:
+        service.prepare_run(savefilename, duration)
+        timer = StageTimer(service)
+        service.start()
+        processes = {"camera": os.getpid(), **{name: cb._process.pid for name, cb in zip(service.callback_names, service.callbacks)}}
+        queues = {name: cb._sender for name, cb in zip(service.callback_names, service.callbacks) if cb.comms == "queue"}
+        sampler = ProcessSampler(processes, queues, sample_interval)
+        sampler.start()
+
+        logger.info(f"Benchmarking {', '.join(callbacks)} at {width}x{height} and {fps:g} fps for {duration:g} seconds.")
+        time.sleep(duration)
+        acquisition_stop = time.perf_counter()
+        while service.state != "stopped":  # the run timer stops the run and waits for the callbacks to finish
+            time.sleep(0.05)
+        drain_seconds = time.perf_counter() - acquisition_stop
+        sampler.stop()
+    finally:
+        service.close()
+
+    nb_bytes = _folder_size(folder, "bench")
+    if save_folder is None:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    nb_frames = service.frameNumber
+    acquisition_time = timer.last_frame - timer.first_frame if nb_frames > 1 else 0
+    results = {
+        "config": {"width": width, "height": height, "fps": fps, "duration": duration, "callbacks": callbacks, "cam_type": cam_type},
+        "frames": nb_frames,
+        "fps": (nb_frames - 1) / acquisition_time if acquisition_time else None,
+        "dropped_frames": getattr(service.c, "dropped", None),
+        "drain_seconds": drain_seconds,
+        "bytes_written": nb_bytes,
+        "bytes_per_second": nb_bytes / (duration + drain_seconds),
+        "latency": {stage: histogram.summary() for stage, histogram in timer.stages.items()},
+        "processes": sampler.summary(),
+    }
+
+    if output is None:
+        output = f"bench_{'_'.join(callbacks)}_{width}x{height}_{fps:g}fps.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if show:
+        print_results(results)
+        rich.print(f"Saved results to {output}.")
+    return results
+
+
+def print_results(results: Dict[str, Any]):
+    """Print results of `run` as tables."""
+    summary = Table(title="Throughput")
+    summary.add_column("")
+    summary.add_column("", justify="right")
+    fps = results["fps"]
+    summary.add_row("frames", f"{results['frames']}")
+    summary.add_row("sustained fps", f"{fps:1.2f}" if fps is not None else "-")
+    summary.add_row("dropped frames", f"{results['dropped_frames']}")
+    summary.add_row("drain time after stop", f"{results['drain_seconds']:1.2f} s")
+    summary.add_row("written", f"{results['bytes_written'] / 1e6:1.1f} MB ({results['bytes_per_second'] / 1e6:1.1f} MB/s)")
+    rich.print(summary)
+
+    latency = Table(title="Latency [ms]")
+    latency.add_column("stage")
+    for column in ("p50", "p90", "p99", "max"):
+        latency.add_column(column, justify="right")
+    for stage, stats in results["latency"].items():
+        if stats["count"]:
+            latency.add_row(stage, *[f"{1000 * stats[column]:1.3f}" for column in ("p50", "p90", "p99", "max")])
+    rich.print(latency)
+
+    processes = Table(title="Processes")
+    for column in ("process", "pid", "cpu mean [%]", "cpu max [%]", "rss max [MB]", "queue max [frames]"):
+        processes.add_column(column, justify="left" if column == "process" else "right")
+    for name, stats in results["processes"].items():
+        processes.add_row(
+            name,
+            f"{stats['pid']}",
+            f"{stats['cpu_mean']:1.1f}" if stats["cpu_mean"] is not None else "-",
+            f"{stats['cpu_max']:1.1f}" if stats["cpu_max"] is not None else "-",
+            f"{stats['rss_max'] / 1e6:1.1f}" if stats["rss_max"] is not None else "-",
+            f"{stats['queue_max']}" if stats["queue_max"] is not None else "-",
+        )
+    rich.print(processes)
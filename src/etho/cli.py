@@ -7,7 +7,7 @@ from pathlib import Path
 import pandas as pd
 import rich
 import sys
-from typing import Optional
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +26,8 @@ def run(
     show_progress: bool = True,
     debug: bool = False,
     preview: bool = False,
+    profile: bool = False,
+    local: bool = False,
 ):
     """Starts an experiment from the CLI."""
     return client.client(
@@ -35,6 +37,8 @@ def run(
         show_progress=show_progress,
         debug=debug,
         preview=preview,
+        profile=profile,
+        local=local,
     )
 
 
@@ -46,6 +50,7 @@ def res_run(
     show_progress: bool = True,
     debug: bool = False,
     preview: bool = False,
+    profile: bool = False,
 ):
     """Starts a resumable DAQ/GCM experiment from the CLI."""
     from . import resumable
@@ -57,6 +62,7 @@ def res_run(
         show_progress=show_progress,
         debug=debug,
         preview=preview,
+        profile=profile,
     )
 
 
@@ -67,6 +73,40 @@ def res_gui(protocol_folder: Optional[str] = None, playlist_folder: Optional[str
     return res_app.main(protocol_folder=protocol_folder, playlist_folder=playlist_folder)
 
 
+def bench(
+    *,
+    width: int = 640,
+    height: int = 480,
+    fps: float = 100.0,
+    duration: float = 10.0,
+    callbacks: Optional[List[str]] = None,
+    save_folder: Optional[str] = None,
+    output: Optional[str] = None,
+):
+    """Benchmarks camera callbacks with a synthetic camera.
+
+    Args:
+        width (int): Frame width. Defaults to 640.
+        height (int): Frame height. Defaults to 480.
+        fps (float): Frame rate. Defaults to 100.
+        duration (float): Acquisition time in seconds. Defaults to 10.
+        callbacks (Optional[List[str]]): Camera callbacks, such as `save_avi save_timestamps`. Defaults to `save_avi`.
+        save_folder (Optional[str]): Keep the files written by the callbacks in this folder. Defaults to a temporary folder.
+        output (Optional[str]): JSON file for the results. Defaults to `bench_<callbacks>_<width>x<height>_<fps>fps.json`.
+    """
+    from . import bench as benchmark
+
+    return benchmark.run(
+        width=width,
+        height=height,
+        fps=fps,
+        duration=duration,
+        callbacks=callbacks or ["save_avi"],
+        save_folder=save_folder,
+        output=output,
+    )
+
+
 def govee(duration: float = 10.0):
     """Lists nearby Govee H5075 sensors and their protocol addresses/readings."""
     import asyncio
@@ -243,6 +283,7 @@ def main():
         "version": version,
         "init": init,
         "govee": govee,
+        "bench": bench,
     }
 
     if client is not None:
@@ -265,4 +306,5 @@ def main():
         subcommands["res-gui"] = no_gui
 
     logging.basicConfig(level=logging.INFO, force=True)
-    defopt.run(subcommands, show_defaults=False)
+    # explicit short flags - `--profile` would take `-p` from `--preview` otherwise
+    defopt.run(subcommands, short={"debug": "d", "preview": "p"}, show_defaults=False)
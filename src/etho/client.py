@@ -1,33 +1,26 @@
+import os
 import time
 import logging
 from rich.progress import Progress
 import rich
 import threading
-import _thread as thread
 import queue
 from typing import Optional, Union, Dict, Any
 import psutil
 
-from .utils.tui import rich_information
+from .utils.tui import callback_health, rich_information
+from .utils import profiling
+from .services.utils.progress import ProgressSubscriber
+from .services.utils.readiness import wait_armed
 
 from . import config
 from . import services as service_module
 from .utils.config import defaultify, readconfig
 
 
-def timed(fn, s, *args, **kwargs):
-    quit_fun = thread.interrupt_main  # raises KeyboardInterrupt
-    timer = threading.Timer(s, quit_fun)
-    timer.start()
-    try:
-        result = fn(*args, **kwargs)
-    except:  # catch KeyboardInterrupt for silent timeouts
-        result = 1
-    finally:
-        timer.cancel()
-    return result
-
-
+PROGRESS_TIMEOUT = 5  # seconds without progress until the display of a service stops
+
+
 def kill_child_processes():
     try:
         parent = psutil.Process()
@@ -52,17 +45,28 @@ def _reject_remote_host_blocks(prot: Dict[str, Any]) -> None:
         raise ValueError(f"Remote service hosts are no longer supported. Remove the 'host' block from: {services}.")
 
 
-def _setup_services(prot, defaults, playlistfile, save_prefix, preview, new_console):
-    services = {}
-    service_classes = {}
+def _service_indices(prot):
+    """Yield the name, class and index among services of the same type for each service in the protocol."""
     service_counts = {}
-
     for service_name in prot["use_services"]:
         service_class = service_module.service_class_for(service_name)
         service_type = service_class.SERVICE_NAME
         service_index = service_counts.get(service_type, 0)
         service_counts[service_type] = service_index + 1
+        yield service_name, service_class, service_index
 
+
+def _setup_services(prot, defaults, playlistfile, save_prefix, preview, new_console):
+    services = {}
+    service_classes = {}
+
+    if not preview:  # launch all server processes first so they start up in parallel
+        for service_name, service_class, service_index in _service_indices(prot):
+            launch_client = getattr(service_class, "launch_client", None)
+            if launch_client is not None:
+                launch_client(service_name, service_index, prot, defaults, new_console)
+
+    for service_name, service_class, service_index in _service_indices(prot):
         service = service_class.setup_client(
             service_name,
             service_index,
@@ -82,32 +86,37 @@ def _setup_services(prot, defaults, playlistfile, save_prefix, preview, new_cons
     return services, service_classes
 
 
+def _publish_progress(services, prot=None, host: str = "localhost") -> Dict[str, str]:
+    """Let the services publish their progress every `progress_interval` seconds - returns the addresses by service name."""
+    addresses = {}
+    for service_name, service in services.items():
+        params = (prot or {}).get(service_name, {})
+        interval = params.get("progress_interval", 1) if isinstance(params, dict) else 1
+        port = service.publish_progress(service_name, interval)
+        addresses[service_name] = f"tcp://{host}:{port}"
+    return addresses
+
+
 def _start_services(services, service_classes):
     logging.info("Starting services")
 
     start_groups = {service_name: getattr(service_classes[service_name], "CLIENT_START_GROUP", "pre") for service_name in services}
     started_groups = set()
-    time_last_prereq_started = time.time()
 
     def start_group(group):
-        nonlocal time_last_prereq_started
         started_groups.add(group)
+        started = {}
         for service_name, service in services.items():
             if start_groups[service_name] != group:
                 continue
             logging.info(f"   {service_name}.")
             service.start()
-            if group in {"pre", "trigger"}:
-                time_last_prereq_started = time.time()
-
-    start_group("pre")
-    time.sleep(0.5)
-    start_group("trigger")
+            started[service_name] = service
+        return started
 
-    if "daq" in start_groups.values():
-        wait_remaining = 5 - (time.time() - time_last_prereq_started)
-        if wait_remaining > 0:
-            time.sleep(wait_remaining)
+    # each group starts once the hardware of the previous group is armed
+    wait_armed(start_group("pre"))
+    wait_armed(start_group("trigger"))
     start_group("daq")
 
     for group in start_groups.values():
@@ -127,6 +136,8 @@ def client(
     monitor: bool = False,
     debug: bool = False,
     preview: bool = False,
+    profile: bool = False,
+    local: bool = False,
     _stop_event: Optional[threading.Event] = None,
     _done_event: Optional[threading.Event] = None,
     _queue: Optional[queue.Queue] = None,
@@ -142,6 +153,8 @@ def client(
         monitor (bool): Keep the run in the progress/cleanup loop even when the progress display is hidden.
         debug (bool): More verbose logs.
         preview (bool): Preview the camera (will disable saving and logging and only open a window with the camera view).
+        profile (bool): Sample the stacks of all service and callback processes and save the profiles to the run folder (see `etho.utils.profiling`).
+        local (bool): Run the services in this process and call them directly instead of over RPC. Services with `local: false` in the protocol still run in their own process.
         _stop_event (threading.Event, optional): Used to stop the task from an outside thread. Defaults to None.
         _done_event (threading.Event, optional): Set to signal that the task is done/stopped to an outside thread. Defaults to None.
         _queue (queue.Queue, optional): Signal the expected duration of the task to outside funs. Defaults to None.
@@ -153,13 +166,15 @@ def client(
     else:
         prot = readconfig(protocolfile)
     logging.debug(prot)
-    defaults = config
+    defaults = config.copy()
     if defaults["host"] is None:
         defaults["host"] = "localhost"
     if defaults["python_exe"] is None:
         defaults["python_exe"] = "python"
     if defaults["serializer"] is None:
         defaults["serializer"] = "pickle"
+    if local:
+        defaults["local"] = True
     _reject_remote_host_blocks(prot)
 
     rich.print(defaults)
@@ -170,6 +185,11 @@ def client(
 
     new_console = debug
 
+    if profile:
+        run_folder = os.path.join(defaults["savefolder"], save_prefix)
+        profiling.enable(os.path.join(run_folder, "profile"))  # inherited by the service processes
+        profiling.start("head")
+
     services, service_classes = _setup_services(prot, defaults, playlistfile, save_prefix, preview, new_console)
 
     # display config info
@@ -184,7 +204,12 @@ def client(
             total = max(total, service.progress()["total"])
         if _queue is not None:
             _queue.put(total)
-        cli_progress(services, save_prefix, _stop_event, _done_event, show_progress=show_progress)
+        progress_addresses = _publish_progress(services, prot, defaults["host"])
+        try:
+            cli_progress(services, save_prefix, _stop_event, _done_event, show_progress=show_progress, progress_addresses=progress_addresses)
+        finally:
+            if profile:
+                profiling.finish(os.path.join(run_folder, f"{save_prefix}_profile.collapsed"))
     else:
         return services
 
@@ -195,6 +220,7 @@ def cli_progress(
     stop_event: Optional[threading.Event] = None,
     done_event: Optional[threading.Event] = None,
     show_progress: bool = True,
+    progress_addresses: Optional[Dict[str, str]] = None,
 ):
     """_summary_
 
@@ -203,29 +229,41 @@ def cli_progress(
         save_prefix (_type_): Name of the expt.
         stop_event (_type_, optional): Used to stop the task from an outside thread. Defaults to None.
         done_event (_type_, optional): Set to signal that the task is done/stopped to an outside thread. Defaults to None.
+        show_progress (bool, optional): Show a progress bar. Defaults to True.
+        progress_addresses (Dict[str, str], optional): Addresses of the progress publishers of the services by name.
+                                                       Defaults to None (services publish every second).
     """
     STOPPED_PREMATURELY = False
+    if progress_addresses is None:
+        progress_addresses = _publish_progress(services)
+    subscriber = ProgressSubscriber(progress_addresses)
     try:
         with Progress(disable=not show_progress) as progress:
             tasks = {}
             for service_name, service in services.items():
                 tasks[service_name] = progress.add_task(f"[red]{service_name}", total=service.progress()["total"])
             RUN = True
+            latest = subscriber.receive(timeout=1)
             while RUN and not progress.finished:
                 for task_name, task_id in tasks.items():
                     if stop_event is not None and stop_event.is_set():
                         break
                     if progress._tasks[task_id].finished:
                         continue
-                    try:
-                        p = timed(services[task_name].progress, 5)
-                        description = None
-                        if "framenumber" in p:
-                            description = f"{task_name} {p['framenumber_delta'] / p['elapsed_delta']: 7.2f} fps"
-                        progress.update(task_id, completed=p["elapsed"], description=description)
-                    except:  # if call times out, stop progress display - this will stop the display whenever a task times out - not necessarily when a task is done
+                    if subscriber.silent(task_name) > PROGRESS_TIMEOUT:
+                        # stop the display of services that stopped publishing - not necessarily because they are done
                         progress.stop_task(task_id)
-                time.sleep(1)
+                        continue
+                    p = latest.get(task_name)
+                    if p is None:
+                        continue
+                    description = None
+                    if "framenumber" in p and p["elapsed_delta"]:
+                        description = f"{task_name} {p['framenumber_delta'] / p['elapsed_delta']: 7.2f} fps"
+                    if p.get("callbacks"):
+                        description = f"{description or task_name} {callback_health(p['callbacks'])}"
+                    progress.update(task_id, completed=p["elapsed"], description=description)
+                latest = subscriber.receive(timeout=1)
 
                 if stop_event is not None and stop_event.is_set():
                     logging.info("Received STOP signal. Cancelling jobs:")
@@ -247,6 +285,7 @@ def cli_progress(
 
         time.sleep(4)
     finally:
+        subscriber.close()
         logging.info("Cleaning up jobs.")
         kill_child_processes()
         if done_event is not None:
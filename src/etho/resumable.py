@@ -10,9 +10,12 @@ from rich.progress import Progress
 from . import config
 from .services import service_base_name
 from .services.resumable import ResumableDAQ, ResumableGCM
-from .utils.tui import rich_information
+from .services.utils.progress import ProgressSubscriber
+from .services.utils.readiness import wait_armed
+from .utils import profiling
+from .utils.tui import callback_health, rich_information
 from .utils.config import defaultify, readconfig
-from .utils.sound import build_playlist, load_sounds, parse_table
+from .utils.sound import PlaylistArray, build_playlist, load_sounds, parse_table
 
 
 logger = logging.getLogger(__name__)
@@ -38,6 +41,7 @@ def _playlist_cache_key(protocol, playlistfile):
         daq_params["samplingrate"],
         str(config["stimfolder"]),
         repr(attenuation),
+        str(daq_params.get("stimulus_dtype") or np.float64),
     )
 
 
@@ -48,6 +52,7 @@ def playlist_arrays(protocol, playlistfile, cache=None):
 
     daq_params = protocol[daq_name]
     fs = daq_params["samplingrate"]
+    dtype = daq_params.get("stimulus_dtype") or np.float64
     cache_key = _playlist_cache_key(protocol, playlistfile)
     if cache is not None and cache_key in cache:
         playlist, sounds = cache[cache_key]
@@ -55,17 +60,32 @@ def playlist_arrays(protocol, playlistfile, cache=None):
     else:
         playlist = parse_table(playlistfile)
         attenuation = _attenuation_for_host()
-        sounds = load_sounds(playlist, fs, attenuation=attenuation, stimfolder=config["stimfolder"])
-        sounds = [sound.astype(np.float64) for sound in sounds]
+        sounds = load_sounds(
+            playlist,
+            fs,
+            attenuation=attenuation,
+            stimfolder=config["stimfolder"],
+            cache_dir=config["stimcachefolder"],
+            cache_size=config["stimcachesize"],
+            dtype=dtype,
+        )
         if cache is not None:
             cache[cache_key] = (playlist, sounds)
-    playlist_items, duration = build_playlist(sounds, protocol["maxduration"], fs, shuffle=daq_params["shuffle"])
-    data = np.concatenate([sounds[item] for item in playlist_items], axis=0)
+    playlist_items, duration = build_playlist(
+        sounds,
+        protocol["maxduration"],
+        fs,
+        shuffle=daq_params["shuffle"],
+        seed=daq_params.get("shuffle_seed"),
+    )
 
+    # do not concatenate the session - the DAQ streams the stimuli in play order
     nb_digital = len(daq_params["digital_chans_out"] or [])
     if nb_digital:
-        return data[:, :-nb_digital], data[:, -nb_digital:].astype(np.uint8), duration
-    return data, None, duration
+        analog = PlaylistArray(sounds, playlist_items, columns=slice(None, -nb_digital), dtype=dtype)
+        digital = PlaylistArray(sounds, playlist_items, columns=slice(-nb_digital, None), dtype=np.uint8)
+        return analog, digital, duration
+    return PlaylistArray(sounds, playlist_items, dtype=dtype), None, duration
 
 
 class ResumableExperimentRunner:
@@ -188,10 +208,10 @@ class ResumableExperimentRunner:
 
     def start(self):
         logger.info("Starting resumable experiment.")
-        for service in self.services.values():
-            if isinstance(service, ResumableGCM):
-                service.start()
-        time.sleep(0.5)
+        cameras = {name: service for name, service in self.services.items() if isinstance(service, ResumableGCM)}
+        for service in cameras.values():
+            service.start()
+        wait_armed(cameras)  # cameras acquire before the DAQ starts
         for service in self.services.values():
             if isinstance(service, ResumableDAQ) and getattr(service, "state", "prepared") == "prepared":
                 service.start()
@@ -229,18 +249,31 @@ class ResumableExperimentRunner:
                 service_progress = service.progress()
                 if service_progress["total"]:
                     tasks[service_name] = progress.add_task(f"[red]{service_name}", total=service_progress["total"])
-            while tasks and not progress.finished:
-                if stop_event is not None and stop_event.is_set():
-                    break
-                for task_name, task_id in tasks.items():
-                    if progress._tasks[task_id].finished:
-                        continue
-                    p = self.services[task_name].progress()
-                    description = None
-                    if "framenumber" in p and p["elapsed_delta"]:
-                        description = f"{task_name} {p['framenumber_delta'] / p['elapsed_delta']: 7.2f} fps"
-                    progress.update(task_id, completed=p["elapsed"], description=description)
-                time.sleep(1)
+            addresses = {}
+            for service_name in tasks:
+                service = self.services[service_name]
+                port = service.publish_progress(service_name, service.params.get("progress_interval", 1))
+                addresses[service_name] = f"tcp://127.0.0.1:{port}"
+            subscriber = ProgressSubscriber(addresses)
+            try:
+                while tasks and not progress.finished:
+                    if stop_event is not None and stop_event.is_set():
+                        break
+                    latest = subscriber.receive(timeout=1)
+                    for task_name, task_id in tasks.items():
+                        p = latest.get(task_name)
+                        if p is None or progress._tasks[task_id].finished:
+                            continue
+                        description = None
+                        if "framenumber" in p and p["elapsed_delta"]:
+                            description = f"{task_name} {p['framenumber_delta'] / p['elapsed_delta']: 7.2f} fps"
+                        if p.get("callbacks"):
+                            description = f"{description or task_name} {callback_health(p['callbacks'])}"
+                        progress.update(task_id, completed=p["elapsed"], description=description)
+            finally:
+                subscriber.close()
+                for service_name in addresses:
+                    self.services[service_name].stop_publishing()
 
 
 def _wait_for_run(runner, duration, show_progress=True):
@@ -255,9 +288,16 @@ def run(
     show_progress=True,
     debug=False,
     preview=False,
+    profile=False,
 ):
     if debug:
         logging.getLogger().setLevel(logging.DEBUG)
+    if profile:  # the services run in this process, the callbacks in processes started by `prepare_run`
+        if save_prefix is None:
+            save_prefix = f"{config['host'] or 'localhost'}-{time.strftime('%Y%m%d_%H%M%S')}"
+        run_folder = Path(config["savefolder"] or ".") / save_prefix
+        profiling.enable(run_folder / "profile")
+        profiling.start("head")
     runner = ResumableExperimentRunner(protocolfile=protocolfile, save_prefix_root=save_prefix)
     try:
         runner.setup_hardware()
@@ -281,3 +321,5 @@ def run(
         return runner.stop_run()
     finally:
         runner.close()
+        if profile:
+            profiling.finish(run_folder / f"{save_prefix}_profile.collapsed")
@@ -43,6 +43,7 @@ class BLT(BaseZeroService):
             this["python_exe"],
             new_console=new_console,
             port=prot[service_key]["port"],
+            local=this.get("local", False),
         )
 
         params = undefaultify(prot[service_key])
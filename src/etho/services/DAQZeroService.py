@@ -2,13 +2,23 @@ from .ZeroService import BaseZeroService
 import time
 import threading
 import sys
+import os
 from typing import Sequence, Optional, Dict, Any
 from . import register_service
 from .. import config as global_config
 from ..utils.config import undefaultify
 from ..utils.sound import parse_table, load_sounds, build_playlist
+from ..utils.stimcache import attach, stimulus_store
 from .utils.log_exceptions import for_all_methods, log_exceptions
 from .callbacks import callbacks
+from .callbacks._trace import EventDetector
+from .daq.autotune import autotune_chunk_size, autotune_metadata, callback_factory
+from .daq.closedloop import ClosedLoop
+from .daq.generators import data_playlist
+from .daq.virtual import VirtualIOTask
+from .utils.concurrent_task import callback_status
+from .utils.service_stats import DAQStatsMixin
+from .utils.telemetry import TelemetryRecorder, save_telemetry, task_pids
 import logging
 import numpy as np
 
@@ -20,10 +30,56 @@ try:
 except (ImportError, NameError, NotImplementedError) as daqmx_import_error:
     pass
 
+logger = logging.getLogger(__name__)
+
+# stimuli rendered by the last `DAQ.setup_client` call - reused by further DAQ services of the same protocol
+_rendered_stimuli: Dict[tuple, Any] = {}
+
+
+def _stimulus_files(playlist, stimfolder) -> tuple:
+    """Modification time and size of the stimulus files of the playlist - change when a file is edited."""
+    names = sorted({name for names in playlist.stimFileName for name in names if name.endswith((".wav", ".h5"))})
+    files = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(stimfolder, name))
+            files.append((name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            files.append((name, None, None))
+    return tuple(files)
+
+
+def _load_stimuli(playlistfile, fs, attenuation, dtype):
+    """Parse playlist and render stimuli, reusing the last result if neither the playlist nor its stimulus files changed."""
+    try:
+        mtime = os.stat(playlistfile).st_mtime_ns
+    except (OSError, TypeError):
+        mtime = None
+    stimfolder = global_config["stimfolder"]
+    playlist = parse_table(playlistfile)
+    key = (os.path.abspath(str(playlistfile)), mtime, fs, repr(attenuation), str(stimfolder), str(np.dtype(dtype)), _stimulus_files(playlist, stimfolder))
+    if mtime is not None and key in _rendered_stimuli:
+        logger.info(f"Reusing stimuli rendered for {playlistfile}.")
+        return _rendered_stimuli[key]
+
+    sounds = load_sounds(
+        playlist,
+        fs,
+        attenuation=attenuation,
+        stimfolder=stimfolder,
+        cache_dir=global_config["stimcachefolder"],
+        cache_size=global_config["stimcachesize"],
+        dtype=dtype,
+    )
+    _rendered_stimuli.clear()
+    if mtime is not None:
+        _rendered_stimuli[key] = playlist, sounds
+    return playlist, sounds
+
 
 @for_all_methods(log_exceptions(logging.getLogger(__name__)))
 @register_service
-class DAQ(BaseZeroService):
+class DAQ(DAQStatsMixin, BaseZeroService):
     """Bundles and synchronizes analog/digital input and output tasks."""
 
     LOGGING_PORT = 1449  # set this to range 1420-1460
@@ -52,16 +108,15 @@ class DAQ(BaseZeroService):
             attenuation = global_config["ATTENUATION"]
 
         fs = prot[service_key]["samplingrate"]
-        playlist = parse_table(playlistfile)
-        sounds = load_sounds(
-            playlist,
+        playlist, sounds = _load_stimuli(playlistfile, fs, attenuation, prot[service_key]["stimulus_dtype"] or np.float64)
+
+        playlist_items, totallen = build_playlist(
+            sounds,
+            prot["maxduration"],
             fs,
-            attenuation=attenuation,
-            stimfolder=global_config["stimfolder"],
+            shuffle=prot[service_key]["shuffle"],
+            seed=prot[service_key]["shuffle_seed"],
         )
-        sounds = [sound.astype(np.float64) for sound in sounds]
-
-        playlist_items, totallen = build_playlist(sounds, prot["maxduration"], fs, shuffle=prot[service_key]["shuffle"])
         if prot["maxduration"] == -1:
             logging.info(f"Setting maxduration from playlist to {totallen}.")
             prot["maxduration"] = totallen
@@ -73,12 +128,21 @@ class DAQ(BaseZeroService):
             digital_data = None
             analog_data = sounds
 
+        # pass stimuli as memory-mapped files so they are not pickled over RPC and services share memory
+        # in-process services get the arrays directly
+        if prot[service_key].get("share_stimuli", not this.get("local", False)):
+            store = stimulus_store(global_config["stimcachefolder"], global_config["stimcachesize"])
+            analog_data = store.share(analog_data)
+            if digital_data is not None:
+                digital_data = store.share(digital_data)
+
         service = cls.make(
             this["serializer"],
             this["host"],
             this["python_exe"],
             new_console=new_console,
             port=prot[service_key]["port"],
+            local=this.get("local", False),
         )
         save_suffix = f"_{service_index + 1}" if service_index > 0 else ""
         service.setup(
@@ -134,7 +198,8 @@ class DAQ(BaseZeroService):
             playlist_info ([type], optional): [description]. Defaults to None.
             duration (float, optional): [description]. Defaults to -1.
             fs (int, optional): [description]. Defaults to 10000.
-            nb_inputsamples_per_cycle ([type], optional): [description]. Defaults to None.
+            nb_inputsamples_per_cycle (int or str, optional): Samples per analog input chunk. "auto" picks the smallest chunk size
+                                                       the input callback can keep up with. Defaults to None (one second).
             clock_source (str, optional): None for AI-synced clock.
                                           Use 'OnboardClock' for boards that don't support this (USB-DAQ).
                                           Defaults to None.
@@ -151,8 +216,39 @@ class DAQ(BaseZeroService):
         """
         self.status = "initializing"
 
-        if daqmx_import_error is not None:
+        if dev_name.startswith("virtual"):
+            Task = VirtualIOTask
+        elif daqmx_import_error is not None:
             raise ImportError(daqmx_import_error)
+        else:
+            Task = IOTask
+
+        if params is None:
+            params = {}
+        closed_loop = params.get("closed_loop")
+        if closed_loop and digital_chans_out:  # before any task or process is started
+            raise ValueError("Closed loop does not support digital outputs.")
+
+        if nb_inputsamples_per_cycle == "auto" and analog_chans_in:
+            # calibrate before the output tasks are created - starting an input task triggers them
+            self.log.warning("Measuring input callback cost for choosing the chunk size.")
+            nb_inputsamples_per_cycle, costs = autotune_chunk_size(
+                lambda nb_samples: Task(
+                    dev_name=dev_name,
+                    cha_name=analog_chans_in,
+                    rate=fs,
+                    nb_inputsamples_per_cycle=nb_samples,
+                    clock_source=clock_source,
+                    logger=self.log,
+                ),
+                fs,
+                make_callbacks=callback_factory(
+                    params.get("callbacks"), {"file_name": savefilename, "nb_analog_chans_in": len(analog_chans_in), "attrs": {"rate": fs}}
+                ),
+                margin=params.get("autotune_margin", 4),
+                logger=self.log,
+            )
+            metadata = {**(metadata or {}), **autotune_metadata(nb_inputsamples_per_cycle, costs)}
 
         self._time_started = None
         self.duration = duration
@@ -170,25 +266,69 @@ class DAQ(BaseZeroService):
 
         self.digital_chans_out = digital_chans_out
 
+        # stimuli shared by the client as files
+        analog_data_out = attach(analog_data_out)
+        digital_data_out = attach(digital_data_out)
+
         # ANALOG OUTPUT
+        self.onset_log = None
+        self.closed_loop = None
         if self.analog_chans_out:
-            self.taskAO = IOTask(
-                dev_name=dev_name,
-                cha_name=self.analog_chans_out,
-                rate=fs,
-                clock_source=clock_source,
-                logger=self.log,
-            )
             if analog_data_out[0].shape[-1] is not len(self.analog_chans_out):
                 raise ValueError(f"Number of analog output channels ({len(self.analog_chans_out)}) does not match the number of channels in the sound files ({analog_data_out[0].shape[-1]}).")
-            self.taskAO.set_data_generator(data_playlist(analog_data_out, play_order, playlist_info, self.log, name="AO"))
-            if clock_source is None:
-                self.taskAO.CfgDigEdgeStartTrig("ai/StartTrigger", DAQmx_Val_Rising)
+            # log stimulus onsets in a background process to keep the output callback lean
+            if params.get("save_onsets", True) and self.savefilename is not None:
+                self.onset_log = callbacks["save_onsets_h5"].make_concurrent(
+                    task_kwargs={"file_name": self.savefilename, "attrs": {"rate": fs}}
+                )
+            # the output tasks are armed by the AI start trigger (or start immediately for `clock_source`) - see IOTask
+            if closed_loop:
+                # small buffer and frequent writes so triggered stimuli are output quickly
+                self.taskAO = Task(
+                    dev_name=dev_name,
+                    cha_name=self.analog_chans_out,
+                    rate=fs,
+                    clock_source=clock_source,
+                    logger=self.log,
+                    buffer_seconds=closed_loop.get("buffer_seconds", 0.02),
+                    refresh_seconds=closed_loop.get("refresh_seconds", 0.005),
+                )
+                detector_channels = closed_loop.get("channels", [0])
+                detector_params = ["threshold", "mode", "band", "btype", "order", "min_interval"]
+                self.closed_loop = ClosedLoop(
+                    analog_data_out,
+                    EventDetector(len(detector_channels), fs, **{key: closed_loop[key] for key in detector_params if key in closed_loop}),
+                    fs,
+                    block_size=self.taskAO.num_samples_per_event,
+                    prefill=self.taskAO.num_samples_per_chan,
+                    channels=detector_channels,
+                    stimulus_order=closed_loop.get("stimulus_order", play_order),
+                    onset_log=self.onset_log,
+                    logger=self.log,
+                )
+                self.taskAO.set_data_generator(self.closed_loop.output())
             else:
-                self.taskAO.DisableStartTrig()
+                self.taskAO = Task(
+                    dev_name=dev_name,
+                    cha_name=self.analog_chans_out,
+                    rate=fs,
+                    clock_source=clock_source,
+                    logger=self.log,
+                )
+                self.taskAO.set_data_generator(
+                    data_playlist(
+                        analog_data_out,
+                        play_order,
+                        playlist_info,
+                        self.log,
+                        name="AO",
+                        onset_log=self.onset_log,
+                        log_text=params.get("log_playlist", True),
+                    )
+                )
         # DIGITAL OUTPUT
         if self.digital_chans_out:
-            self.taskDO = IOTask(
+            self.taskDO = Task(
                 dev_name=dev_name,
                 cha_name=self.digital_chans_out,
                 rate=fs,
@@ -196,13 +336,9 @@ class DAQ(BaseZeroService):
                 logger=self.log,
             )
             self.taskDO.set_data_generator(data_playlist(digital_data_out, play_order, name="DO"))
-            if clock_source is None:
-                self.taskDO.CfgDigEdgeStartTrig("ai/StartTrigger", DAQmx_Val_Rising)
-            else:
-                self.taskDO.DisableStartTrig()
         # ANALOG INPUT
         if self.analog_chans_in:
-            self.taskAI = IOTask(
+            self.taskAI = Task(
                 dev_name=dev_name,
                 cha_name=self.analog_chans_in,
                 rate=fs,
@@ -212,6 +348,9 @@ class DAQ(BaseZeroService):
                 logger=self.log,
             )
             self.taskAI.data_rec = []
+            if self.closed_loop is not None:
+                # detect events before the callbacks are fed
+                self.taskAI.data_rec.append(self.closed_loop)
 
             self.callbacks = []
             if metadata is None:
@@ -231,6 +370,7 @@ class DAQ(BaseZeroService):
             }
 
             self.callbacks = []
+            self.callback_names = []
             if "callbacks" in params and params["callbacks"]:
                 for cb_name, cb_params in params["callbacks"].items():
                     if cb_params is not None:
@@ -239,6 +379,7 @@ class DAQ(BaseZeroService):
                         task_kwargs = common_task_kwargs
                     callback = callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs)
                     self.callbacks.append(callback)
+                    self.callback_names.append(cb_name)
                     self.taskAI.data_rec.append(callback)
 
         if self.duration > 0:  # if zero, will stop when nothing is to be outputted
@@ -256,6 +397,13 @@ class DAQ(BaseZeroService):
             "metadata": self.metadata,
         }
         self.info["playlist"] = self.playlist_info
+        if self.closed_loop is not None:
+            self.info["closed loop"] = closed_loop
+
+        self.telemetry = None
+        telemetry_interval = params.get("telemetry_interval", 1)
+        if telemetry_interval:
+            self.telemetry = TelemetryRecorder(lambda: self._telemetry(), lambda: task_pids(*self._callback_tasks()), telemetry_interval)
 
     def start(self):
         self.status = "running"
@@ -265,6 +413,9 @@ class DAQ(BaseZeroService):
         for task in self.taskAI.data_rec:
             task.start()
 
+        if self.onset_log is not None:
+            self.onset_log.start()
+
         # Arm the output tasks - won't start until the AI start is triggered
         if self.analog_chans_out:
             self.taskAO.StartTask()
@@ -275,6 +426,9 @@ class DAQ(BaseZeroService):
         # Start the AI task - generates AI start trigger and triggers the output tasks
         self.taskAI.StartTask()
 
+        if self.telemetry is not None:
+            self.telemetry.start()
+
         self.log.debug("started")
         if hasattr(self, "_thread_timer"):
             self.log.debug("duration {0} seconds".format(self.duration))
@@ -301,6 +455,10 @@ class DAQ(BaseZeroService):
         except InvalidTaskError as e:
             self.log.warning(e)
 
+        if self.savefilename is not None:
+            save_telemetry(getattr(self, "telemetry", None), self.savefilename + "_daq_telemetry.npz", self.log)
+        self.telemetry = None
+
         # close any files in the callbacks
         for callback in self.callbacks:
             try:
@@ -328,17 +486,38 @@ class DAQ(BaseZeroService):
             # print("\n   stoppedAO")
             self.taskAO.stop()
 
+        if getattr(self, "closed_loop", None) is not None:
+            self.info["closed loop"] = {**self.info["closed loop"], **self.closed_loop.summary()}
+            self.log.warning(f"   closed loop: {self.closed_loop.summary()}")
+
+        if getattr(self, "onset_log", None) is not None:
+            try:
+                self.onset_log.finish()
+                self.onset_log.close()
+            except Exception as e:
+                self.log.warning(e)
+
         if self.analog_chans_out:
             self.taskAO.ClearTask()
 
         if self.digital_chans_out:
             self.taskDO.ClearTask()
 
+        if self.savefilename is not None:
+            self._save_stats()
+
         self.log.warning("   stopped ")
         if stop_service:
             time.sleep(0.5)
             self.service_stop()
 
+    def progress(self):
+        p = super().progress()
+        if p is not None:
+            p["tasks"] = {name: stats.summary() for name, stats in self._task_stats().items()}
+            p["callbacks"] = callback_status(*self._callback_tasks())
+        return p
+
     def disp(self):
         pass
 
@@ -9,6 +9,9 @@ import logging
 from ..services import camera
 from ..utils.config import undefaultify
 from .callbacks import callbacks
+from .utils.concurrent_task import callback_status
+from .utils.service_stats import CameraStatsMixin
+from .utils.telemetry import TelemetryRecorder, save_telemetry, task_pids
 
 
 logger = logging.getLogger(__name__)
@@ -16,7 +19,7 @@ logger = logging.getLogger(__name__)
 
 @for_all_methods(log_exceptions(logger))
 @register_service
-class GCM(BaseZeroService):
+class GCM(CameraStatsMixin, BaseZeroService):
     LOGGING_PORT = 1446  # set this to range 1420-1460
     SERVICE_PORT = 4246  # last to digits match logging port - but start with "42" instead of "14"
     SERVICE_NAME = "GCM"  # short, uppercase, 3-letter ID of the service (equals class name)
@@ -36,6 +39,7 @@ class GCM(BaseZeroService):
             this["python_exe"],
             new_console=new_console,
             port=prot[service_key]["port"],
+            local=this.get("local", False),
         )
 
         params = undefaultify(prot[service_key])
@@ -131,6 +135,8 @@ class GCM(BaseZeroService):
             "frame_width": self.frame_width,
         }
 
+        trace_every = params.get("trace_every", 0)
+        concurrent_kwargs = {"trace_every": trace_every} if trace_every else {}
         if "callbacks" in params and params["callbacks"]:
             for cb_name, cb_params in params["callbacks"].items():
                 if cb_params is not None:
@@ -138,7 +144,7 @@ class GCM(BaseZeroService):
                 else:
                     task_kwargs = common_task_kwargs
 
-                self.callbacks.append(callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs))
+                self.callbacks.append(callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs, **concurrent_kwargs))
                 self.callback_names.append(cb_name)
 
         # background jobs should be run and controlled via a thread
@@ -151,6 +157,12 @@ class GCM(BaseZeroService):
 
         # set up the worker thread
         self._worker_thread = threading.Thread(target=self._worker, args=(self._thread_stopper,))
+        self._camera_started = threading.Event()  # set by the worker once the camera acquires
+
+        self.telemetry = None
+        telemetry_interval = params.get("telemetry_interval", 1)
+        if telemetry_interval:
+            self.telemetry = TelemetryRecorder(self._telemetry, lambda: task_pids(self.callback_names, self.callbacks), telemetry_interval)
 
         iii = self.c.info_imaging()
         iii["exposure"] = f"{iii['exposure']:1.2f}ms"
@@ -182,12 +194,18 @@ class GCM(BaseZeroService):
 
         # background jobs should be run and controlled via a thread
         self._worker_thread.start()
+        if self.telemetry is not None:
+            self.telemetry.start()
         self.log.debug("started")
         if hasattr(self, "_thread_timer"):
             self.log.debug("duration {0} seconds".format(self.duration))
             self._thread_timer.start()
             self.log.debug("finish timer started")
 
+    def armed(self):
+        camera_started = getattr(self, "_camera_started", None)
+        return camera_started is not None and camera_started.is_set()
+
     def _worker(self, stop_event):
         RUN = True
         self.frameNumber = 0
@@ -195,6 +213,7 @@ class GCM(BaseZeroService):
         self.log.info("started worker")
         self.c.enable_gpio_strobe()
         self.c.start()
+        self._camera_started.set()
 
         while RUN:
             try:
@@ -203,13 +222,17 @@ class GCM(BaseZeroService):
                     raise ValueError("Image is None")
                 else:
                     image, image_ts, system_ts = out
+                acquired = time.perf_counter()
 
                 for callback_name, callback in zip(self.callback_names, self.callbacks):
                     if "timestamps" in callback_name:
                         package = (0, (system_ts, image_ts))
                     else:
                         package = (image, (system_ts, image_ts))
-                    callback.send(package)
+                    if getattr(callback, "trace", None) is None:  # custom callbacks may not trace
+                        callback.send(package)
+                    else:
+                        callback.send(package, acquired)
 
                 self.frameNumber += 1
                 if self.frameNumber == self.nFrames:
@@ -245,6 +268,11 @@ class GCM(BaseZeroService):
         for callback in self.callbacks:
             callback.finish()
 
+        # last sample after the callbacks processed the queued frames
+        if getattr(self, "savefilename", None) is not None:
+            save_telemetry(getattr(self, "telemetry", None), self.savefilename + "_gcm_telemetry.npz", self.log)
+        self.telemetry = None
+
         # callbacks clean up after themselves now so probably no need for this:
         for callback in self.callbacks:
             try:
@@ -252,6 +280,9 @@ class GCM(BaseZeroService):
             except Exception as e:
                 pass
 
+        if getattr(self, "savefilename", None) is not None:
+            self._save_latencies()
+
         self.finished = True
         self.log.warning("   stopped ")
         if stop_service:
@@ -269,8 +300,12 @@ class GCM(BaseZeroService):
                     "framenumber": fn,
                     "framenumber_delta": fn - self.prev_framenumber,
                     "framenumber_units": "frames",
+                    "callbacks": callback_status(self.callback_names, self.callbacks),
                 }
             )
+            latencies = self._latencies()
+            if latencies:
+                p["latency"] = {name: trace.summary() for name, trace in latencies.items()}
             self.prev_framenumber = fn
             return p
         except:
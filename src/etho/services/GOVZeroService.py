@@ -127,6 +127,7 @@ class GOV(BaseZeroService):
             this["python_exe"],
             new_console=new_console,
             port=prot[service_key]["port"],
+            local=this.get("local", False),
         )
         service.setup(prot[service_key]["address"], interval, prot["maxduration"] + 10)
         service.init_local_logger(f"{this['savefolder']}/{save_prefix}/{save_prefix}_{service_key.lower()}.log")
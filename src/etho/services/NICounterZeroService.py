@@ -42,6 +42,7 @@ class NIC(BaseZeroService):
             this["python_exe"],
             new_console=new_console,
             port=prot[service_key]["port"],
+            local=this.get("local", False),
         )
 
         params = undefaultify(prot[service_key])
@@ -42,6 +42,7 @@ class SIT(BaseZeroService):
             this["python_exe"],
             new_console=new_console,
             port=prot[service_key]["port"],
+            local=this.get("local", False),
         )
 
         params = undefaultify(prot[service_key])
@@ -94,7 +95,7 @@ class SIT(BaseZeroService):
         self.log.info("   success.")
 
     def start(self):
-        pass
+        self._time_started = time.time()  # the output task runs since `setup`
 
     def finish(self, stop_service=False):
         self.log.warning("stopping")
@@ -6,9 +6,15 @@ from zmq.log.handlers import PUBHandler
 import socket
 import time
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Set
 import psutil
 
+from ..utils import profiling
+from .utils.progress import ProgressPublisher
+
+
+_launched_servers: Set[str] = set()  # started by `launch`, not yet connected to by `make`
+
 
 class BaseZeroService(abc.ABC, zerorpc.Server):
     """Define abstract base class for all 0services.
@@ -39,27 +45,57 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
     SERVICE_NAME: Optional[str] = None
     CLIENT_START_GROUP = "pre"
 
-    def __init__(self, *args, serializer: str = "default", head_ip: str = "192.168.1.1", **kwargs):
+    def __init__(self, *args, serializer: str = "default", head_ip: str = "192.168.1.1", local: bool = False, **kwargs):
         """[summary]
 
         Args:
             serializer (str, optional): [description]. Defaults to 'default'.
             head_ip (str, optional): [description]. Defaults to '192.168.1.1'.
+            local (bool, optional): Service runs in the process of the head and is called directly, not over RPC.
+                                    Defaults to False.
             logging_port (int, optional): [description]. Defaults to None.
             service_port (int, optional): [description]. Defaults to None.
         """
+        self.local = local
         self._serializer = serializer
         ctx = zerorpc.Context()
         ctx.register_serializer(self._serializer)
         super(BaseZeroService, self).__init__(*args, **kwargs, heartbeat=120, context=ctx)
 
         self._init_network_logger(head_ip)
+        profiling.start(self.SERVICE_NAME or type(self).__name__)  # if the run is profiled
 
         self._time_started = None
         self.duration = None
         self.prev_elapsed = 0
         self.info: Dict[str, Any] = dict()
 
+    @classmethod
+    def _server_name(cls, serializer: str, python_exe: str, port: Optional[int]) -> str:
+        if port is None:
+            port = cls.SERVICE_PORT  # fall back to default port
+        return f"{python_exe} -m {cls.__module__} {serializer} {port}"
+
+    @classmethod
+    def launch(
+        cls,
+        serializer: str,
+        host: str = "localhost",
+        python_exe: str = "python",
+        port: Optional[int] = None,
+        new_console: bool = False,
+    ):
+        """Start the server process without waiting for it to come up - `make` with the same arguments connects to it.
+
+        Launching all servers before making the clients starts the services in parallel.
+        """
+        from ..utils.runner import Runner
+
+        server_name = cls._server_name(serializer, python_exe, port)
+        logging.debug(f"launching {cls.SERVICE_NAME}: {server_name}.")
+        Runner(host, python_exe=python_exe).run(server_name, new_console=new_console, disown=True)
+        _launched_servers.add(server_name)
+
     @classmethod
     def make(
         cls,
@@ -68,13 +104,32 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
         python_exe: str = "python",
         port: Optional[int] = None,
         new_console: bool = False,
+        local: bool = False,
     ):
+        """Start the service and connect to it.
+
+        Args:
+            serializer (str): ZeroRPC serializer.
+            host (str, optional): Host of the service. Defaults to "localhost".
+            python_exe (str, optional): Python executable for the service process. Defaults to "python".
+            port (Optional[int], optional): Port of the service. Defaults to None (`SERVICE_PORT`).
+            new_console (bool, optional): Start the service process in a new console. Defaults to False.
+            local (bool, optional): Create the service in this process and call it directly, without a service process
+                                    and RPC - arguments are passed without serialization. Defaults to False.
+
+        Returns:
+            ZeroClient or the service itself if `local`.
+        """
+        if local:
+            logging.debug(f"initializing {cls.SERVICE_NAME} in-process.")
+            return cls(serializer=serializer, local=True)
+
         from ..utils.zeroclient import ZeroClient  # only works on the head node
 
         if port is None:
             port = cls.SERVICE_PORT  # fall back to default port
-
-        server_name = f"{python_exe} -m {cls.__module__} {serializer} {port}"
+
+        server_name = cls._server_name(serializer, python_exe, port)
         logging.debug(f"initializing {cls.SERVICE_NAME} at port {port}.")
         service = ZeroClient(
             host,
@@ -82,15 +137,40 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
             serializer=serializer,
             python_exe=python_exe,
         )
-        logging.debug("   starting server:")
-        ret = service.start_server(server_name, warmup=1, new_console=new_console)
-        logging.debug(f'{"success" if ret else "FAILED"}.')
+        if server_name in _launched_servers:
+            _launched_servers.discard(server_name)
+            service.server_name = server_name
+            service.pid = service.sr.pid(query=server_name)
+        else:
+            logging.debug("   starting server:")
+            ret = service.start_server(server_name, warmup=0, new_console=new_console)
+            logging.debug(f'{"success" if ret else "FAILED"}.')
         logging.debug("   connecting to server:")
-
-        ret = service.connect("tcp://{0}:{1}".format(host, port))
-        logging.debug(f'{"success" if ret else "FAILED"}.')
+
+        service.connect("tcp://{0}:{1}".format(host, port))
+        ret = service.wait_ready()  # requests are queued until the server is up
+        logging.debug(f'{"success" if ret else "FAILED"}.')
         return service
 
+    @classmethod
+    def launch_client(cls, service_key, service_index, prot, defaults, new_console):
+        """Launch the server process for `setup_client`, so `etho.client` can start all services in parallel."""
+        this = defaults.copy()
+        this.update(prot[service_key])
+        if this.get("local"):
+            return
+
+        if prot[service_key].get("port") is None:
+            prot[service_key]["port"] = cls.SERVICE_PORT + service_index
+
+        cls.launch(
+            this["serializer"],
+            this["host"],
+            this["python_exe"],
+            new_console=new_console,
+            port=prot[service_key]["port"],
+        )
+
     @classmethod
     def setup_client(cls, *args, **kwargs):
         raise NotImplementedError(f"{cls.__name__} must implement setup_client() for etho.client.")
@@ -109,7 +189,10 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
         pub = ctx.socket(zmq.PUB)
         pub.connect("tcp://{0}:{1}".format(head_ip, self.LOGGING_PORT))
 
-        self.log = logging.getLogger((__name__))
+        if self.local:  # log files of in-process services should not mix
+            self.log = logging.getLogger(f"{__name__}.{self.SERVICE_NAME}-{id(self):x}")
+        else:
+            self.log = logging.getLogger((__name__))
         self.log.setLevel(log_level)
 
         # get host name or IP to append to message
@@ -208,10 +291,34 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
         except:
             pass
 
+    def publish_progress(self, name: str, interval: float = 1.0) -> int:
+        """Publish `progress()` every `interval` seconds - subscribe with `utils.progress.ProgressSubscriber`.
+
+        Args:
+            name (str): Name of the service in the protocol, sent with the progress.
+            interval (float, optional): Publishing interval in seconds. Defaults to 1.
+
+        Returns:
+            int: Port of the PUB socket.
+        """
+        if getattr(self, "_progress_publisher", None) is not None:
+            self._progress_publisher.stop()
+        self._progress_publisher = ProgressPublisher(name, self.progress, interval)
+        self._progress_publisher.start()
+        return self._progress_publisher.port
+
     def ping(self):
         self.log.info("pong")
         return "pong"
 
+    def armed(self) -> bool:
+        """Whether the hardware started by `start` runs or waits for its trigger.
+
+        The head starts the next group of services once all services of a group are armed.
+        Services whose hardware starts asynchronously override this.
+        """
+        return self._time_started is not None
+
     def service_start(self, ip_address: str = "tcp://0.0.0.0"):
         """Start service.
 
@@ -240,12 +347,18 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
         self.kill()
 
     def kill(self, include_children: bool = False):
+        if self.local:
+            self.log.debug("   in-process service - not killing the head")
+            return
         if include_children:
             self.kill_children()
         self.log.warning("   kill process {0}".format(self.pid))
+        profiling.stop()  # save the profiles - killing skips the exit handlers
         psutil.Process(self.pid).kill()
 
     def kill_children(self):
+        if self.local:  # children of the head are not ours
+            return
         try:
             parent = psutil.Process(self.pid)
         except psutil.NoSuchProcess:
@@ -272,6 +385,8 @@ class BaseZeroService(abc.ABC, zerorpc.Server):
             return None
 
     def __del__(self):
+        if getattr(self, "local", False):  # finished by the head - at exit, its resources may be gone already
+            return
         self.cleanup()
         self.stop()
         self._flush_loggers()
@@ -1,10 +1,16 @@
 import queue
 import time
-from ..utils.concurrent_task import ConcurrentTask
+from ..utils.concurrent_task import ConcurrentTask, TaskMetrics
 from . import register_callback
 from typing import Optional
 
 
+def _nbytes(data) -> int:
+    """Payload bytes of an item - items are `(payload, timestamps)` or the payload."""
+    payload = data[0] if isinstance(data, tuple) else data
+    return getattr(payload, "nbytes", 0)
+
+
 class BaseCallback:
     def __init__(self, data_source, poll_timeout: Optional[float] = None, rate: float = 0, **kwargs):
         """_summary_
@@ -40,6 +46,8 @@ class BaseCallback:
         self.RUN = False
 
     def _run(self):
+        # counters shared with the service - see `ConcurrentTask.status`
+        metrics = getattr(self.data_source, "metrics", None) or TaskMetrics()
         t1 = 0
         while self.RUN:
             t0 = time.time()
@@ -54,9 +62,18 @@ class BaseCallback:
                 continue
 
             if data is not None:
+                metrics.received()
                 if (t0 - t1) >= self.rate:
-                    self._loop(data)
+                    start = time.perf_counter()
+                    try:
+                        self._loop(data)
+                    except Exception as e:
+                        metrics.failed(e)
+                        raise
+                    metrics.processed(time.perf_counter() - start, _nbytes(data))
                     t1 = t0
+                else:
+                    metrics.dropped()
             else:
                 self.stop()
 
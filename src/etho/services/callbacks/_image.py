@@ -225,13 +225,14 @@ class ImageWriterPyAV(ImageCallback):
     FRIENDLY_NAME = "save_pyav"
     TIMESTAMPS_ONLY = False
 
-    def __init__(self, data_source, *, poll_timeout=0.01, **kwargs):
+    def __init__(self, data_source, *, poll_timeout=0.01, codec: str = "libx264", **kwargs):
         super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
 
         if av_import_error is not None:
             logger.exception("Could not import PyAV. Aborting!", exc_info=av_import_error)
             raise av_import_error
 
+        self.codec = codec
         self.container = None
 
     def _loop(self, data):
@@ -242,7 +243,7 @@ class ImageWriterPyAV(ImageCallback):
 
         if self.container is None:
             self.container = av.open(self.file_name + self.SUFFIX, "w")
-            self.stream = self.container.add_stream("libx264", rate=Fraction(str(self.frame_rate)))
+            self.stream = self.container.add_stream(self.codec, rate=Fraction(str(self.frame_rate)))
             self.stream.width = image.shape[1]
             self.stream.height = image.shape[0]
             self.stream.pix_fmt = "yuv420p"
@@ -532,27 +533,41 @@ class ImageWriterH5(BaseCallback):
     FRIENDLY_NAME = "saveimg_h5"
     SUFFIX = "_images.h5"
 
-    def __init__(self, data_source, *, file_name, attrs=None, poll_timeout=0.01, **kwargs):
+    def __init__(
+        self,
+        data_source,
+        *,
+        file_name,
+        attrs=None,
+        poll_timeout=0.01,
+        chunk_frames: int = 10,
+        complib: str = "zlib",
+        complevel: int = 4,
+        **kwargs,
+    ):
         super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
         self.file_name = file_name
         self.f = tables.open_file(self.file_name + self.SUFFIX, mode="w")
         self.vanilla: bool = True
         self.arrays = dict()
         self.attrs = attrs
+        self.chunk_frames = chunk_frames
+        self.complib = complib
+        self.complevel = complevel
 
     @classmethod
-    def make_concurrent(cls, task_kwargs, comms="queue"):
-        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
+    def make_concurrent(cls, task_kwargs, comms="queue", **kwargs):
+        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms, **kwargs)
 
     def _init_data(self, data, timestamp):
-        filters = tables.Filters(complevel=4, complib="zlib", fletcher32=True)
+        filters = tables.Filters(complevel=self.complevel, complib=self.complib, fletcher32=True)
 
         self.arrays["images"] = self.f.create_earray(
             self.f.root,
             "images",
             tables.Atom.from_dtype(data.dtype),
             shape=[0, *data.shape[1:]],
-            chunkshape=[10, *data.shape[1:]],
+            chunkshape=[self.chunk_frames, *data.shape[1:]],
             filters=filters,
         )
         if self.attrs is not None:
@@ -595,7 +610,18 @@ class ImageWriterZarr(BaseCallback):
     FRIENDLY_NAME = "saveimg_zarr"
     SUFFIX = "_images.zarr"
 
-    def __init__(self, data_source, *, file_name, attrs=None, poll_timeout=0.01, **kwargs):
+    def __init__(
+        self,
+        data_source,
+        *,
+        file_name,
+        attrs=None,
+        poll_timeout=0.01,
+        chunk_frames: int = 30,
+        cname: str = "zstd",
+        clevel: int = 3,
+        **kwargs,
+    ):
         super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
 
         if zarr_import_error is not None:
@@ -614,15 +640,18 @@ class ImageWriterZarr(BaseCallback):
             self._create_array = self.arrays.create_array
         self.vanilla: bool = True
         self.attrs = attrs
+        self.chunk_frames = chunk_frames
+        self.cname = cname
+        self.clevel = clevel
 
     @classmethod
-    def make_concurrent(cls, task_kwargs, comms="queue"):
-        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
+    def make_concurrent(cls, task_kwargs, comms="queue", **kwargs):
+        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms, **kwargs)
 
     def _init_data(self, data, timestamp):
-        compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE)
+        compressor = Blosc(cname=self.cname, clevel=self.clevel, shuffle=Blosc.BITSHUFFLE)
 
-        self._create_array("images", shape=(0, *data.shape[1:]), chunks=(30, *data.shape[1:]), dtype=data.dtype, compressor=compressor)
+        self._create_array("images", shape=(0, *data.shape[1:]), chunks=(self.chunk_frames, *data.shape[1:]), dtype=data.dtype, compressor=compressor)
 
         if self.attrs is not None:
             for key, val in self.attrs.items():
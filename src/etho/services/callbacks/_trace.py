@@ -1,7 +1,9 @@
 """Callbacks for processing time series."""
 
 import logging
+import time
 import numpy as np
+import scipy.signal
 
 from ..utils.concurrent_task import ConcurrentTask
 from ..utils.log_exceptions import for_all_methods, log_exceptions
@@ -33,17 +35,312 @@ except Exception as zarr_import_error:  # catch generic Exception to cover missi
 
 logger = logging.getLogger(__name__)
 
+CHUNK_BYTES = 1 << 20  # target size of the chunks written by `save_h5` and `save_zarr`
+INDEX_DTYPE = np.dtype([("sample_offset", np.int64), ("nb_samples", np.int64), ("systemtime", np.float64)])
 
-@for_all_methods(log_exceptions(logger))
-@register_callback
-class PlotMPL(BaseCallback):
-    FRIENDLY_NAME = "plot"
 
-    def __init__(self, data_source, *, poll_timeout=0.01, channels_to_plot: list, nb_samples: int = 10_000, **kwargs):
+def minmax_envelope(data: np.ndarray, bin_size: int) -> np.ndarray:
+    """Min and max of each bin of `bin_size` samples.
+
+    Args:
+        data (np.ndarray): [samples, channels]
+        bin_size (int): Number of samples per bin. The last bin may be shorter.
+
+    Returns:
+        np.ndarray: [2 * bins, channels] with min and max of each bin interleaved.
+    """
+    starts = np.arange(0, data.shape[0], bin_size)
+    envelope = np.empty((2 * len(starts), *data.shape[1:]), dtype=data.dtype)
+    envelope[0::2] = np.minimum.reduceat(data, starts, axis=0)
+    envelope[1::2] = np.maximum.reduceat(data, starts, axis=0)
+    return envelope
+
+
+def time_to_sample(index: np.ndarray, systemtime):
+    """Number of samples received up to `systemtime` - the first sample received after it.
+
+    Uses a binary search over the `index` of a file saved with `save_h5` or `save_zarr`.
+
+    Args:
+        index (np.ndarray): Index table, for instance `f.root.index.read()` (HDF5) or `group["index"][:]` (Zarr).
+        systemtime (float or np.ndarray): System time(s) in seconds.
+
+    Returns:
+        int or np.ndarray: Sample number(s).
+    """
+    row = np.searchsorted(index["systemtime"], systemtime, side="right") - 1
+    nb_received = np.append(index["sample_offset"] + index["nb_samples"], 0)  # row -1 -> 0
+    return nb_received[row]
+
+
+class ChunkBuffer:
+    """Collect chunks and their index rows until they fill `chunk_bytes`."""
+
+    def __init__(self, chunk_bytes: int = CHUNK_BYTES):
+        self.chunk_bytes = chunk_bytes
+        self.sample_offset = 0
+        self.chunks = []
+        self.rows = []
+        self.nb_bytes = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def chunk_rows(self, data: np.ndarray) -> int:
+        """Samples per storage chunk for data shaped like `data`."""
+        return max(1, self.chunk_bytes // max(1, data[:1].nbytes))
+
+    def push(self, data: np.ndarray, systemtime: float) -> bool:
+        """Add a chunk - returns True once the buffer is full."""
+        self.chunks.append(data)
+        self.rows.append((self.sample_offset, len(data), systemtime))
+        self.sample_offset += len(data)
+        self.nb_bytes += data.nbytes
+        return self.nb_bytes >= self.chunk_bytes
+
+    def pop(self):
+        """Return and clear the buffered samples and index rows."""
+        samples = self.chunks[0] if len(self.chunks) == 1 else np.concatenate(self.chunks)
+        index = np.array(self.rows, dtype=INDEX_DTYPE)
+        self.chunks = []
+        self.rows = []
+        self.nb_bytes = 0
+        return samples, index
+
+
+class EnvelopePreprocessor:
+    """Reduce DAQ chunks to the min/max envelope of the plotted channels before they are sent to the plot process."""
+
+    def __init__(self, channels, bin_size: int):
+        self.channels = list(channels)
+        self.bin_size = bin_size
+
+    def __call__(self, data):
+        data_to_plot, systemtime = data
+        return minmax_envelope(data_to_plot[:, self.channels], self.bin_size), systemtime
+
+
+class ScrollingHistory:
+    """Ring buffer with the most recent `nb_points` points of each channel, oldest first."""
+
+    def __init__(self, nb_points: int, nb_channels: int, dtype=np.float64):
+        self.data = np.zeros((nb_points, nb_channels), dtype=dtype)
+
+    def push(self, new: np.ndarray):
+        nb_new = min(new.shape[0], self.data.shape[0])
+        if nb_new == 0:
+            return
+        self.data[:-nb_new] = self.data[nb_new:]  # scroll
+        self.data[-nb_new:] = new[-nb_new:]
+
+
+class EventDetector:
+    """Filter consecutive chunks of a multi-channel trace and detect events.
+
+    Filter state and the last samples of each chunk are carried over so events
+    are detected as if the whole trace had been processed at once.
+
+    Args:
+        nb_channels (int): Number of channels.
+        rate (float): Sampling rate in Hz.
+        threshold (float or list): Detection threshold - scalar or one per channel.
+        mode (str, optional): "threshold" detects upward crossings of the filtered trace,
+                              "pulse" detects peaks of the rectified filtered trace above threshold.
+                              Defaults to "threshold".
+        band (float or list, optional): Cutoff(s) of the butterworth filter in Hz. Defaults to None (no filter).
+        btype (str, optional): Filter type ("bandpass", "highpass", "lowpass"). Defaults to "bandpass".
+        order (int, optional): Filter order. Defaults to 4.
+        min_interval (float, optional): Dead time after each event in seconds. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        nb_channels: int,
+        rate: float,
+        threshold,
+        mode: str = "threshold",
+        band=None,
+        btype: str = "bandpass",
+        order: int = 4,
+        min_interval: float = 0,
+    ):
+        if mode not in ("threshold", "pulse"):
+            raise ValueError(f'Unknown mode {mode} - allowed values are "threshold", "pulse"')
+        self.mode = mode
+        self.threshold = np.broadcast_to(np.asarray(threshold, dtype=np.float64), (nb_channels,)).copy()
+        self.min_interval = int(min_interval * rate)
+        self.sos = None
+        if band is not None:
+            self.sos = scipy.signal.butter(order, band, btype=btype, fs=rate, output="sos")
+            self.zi = np.zeros((self.sos.shape[0], 2, nb_channels))
+        # pulse detection needs one sample before and after each peak
+        self.tail = np.full((1 if self.mode == "threshold" else 2, nb_channels), -np.inf)
+        self.last_event = np.full(nb_channels, np.iinfo(np.int64).min // 2)
+        self.nb_samples = 0  # samples processed so far
+
+    def filter(self, x: np.ndarray) -> np.ndarray:
+        if self.sos is None:
+            return np.asarray(x, dtype=np.float64)
+        y, self.zi = scipy.signal.sosfilt(self.sos, x, axis=0, zi=self.zi)
+        return y
+
+    def __call__(self, x: np.ndarray):
+        """Process the next chunk.
+
+        Args:
+            x (np.ndarray): [samples, channels]
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: sample index (since the first chunk), channel, and amplitude of each event.
+        """
+        y = self.filter(x)
+        if self.mode == "pulse":
+            y = np.abs(y)
+        trace = np.concatenate((self.tail, y), axis=0)
+        above = trace > self.threshold
+        if self.mode == "threshold":
+            candidates = above[1:] & ~above[:-1]
+        else:
+            peak = trace[1:-1]
+            candidates = above[1:-1] & (peak > trace[:-2]) & (peak >= trace[2:])
+        positions, channels = np.nonzero(candidates)
+        positions = positions + 1  # index into trace
+        amplitudes = trace[positions, channels]
+        samples = self.nb_samples - len(self.tail) + positions
+
+        if self.min_interval > 0 and len(samples):
+            keep = np.zeros(len(samples), dtype=bool)
+            for cnt, (sample, channel) in enumerate(zip(samples, channels)):
+                if sample - self.last_event[channel] >= self.min_interval:
+                    self.last_event[channel] = sample
+                    keep[cnt] = True
+            samples, channels, amplitudes = samples[keep], channels[keep], amplitudes[keep]
+
+        self.tail = trace[-len(self.tail) :]
+        self.nb_samples += len(y)
+        return samples, channels, amplitudes
+
+
+class StreamingSTFT:
+    """Short-time power spectra of consecutive chunks of a multi-channel trace.
+
+    Samples that do not fill a complete frame are kept for the next chunk so the
+    frames are identical to those of the whole trace. All frames of a chunk are
+    transformed with a single FFT call.
+
+    Args:
+        nfft (int, optional): Frame length in samples. Defaults to 512.
+        hop (int, optional): Samples between frame starts. Defaults to None (nfft // 2).
+        window (str, optional): Window name for `scipy.signal.get_window`. Defaults to "hann".
+    """
+
+    def __init__(self, nfft: int = 512, hop: int = None, window: str = "hann"):
+        self.nfft = nfft
+        self.hop = hop if hop is not None else nfft // 2
+        self.window = scipy.signal.get_window(window, self.nfft)
+        self.buffer = None
+        self.offset = 0  # index of the first sample in the buffer
+
+    def freqs(self, rate: float) -> np.ndarray:
+        return np.fft.rfftfreq(self.nfft, 1 / rate)
+
+    def __call__(self, x: np.ndarray):
+        """Process the next chunk.
+
+        Args:
+            x (np.ndarray): [samples, channels]
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: first sample of each frame and power [frames, channels, freqs].
+        """
+        buffer = x if self.buffer is None else np.concatenate((self.buffer, x), axis=0)
+        nb_frames = max(0, (len(buffer) - self.nfft) // self.hop + 1)
+        if nb_frames:
+            frames = np.lib.stride_tricks.sliding_window_view(buffer, self.nfft, axis=0)[:: self.hop][:nb_frames]
+            power = np.abs(np.fft.rfft(frames * self.window, axis=-1)) ** 2
+        else:
+            power = np.empty((0, buffer.shape[1], self.nfft // 2 + 1))
+        starts = self.offset + self.hop * np.arange(nb_frames)
+        self.buffer = buffer[nb_frames * self.hop :].copy()
+        self.offset += nb_frames * self.hop
+        return starts, power
+
+
+class _TracePlot(BaseCallback):
+    """Base for plotting the min/max envelope of a scrolling history of DAQ traces.
+
+    The DAQ service reduces each chunk to the envelope at `bin_size` before sending it,
+    so the plot cost does not depend on the sampling rate.
+
+    Args:
+        channels_to_plot (list): Indices of the channels to plot.
+        history_seconds (float, optional): Seconds of history to show. Defaults to None (`nb_samples` samples).
+        nb_samples (int, optional): Samples of history to show if `history_seconds` is None. Defaults to 10_000.
+        width (int, optional): Horizontal resolution of the plot in points. Defaults to 1000.
+        redraw_interval (float, optional): Minimal interval between redraws in seconds. Defaults to 0.05.
+        bin_size (int, optional): Samples per envelope bin. Set by `make_concurrent`. Defaults to 1.
+        attrs (dict, optional): Needs the sampling "rate" for `history_seconds`.
+    """
+
+    def __init__(
+        self,
+        data_source,
+        *,
+        poll_timeout=0.01,
+        channels_to_plot: list,
+        nb_samples: int = 10_000,
+        history_seconds: float = None,
+        width: int = 1000,
+        redraw_interval: float = 0.05,
+        bin_size: int = 1,
+        attrs=None,
+        **kwargs,
+    ):
         super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
         self.channels_to_plot = channels_to_plot
         self.nb_channels = len(self.channels_to_plot)
-        self.nb_samples = nb_samples
+        self.bin_size = bin_size
+        self.redraw_interval = redraw_interval
+        self._last_draw = 0
+        nb_history = self.history_samples(nb_samples, history_seconds, attrs)
+        self.nb_points = 2 * int(np.ceil(nb_history / self.bin_size))
+        self.history = ScrollingHistory(self.nb_points, self.nb_channels)
+
+    @staticmethod
+    def history_samples(nb_samples, history_seconds, attrs):
+        if history_seconds is not None and attrs is not None and "rate" in attrs:
+            return int(history_seconds * attrs["rate"])
+        return nb_samples
+
+    @classmethod
+    def make_concurrent(cls, task_kwargs, comms="queue"):
+        nb_history = cls.history_samples(
+            task_kwargs.get("nb_samples", 10_000), task_kwargs.get("history_seconds"), task_kwargs.get("attrs")
+        )
+        bin_size = max(1, int(np.ceil(nb_history / task_kwargs.get("width", 1000))))
+        task_kwargs = {**task_kwargs, "bin_size": bin_size}
+        preprocess = EnvelopePreprocessor(task_kwargs["channels_to_plot"], bin_size)
+        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms, preprocess=preprocess)
+
+    def _loop(self, data):
+        envelope, timestamp = data
+        self.history.push(envelope)
+        now = time.time()
+        if now - self._last_draw >= self.redraw_interval:
+            self._draw()
+            self._last_draw = now
+
+    def _draw(self):
+        pass
+
+
+@for_all_methods(log_exceptions(logger))
+@register_callback
+class PlotMPL(_TracePlot):
+    FRIENDLY_NAME = "plot"
+
+    def __init__(self, data_source, *, poll_timeout=0.01, channels_to_plot: list, **kwargs):
+        super().__init__(data_source=data_source, poll_timeout=poll_timeout, channels_to_plot=channels_to_plot, **kwargs)
 
         import matplotlib
 
@@ -54,49 +351,41 @@ class PlotMPL(BaseCallback):
         self.fig = plt.figure()
         self.fig.canvas.set_window_title("traces: daq")
         self.ax = [self.fig.add_subplot(self.nb_channels, 1, channel + 1) for channel in range(self.nb_channels)]
-        plt.show(block=False)
-        plt.draw()
-        self.fig.canvas.start_event_loop(0.01)  # otherwise plot freezes after 3-4 iterations
-        self.bgrd = [self.fig.canvas.copy_from_bbox(this_ax.bbox) for this_ax in self.ax]
-        self.points = [ax.plot(np.arange(self.nb_samples), np.zeros((self.nb_samples, 1)), linewidth=0.4)[0] for ax in self.ax]  # init plot content
         [ax.set_ylim(-5, 5) for ax in self.ax]  # init plot content
-        [ax.set_xlim(0, self.nb_samples) for ax in self.ax]  # init plot content
+        [ax.set_xlim(0, self.nb_points) for ax in self.ax]  # init plot content
         for cnt, ax in enumerate(self.fig.get_axes()[::-1]):
             ax.label_outer()
             ax.spines["top"].set_visible(False)
             ax.spines["right"].set_visible(False)
         plt.show(block=False)
         plt.draw()
+        self.fig.canvas.start_event_loop(0.01)  # otherwise plot freezes after 3-4 iterations
+        self.bgrd = [self.fig.canvas.copy_from_bbox(this_ax.bbox) for this_ax in self.ax]
+        x = np.arange(self.nb_points)
+        self.points = [ax.plot(x, self.history.data[:, chn], linewidth=0.4, animated=True)[0] for chn, ax in enumerate(self.ax)]  # init plot content
 
-    def _loop(self, data):
-        data_to_plot, timestamp = data
-        self.nb_samples = data_to_plot.shape[0]
-        x = np.arange(self.nb_samples)
-        for ax, bgrd, points, chn in zip(self.ax, self.bgrd, self.points, self.channels_to_plot):
+    def _draw(self):
+        # update all axes and blit the figure once
+        for chn, (ax, bgrd, points) in enumerate(zip(self.ax, self.bgrd, self.points)):
             self.fig.canvas.restore_region(bgrd)  # restore background
-            points.set_data(x, data_to_plot[: self.nb_samples, chn])
+            points.set_ydata(self.history.data[:, chn])
             ax.draw_artist(points)  # redraw just the points
-            self.fig.canvas.blit(ax.bbox)  # fill in the axes rectangle
-        self.fig.canvas.draw()
+        self.fig.canvas.blit(self.fig.bbox)
         self.fig.canvas.flush_events()
 
 
 @for_all_methods(log_exceptions(logger))
 @register_callback
-class PlotPQG(BaseCallback):
+class PlotPQG(_TracePlot):
     FRIENDLY_NAME = "plot_fast"
 
-    def __init__(self, data_source, *, poll_timeout=0.01, channels_to_plot: list, nb_samples: int = 10_000, **kwargs):
-        super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
+    def __init__(self, data_source, *, poll_timeout=0.01, channels_to_plot: list, **kwargs):
+        super().__init__(data_source=data_source, poll_timeout=poll_timeout, channels_to_plot=channels_to_plot, **kwargs)
 
         if pyqtgraph_import_error is not None:
             logger.exception("Could not import pyqtgraph. Aborting!", exc_info=pyqtgraph_import_error)
             raise pyqtgraph_import_error
 
-        self.channels_to_plot = channels_to_plot
-        self.nb_channels = len(self.channels_to_plot)
-        self.nb_samples = nb_samples
-
         pg.setConfigOption("background", "w")
         pg.setConfigOption("leftButtonPan", False)
 
@@ -106,30 +395,209 @@ class PlotPQG(BaseCallback):
         self.win.resize(1000, min(100 * self.nb_channels, 1000))
         self.p = []
         for row in range(self.nb_channels):
-            w = self.win.addPlot(row=row, col=0, y=np.zeros((self.nb_samples,)))
-            w.setXRange(0, self.nb_samples, padding=0)
+            w = self.win.addPlot(row=row, col=0)
+            w.setXRange(0, self.nb_points, padding=0)
             w.setYRange(-5, 5)
             w.setMouseEnabled(x=False, y=False)
             w.enableAutoRange("xy", np.False_)
-            self.p.append(w.plot(pen="k"))
-        print(self.p)
+            self.p.append(w.plot(self.history.data[:, row], pen="k"))
         self.win.show()
         self.app.processEvents()
 
+    def _draw(self):
+        # update all curves, then repaint once
+        for chn, plot in enumerate(self.p):
+            plot.setData(self.history.data[:, chn])
+        self.app.processEvents()
+
+
+@for_all_methods(log_exceptions(logger))
+@register_callback
+class PlotSpectrogram(BaseCallback):
+    """Display a rolling spectrogram and optionally save it to `<prefix>_spec.h5`.
+
+    Args:
+        channels_to_plot (list, optional): Channels to display. Defaults to [0].
+        nfft (int, optional): FFT length in samples. Defaults to 512.
+        hop (int, optional): Samples between frames. Defaults to None (nfft // 2).
+        freq_range (list, optional): Lowest and highest frequency in Hz. Defaults to None (0 to nyquist).
+        history_seconds (float, optional): Seconds of history to show. Defaults to 10.
+        levels (list, optional): Color range in dB. Defaults to None (auto).
+        redraw_interval (float, optional): Minimal interval between redraws in seconds. Defaults to 0.1.
+        display (bool, optional): Show the spectrogram. Defaults to True.
+        save (bool, optional): Save the spectrogram. Defaults to False.
+        save_decimation (int, optional): Save the mean of every `save_decimation` frames. Defaults to 1.
+        attrs (dict): Needs the sampling "rate".
+    """
+
+    FRIENDLY_NAME = "plot_spectrogram"
+    SUFFIX = "_spec.h5"
+
+    def __init__(
+        self,
+        data_source,
+        *,
+        attrs,
+        file_name=None,
+        channels_to_plot: list = [0],
+        nfft: int = 512,
+        hop: int = None,
+        freq_range: list = None,
+        history_seconds: float = 10,
+        levels: list = None,
+        redraw_interval: float = 0.1,
+        display: bool = True,
+        save: bool = False,
+        save_decimation: int = 1,
+        poll_timeout=0.01,
+        **kwargs,
+    ):
+        super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
+        self.channels_to_plot = list(channels_to_plot)
+        self.nb_channels = len(self.channels_to_plot)
+        self.rate = attrs["rate"]
+        self.stft = StreamingSTFT(nfft, hop)
+        freqs = self.stft.freqs(self.rate)
+        if freq_range is None:
+            freq_range = [freqs[0], freqs[-1]]
+        first_bin = max(0, np.searchsorted(freqs, freq_range[0], side="right") - 1)
+        self.freq_bins = slice(first_bin, np.searchsorted(freqs, freq_range[1], side="right"))
+        self.freqs = freqs[self.freq_bins]
+        self.nb_freqs = len(self.freqs)
+        self.redraw_interval = redraw_interval
+        self._last_draw = 0
+
+        self.display = display
+        if self.display:
+            if pyqtgraph_import_error is not None:
+                logger.exception("Could not import pyqtgraph. Aborting!", exc_info=pyqtgraph_import_error)
+                raise pyqtgraph_import_error
+
+            nb_frames = int(np.ceil(history_seconds * self.rate / self.stft.hop))
+            self.history = ScrollingHistory(nb_frames, self.nb_channels * self.nb_freqs)
+            self.history.data[:] = np.nan
+
+            self.app = QtWidgets.QApplication([])
+            self.win = pg.GraphicsLayoutWidget(title="Spectrogram")
+            self.win.resize(1000, min(250 * self.nb_channels, 1000))
+            self.images = []
+            for row in range(self.nb_channels):
+                w = self.win.addPlot(row=row, col=0)
+                w.setMouseEnabled(x=False, y=False)
+                w.setLabel("left", "Frequency", units="Hz")
+                image = pg.ImageItem(axisOrder="col-major")
+                image.setColorMap(pg.colormap.get("viridis"))
+                image.setRect(pg.QtCore.QRectF(-history_seconds, self.freqs[0], history_seconds, self.freqs[-1] - self.freqs[0]))
+                w.addItem(image)
+                self.images.append(image)
+            self.levels = levels
+            self.win.show()
+            self.app.processEvents()
+
+        self.save = save
+        if self.save:
+            if tables_import_error is not None:
+                logger.exception("Could not import tables. Aborting!", exc_info=tables_import_error)
+                raise tables_import_error
+
+            self.save_decimation = save_decimation
+            self.file_name = file_name
+            self.f = tables.open_file(self.file_name + self.SUFFIX, mode="w")
+            filters = tables.Filters(complevel=4, complib="zlib", fletcher32=True)
+            self.spectrogram = self.f.create_earray(
+                self.f.root, "spectrogram", tables.Float32Atom(), shape=[0, self.nb_channels, self.nb_freqs], filters=filters
+            )
+            self.frame_samples = self.f.create_earray(self.f.root, "samples", tables.Int64Atom(), shape=[0], filters=filters)
+            for key, val in {
+                **attrs,
+                "freqs": self.freqs,
+                "channels": self.channels_to_plot,
+                "nfft": self.stft.nfft,
+                "hop": self.stft.hop,
+                "save_decimation": self.save_decimation,
+            }.items():
+                self.spectrogram.attrs[key] = val
+            self.unsaved_starts = np.empty((0,), dtype=np.int64)
+            self.unsaved_frames = np.empty((0, self.nb_channels, self.nb_freqs))
+
+    @classmethod
+    def make_concurrent(cls, task_kwargs, comms="queue"):
+        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
+
     def _loop(self, data):
-        data_to_plot, timestamp = data
-        for plot, chan in zip(self.p, self.channels_to_plot):
-            plot.setData(data_to_plot[:, chan])
+        data_to_plot, systemtime = data  # unpack
+        starts, power = self.stft(data_to_plot[:, self.channels_to_plot])
+        power = power[..., self.freq_bins]
+        if self.save:
+            self.unsaved_starts = np.concatenate((self.unsaved_starts, starts))
+            self.unsaved_frames = np.concatenate((self.unsaved_frames, power))
+            self._save_frames()
+        if self.display and len(power):
+            self.history.push(10 * np.log10(power.reshape(len(power), -1) + 1e-20))
+            now = time.time()
+            if now - self._last_draw >= self.redraw_interval:
+                self._draw()
+                self._last_draw = now
+
+    def _save_frames(self, flush=False):
+        nb_save = len(self.unsaved_frames)
+        if not flush:
+            nb_save -= nb_save % self.save_decimation
+        if nb_save:
+            groups = np.arange(0, nb_save, self.save_decimation)
+            frames = np.add.reduceat(self.unsaved_frames[:nb_save], groups, axis=0)
+            frames /= np.diff(np.append(groups, nb_save))[:, np.newaxis, np.newaxis]  # mean of each group
+            self.spectrogram.append(frames.astype(np.float32))
+            self.frame_samples.append(self.unsaved_starts[groups])
+            self.unsaved_starts = self.unsaved_starts[nb_save:]
+            self.unsaved_frames = self.unsaved_frames[nb_save:]
+
+    def _draw(self):
+        spectrogram = self.history.data.reshape(-1, self.nb_channels, self.nb_freqs)
+        for chn, image in enumerate(self.images):
+            if self.levels is None:
+                image.setImage(spectrogram[:, chn], autoLevels=True)
+            else:
+                image.setImage(spectrogram[:, chn], levels=self.levels)
         self.app.processEvents()
 
+    def _cleanup(self):
+        if self.save:
+            if self.f.isopen:
+                self._save_frames(flush=True)
+                self.f.flush()
+                self.f.close()
+            else:
+                logger.debug(f"{self.file_name} already closed.")
+        super()._cleanup()
+
 
 @for_all_methods(log_exceptions(logger))
 @register_callback
 class SaveHDF(BaseCallback):
+    """Save analog input to the `samples` array and the `index` table.
+
+    Chunks are buffered and written once they fill `chunk_bytes`. The `index` table
+    has one row per chunk with its first sample, number of samples and system time -
+    see `time_to_sample`. The `systemtime` and `samplenumber` arrays hold the system
+    time and number of samples of each chunk as before.
+    """
+
     FRIENDLY_NAME = "save_h5"
     SUFFIX = "_daq.h5"
 
-    def __init__(self, data_source, *, file_name, attrs=None, poll_timeout=0.01, **kwargs):
+    def __init__(
+        self,
+        data_source,
+        *,
+        file_name,
+        attrs=None,
+        poll_timeout=0.01,
+        chunk_bytes: int = CHUNK_BYTES,
+        complib: str = "zlib",
+        complevel: int = 4,
+        **kwargs,
+    ):
         super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
 
         if tables_import_error is not None:
@@ -140,66 +608,61 @@ class SaveHDF(BaseCallback):
         self.vanilla: bool = True
         self.arrays = dict()
         self.attrs = attrs
+        self.buffer = ChunkBuffer(chunk_bytes)
+        self.complib = complib
+        self.complevel = complevel
 
     @classmethod
     def make_concurrent(cls, task_kwargs, comms="queue"):
         return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
 
     def _init_data(self, data, systemtime):
-        filters = tables.Filters(complevel=4, complib="zlib", fletcher32=True)
+        filters = tables.Filters(complevel=self.complevel, complib=self.complib, fletcher32=True)
 
         self.arrays["samples"] = self.f.create_earray(
             self.f.root,
             "samples",
             tables.Atom.from_dtype(data.dtype),
             shape=[0, *data.shape[1:]],
-            chunkshape=[*data.shape],
+            chunkshape=[self.buffer.chunk_rows(data), *data.shape[1:]],
             filters=filters,
         )
         if self.attrs is not None:
             for key, val in self.attrs.items():
                 self.arrays["samples"].attrs[key] = val
 
-        self.arrays["systemtime"] = self.f.create_earray(
-            self.f.root,
-            "systemtime",
-            tables.Atom.from_dtype(np.array(systemtime).dtype),
-            shape=[0, 1],
-            chunkshape=[100, 1],
-            filters=filters,
-        )
-
-        samplenumber = self.f.root["samples"].shape[:1]
-        self.arrays["samplenumber"] = self.f.create_earray(
-            self.f.root,
-            "samplenumber",
-            tables.Atom.from_dtype(np.array([samplenumber])[:, np.newaxis].dtype),
-            shape=[0, 1],
-            chunkshape=[100, 1],
-            filters=filters,
-        )
-        # print([(k, v.shape) for k, v in self.arrays.items()])
-
-    def _append_data(self, data, systemtime):
-        # print(data.shape, self.arrays["samples"].shape, self.arrays["samplenumber"].shape)
-        self.arrays["samples"].append(data)
-
-        samplenumber = data.shape[:1]  # self.f.root['samples'].shape[:1]
-        self.arrays["samplenumber"].append(np.array([samplenumber]))
-
-        self.arrays["systemtime"].append(systemtime)
+        self.arrays["index"] = self.f.create_table(self.f.root, "index", description=INDEX_DTYPE, filters=filters)
+        # per-chunk system time and length as in files written before the `index` table
+        for name, dtype in (("systemtime", np.float64), ("samplenumber", np.int64)):
+            self.arrays[name] = self.f.create_earray(
+                self.f.root,
+                name,
+                tables.Atom.from_dtype(np.dtype(dtype)),
+                shape=[0, 1],
+                chunkshape=[100, 1],
+                filters=filters,
+            )
+
+    def _append_data(self):
+        samples, index = self.buffer.pop()
+        self.arrays["samples"].append(samples)
+        self.arrays["index"].append(index)
+        self.arrays["systemtime"].append(index["systemtime"][:, np.newaxis])
+        self.arrays["samplenumber"].append(index["nb_samples"][:, np.newaxis])
 
     def _loop(self, data):
         data_to_save, systemtime = data  # unpack
-        sn = np.array([systemtime])[:, np.newaxis]
         if self.vanilla:
-            self._init_data(data_to_save, sn)
+            self._init_data(data_to_save, systemtime)
             self.vanilla = False
-        self._append_data(data_to_save, sn)
+        if self.buffer.push(data_to_save, float(systemtime)):
+            self._append_data()
 
     def _cleanup(self):
         logger.warning("cleaning")
         if self.f.isopen:
+            if len(self.buffer):
+                self._append_data()
             self.f.flush()
             self.f.close()
         else:
@@ -209,10 +672,23 @@ class SaveHDF(BaseCallback):
 @for_all_methods(log_exceptions(logger))
 @register_callback
 class SaveZarr(BaseCallback):
+    """Save analog input to the `samples` array and the `index` table - see `SaveHDF`."""
+
     FRIENDLY_NAME = "save_zarr"
     SUFFIX = "_daq.zarr"
 
-    def __init__(self, data_source, *, file_name, attrs=None, poll_timeout=0.01, **kwargs):
+    def __init__(
+        self,
+        data_source,
+        *,
+        file_name,
+        attrs=None,
+        poll_timeout=0.01,
+        chunk_bytes: int = CHUNK_BYTES,
+        cname: str = "zstd",
+        clevel: int = 3,
+        **kwargs,
+    ):
         super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
 
         if zarr_import_error is not None:
@@ -233,51 +709,193 @@ class SaveZarr(BaseCallback):
         self.vanilla: bool = True
 
         self.attrs = attrs
+        self.buffer = ChunkBuffer(chunk_bytes)
+        self.cname = cname
+        self.clevel = clevel
 
     @classmethod
     def make_concurrent(cls, task_kwargs, comms="queue"):
         return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
 
     def _init_data(self, data, systemtime):
-        compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE)
+        compressor = Blosc(cname=self.cname, clevel=self.clevel, shuffle=Blosc.BITSHUFFLE)
 
-        self._create_array("samples", shape=(0, *data.shape[1:]), chunks=data.shape, dtype=data.dtype, compressor=compressor)
+        chunks = (self.buffer.chunk_rows(data), *data.shape[1:])
+        self._create_array("samples", shape=(0, *data.shape[1:]), chunks=chunks, dtype=data.dtype, compressor=compressor)
 
         if self.attrs is not None:
             for key, val in self.attrs.items():
                 self.arrays["samples"].attrs[key] = val
 
-        self._create_array("systemtime", shape=(0, 1), chunks=self._auto_chunks, dtype=systemtime.dtype, compressor=compressor)
-
-        sn = np.array(data.shape[:1])[:, np.newaxis]
-        self._create_array("samplenumber", shape=(0, 1), chunks=self._auto_chunks, dtype=sn.dtype, compressor=compressor)
-        # print([(k, v.shape) for k, v in self.arrays.items()])
-
-    def _append_data(self, data, systemtime):
-        # print(data.shape, self.arrays["samples"].shape, self.arrays["samplenumber"].shape)
-        self.arrays["samples"].append(data, axis=0)
-
-        samplenumber = np.array(data.shape[:1])[:, np.newaxis]  # self.f.root['samples'].shape[:1]
-        self.arrays["samplenumber"].append(samplenumber, axis=0)
+        self._create_array("index", shape=(0,), chunks=(4096,), dtype=INDEX_DTYPE, compressor=compressor)
+        # per-chunk system time and length as in files written before the `index` table
+        self._create_array("systemtime", shape=(0, 1), chunks=self._auto_chunks, dtype=np.float64, compressor=compressor)
+        self._create_array("samplenumber", shape=(0, 1), chunks=self._auto_chunks, dtype=np.int64, compressor=compressor)
 
-        self.arrays["systemtime"].append(systemtime, axis=0)
+    def _append_data(self):
+        samples, index = self.buffer.pop()
+        self.arrays["samples"].append(samples, axis=0)
+        self.arrays["index"].append(index, axis=0)
+        self.arrays["systemtime"].append(index["systemtime"][:, np.newaxis], axis=0)
+        self.arrays["samplenumber"].append(index["nb_samples"][:, np.newaxis], axis=0)
 
     def _loop(self, data):
         data_to_save, systemtime = data  # unpack
-        sn = np.array([systemtime])[:, np.newaxis]
         if self.vanilla:
-            self._init_data(data_to_save, sn)
+            self._init_data(data_to_save, systemtime)
             self.vanilla = False
-        self._append_data(data_to_save, sn)
+        if self.buffer.push(data_to_save, float(systemtime)):
+            self._append_data()
 
     def _cleanup(self):
         logger.warning("cleaning")
+        if len(self.buffer):
+            self._append_data()
         try:
             self.f.close()
         except:
             logger.debug(f"{self.file_name} already closed.")
 
 
+@for_all_methods(log_exceptions(logger))
+@register_callback
+class SaveOnsetsHDF(BaseCallback):
+    """Save stimulus onsets to an `onsets` table.
+
+    Expects `((item, playlist_row, sample_offset), systemtime)` for each stimulus,
+    with `sample_offset` the first sample of the stimulus in the analog output.
+    """
+
+    FRIENDLY_NAME = "save_onsets_h5"
+    SUFFIX = "_onsets.h5"
+    ONSET_DTYPE = np.dtype([("item", np.int64), ("playlist_row", np.int64), ("sample_offset", np.int64), ("systemtime", np.float64)])
+
+    def __init__(self, data_source, *, file_name, attrs=None, poll_timeout=0.01, flush_every: int = 100, **kwargs):
+        super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
+
+        if tables_import_error is not None:
+            logger.exception("Could not import tables. Aborting!", exc_info=tables_import_error)
+            raise tables_import_error
+
+        self.file_name = file_name
+        self.flush_every = flush_every
+        self.f = tables.open_file(self.file_name + self.SUFFIX, mode="w")
+        filters = tables.Filters(complevel=4, complib="zlib", fletcher32=True)
+        self.onsets = self.f.create_table(self.f.root, "onsets", description=self.ONSET_DTYPE, filters=filters)
+        if attrs is not None:
+            for key, val in attrs.items():
+                self.onsets.attrs[key] = val
+        self.rows = []
+
+    @classmethod
+    def make_concurrent(cls, task_kwargs, comms="queue"):
+        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
+
+    def _flush_rows(self):
+        if self.rows:
+            self.onsets.append(np.array(self.rows, dtype=self.ONSET_DTYPE))
+            self.rows = []
+
+    def _loop(self, data):
+        (item, playlist_row, sample_offset), systemtime = data  # unpack
+        self.rows.append((item, playlist_row, sample_offset, systemtime))
+        if len(self.rows) >= self.flush_every:
+            self._flush_rows()
+
+    def _cleanup(self):
+        if self.f.isopen:
+            self._flush_rows()
+            self.f.flush()
+            self.f.close()
+        else:
+            logger.debug(f"{self.file_name} already closed.")
+
+
+@for_all_methods(log_exceptions(logger))
+@register_callback
+class DetectEvents(BaseCallback):
+    """Filter DAQ traces and save detected events to an `events` table.
+
+    See `EventDetector` for the filter and detection parameters. `sample` in the
+    table counts analog input samples from the start of the recording, `channel`
+    is the analog input channel, and `systemtime` is the time at which the chunk
+    with the event was acquired.
+
+    Args:
+        channels (list, optional): Channels to process. Defaults to None (all channels).
+    """
+
+    FRIENDLY_NAME = "detect_events"
+    SUFFIX = "_events.h5"
+    EVENT_DTYPE = np.dtype([("sample", np.int64), ("channel", np.int32), ("amplitude", np.float32), ("systemtime", np.float64)])
+
+    def __init__(
+        self,
+        data_source,
+        *,
+        file_name,
+        threshold,
+        channels: list = None,
+        nb_analog_chans_in: int = None,
+        mode: str = "threshold",
+        band=None,
+        btype: str = "bandpass",
+        order: int = 4,
+        min_interval: float = 0,
+        attrs=None,
+        poll_timeout=0.01,
+        **kwargs,
+    ):
+        super().__init__(data_source=data_source, poll_timeout=poll_timeout, **kwargs)
+
+        if tables_import_error is not None:
+            logger.exception("Could not import tables. Aborting!", exc_info=tables_import_error)
+            raise tables_import_error
+
+        self.channels = channels
+        nb_channels = len(channels) if channels is not None else nb_analog_chans_in
+        self.detector = EventDetector(nb_channels, attrs["rate"], threshold, mode, band, btype, order, min_interval)
+
+        self.file_name = file_name
+        self.f = tables.open_file(self.file_name + self.SUFFIX, mode="w")
+        filters = tables.Filters(complevel=4, complib="zlib", fletcher32=True)
+        self.events = self.f.create_table(self.f.root, "events", description=self.EVENT_DTYPE, filters=filters)
+        for key, val in {**attrs, "threshold": self.detector.threshold, "mode": mode}.items():
+            self.events.attrs[key] = val
+        if channels is not None:
+            self.events.attrs["channels"] = channels
+        if band is not None:
+            self.events.attrs["band"] = band
+            self.events.attrs["btype"] = btype
+            self.events.attrs["order"] = order
+
+    @classmethod
+    def make_concurrent(cls, task_kwargs, comms="queue"):
+        return ConcurrentTask(task=cls.make_run, task_kwargs=task_kwargs, comms=comms)
+
+    def _loop(self, data):
+        data_to_save, systemtime = data  # unpack
+        if self.channels is not None:
+            data_to_save = data_to_save[:, self.channels]
+        samples, channels, amplitudes = self.detector(data_to_save)
+        if self.channels is not None:
+            channels = np.asarray(self.channels)[channels]
+        if len(samples):
+            events = np.empty(len(samples), dtype=self.EVENT_DTYPE)
+            events["sample"] = samples
+            events["channel"] = channels
+            events["amplitude"] = amplitudes
+            events["systemtime"] = systemtime
+            self.events.append(events)
+
+    def _cleanup(self):
+        if self.f.isopen:
+            self.f.flush()
+            self.f.close()
+        else:
+            logger.debug(f"{self.file_name} already closed.")
+
+
 @for_all_methods(log_exceptions(logger))
 @register_callback
 class SaveDLP_HDF(BaseCallback):
@@ -3,7 +3,7 @@ from .spinnaker_old import Spinnaker_OLD
 from .ximea import Ximea
 from .basler import Basler
 from .hamamatsu import Hamamatsu
-from .dummy import Dummy
+from .dummy import Dummy, Synthetic
 
 make = {
     "Spinnaker_OLD": Spinnaker_OLD,
@@ -12,4 +12,5 @@ make = {
     "Basler": Basler,
     "Hamamatsu": Hamamatsu,
     "Dummy": Dummy,
+    "Synthetic": Synthetic,
 }
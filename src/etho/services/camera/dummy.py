@@ -137,3 +137,37 @@ class Dummy(BaseCam):
             "framerate": self.framerate,
         }
         return info
+
+
+class Synthetic(Dummy):
+    """Dummy cam that cycles through precomputed noise frames on a fixed schedule.
+
+    Frames are due every `1 / framerate` seconds after `start`. Frames missed because
+    `get` was called too late are skipped and counted in `dropped`, like frames that
+    are overwritten in the buffer of a real camera. Meant for benchmarking callbacks
+    without the cost of rendering each frame.
+    """
+
+    NB_FRAMES = 16
+
+    def start(self):
+        _, _, x, y = self.roi
+        self._frames = np.random.default_rng(0).integers(0, 64, size=(self.NB_FRAMES, x, y, 3), dtype=np.uint8)
+        self._start = time.perf_counter()
+        self._frame = 0
+        self.dropped = 0
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[np.ndarray, float, float]:
+        due = self._start + self._frame / self.framerate
+        now = time.perf_counter()
+        if now < due:
+            time.sleep(due - now)
+        else:
+            missed = int((now - due) * self.framerate)
+            self._frame += missed
+            self.dropped += missed
+
+        image = self._frames[self._frame % self.NB_FRAMES]
+        self._frame += 1
+        system_timestamp = time.time()
+        return image, system_timestamp - self._t0, system_timestamp
@@ -4,6 +4,8 @@ import time
 import numpy as np
 import logging
 from ..utils.log_exceptions import for_all_methods, log_exceptions
+from .generators import coroutine, data_playlist
+from ..utils.stats import CallbackStats
 from typing import Optional, List
 
 try:
@@ -33,6 +35,8 @@ class IOTask(daq.Task):
         terminals: Optional[List[str]] = None,
         duration: Optional[float] = None,
         logger=None,
+        buffer_seconds: float = 100,
+        refresh_seconds: float = 0.1,
     ):
         """[summary]
 
@@ -46,6 +50,9 @@ class IOTask(daq.Task):
                                           Use 'OnboardClock' for boards that don't support this (USB-DAQ).
                                           Defaults to None.
             terminals (List[str], optional):
+            buffer_seconds (float, optional): Size of the output buffer in seconds. Defaults to 100.
+            refresh_seconds (float, optional): Interval between writes to the output buffer in seconds.
+                                               Small buffers and intervals reduce output latency (closed loop). Defaults to 0.1.
 
 
         Raises:
@@ -112,8 +119,8 @@ class IOTask(daq.Task):
         self.data_gen = None  # called at start of callback
         self.data_rec = None  # called at end of callback
 
-        self.buffer_seconds = 100
-        self.refresh_seconds = 0.1
+        self.buffer_seconds = buffer_seconds
+        self.refresh_seconds = refresh_seconds
         self.num_samples_per_chan = int(rate * self.buffer_seconds)
         self.num_samples_per_event = int(rate * self.refresh_seconds)
 
@@ -190,6 +197,11 @@ class IOTask(daq.Task):
         self.AutoRegisterDoneEvent(0)
         self._data_lock = threading.Lock()
         self._newdata_event = threading.Event()
+        if self.cha_type[0] == "analog_input":
+            buffer_size = self.num_samples_per_chan * self.num_channels * 4  # see CfgInputBuffer
+        else:
+            buffer_size = self.num_samples_per_chan
+        self.stats = CallbackStats(self.rate, self.num_samples_per_event, buffer_size, output="output" in self.cha_type[0], name=repr(self), logger=self.log)
         # Output data is supplied by the service after this task has been
         # constructed.  Do not prefill the buffer here: doing so writes a full
         # buffer of zeros before the playlist generator is attached.  With the
@@ -220,6 +232,7 @@ class IOTask(daq.Task):
         """
         # for clean teardown, catch PyDAQmx.DAQmxFunctions.GenStoppedToPreventRegenOfOldSamplesError
         with self._data_lock:
+            start = time.perf_counter()
             systemtime = time.time()
             if self.data_gen is not None:
                 try:
@@ -247,12 +260,13 @@ class IOTask(daq.Task):
 
             elif self.cha_type[0] == "analog_output" and self._data is not None:
                 try:
+                    # stimuli may be stored as float32 or as non-contiguous views - convert per block only
                     self.WriteAnalogF64(
                         self._data.shape[0],
                         0,
                         daq.DAQmx_Val_WaitInfinitely,
                         daq.DAQmx_Val_GroupByScanNumber,
-                        self._data,
+                        np.ascontiguousarray(self._data, dtype=np.float64),
                         daq.byref(self.samples_written),
                         None,
                     )
@@ -266,7 +280,7 @@ class IOTask(daq.Task):
                         0,
                         daq.DAQmx_Val_WaitInfinitely,
                         daq.DAQmx_Val_GroupByScanNumber,
-                        self._data,
+                        np.ascontiguousarray(self._data, dtype=np.uint8),
                         daq.byref(self.samples_read),
                         None,
                     )
@@ -278,56 +292,29 @@ class IOTask(daq.Task):
                     if self._data is not None:
                         data_rec.send((self._data, systemtime))
             self._newdata_event.set()
+            # the backlog is queried from the driver - sample it to keep the callback lean
+            backlog = self._backlog() if self.stats.backlog_due() else None
+            self.stats.record(start, time.perf_counter(), 0 if self._data is None else len(self._data), backlog)
 
         return 0  # The function should return an integer
 
+    def _backlog(self) -> Optional[int]:
+        """Samples per channel written but not yet generated (output) or acquired but not yet read (input)."""
+        try:
+            if self.cha_type[0] == "analog_input":
+                available = daq.uInt32()
+                self.GetReadAvailSampPerChan(daq.byref(available))
+                return available.value
+            else:
+                write_position = daq.uInt64()
+                generated = daq.uInt64()
+                self.GetWriteCurrWritePos(daq.byref(write_position))
+                self.GetWriteTotalSampPerChanGenerated(daq.byref(generated))
+                return write_position.value - generated.value
+        except daq.DAQError:
+            return None
+
     def DoneCallback(self, status):
         """Call when Task is stopped/done."""
         self.log.warning("Done status %s", status)
         return 0  # The function should return an integer
-
-
-def coroutine(func):
-    """decorator that auto-initializes (calls `next(None)`) coroutines"""
-
-    def start(*args, **kwargs):
-        cr = func(*args, **kwargs)
-        next(cr)
-        return cr
-
-    return start
-
-
-@coroutine
-def data_playlist(sounds, play_order, playlist_info=None, logger=None, name="standard"):
-    """sounds - list of nparrays"""
-    first_run = True
-    playlist_index = 0
-    playlist_cnt = 0
-
-    try:
-        while play_order:
-            # duplicate first stim - otherwise we miss the first in the playlist
-            if first_run:
-                pp = 0
-                first_run = False
-            else:
-                pp = play_order[playlist_index % len(play_order)]
-                playlist_index += 1
-                playlist_cnt += 1
-                if playlist_info is not None:
-                    msg = _format_playlist(playlist_info.loc[pp], playlist_cnt)
-                    if logger:
-                        logger.warning(msg)
-            stim = sounds[pp]
-            yield stim
-    except (GeneratorExit, StopIteration):
-        if logger is not None:
-            logger.warning(f"   {name} cleaning up datagen.")
-
-
-def _format_playlist(playlist, cnt):
-    string = f"cnt: {cnt}; "
-    for key, val in playlist.items():
-        string += f"{key}: {val}; "
-    return string
@@ -0,0 +1,122 @@
+"""Pick the analog input chunk size from the measured cost of the input callback."""
+
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..callbacks import callbacks
+from .virtual import VirtualIOTask
+
+
+logger = logging.getLogger(__name__)
+
+# candidate chunk durations in seconds
+CHUNK_SECONDS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+def measure_callback_cost(task, nb_calls: int = 20, timeout: float = 10) -> float:
+    """90th percentile of the duration of `task.EveryNCallback` in seconds.
+
+    Virtual tasks are called directly. Device tasks are started and run until
+    `nb_calls` callbacks completed or for at most `timeout` seconds. The task is cleared afterwards.
+    """
+    durations = []
+    every_n_callback = task.EveryNCallback
+
+    def timed_callback():
+        t0 = time.perf_counter()
+        result = every_n_callback()
+        durations.append(time.perf_counter() - t0)
+        return result
+
+    task.EveryNCallback = timed_callback  # the device callback looks the method up by name
+    try:
+        if isinstance(task, VirtualIOTask):
+            for _ in range(nb_calls):
+                task.EveryNCallback()
+        else:
+            task.StartTask()
+            t_end = time.time() + timeout
+            while len(durations) < nb_calls and time.time() < t_end:
+                time.sleep(0.01)
+            task.StopTask()
+    finally:
+        task.ClearTask()
+
+    if not durations:
+        return float("inf")
+    return float(np.percentile(durations, 90))
+
+
+def callback_factory(callback_params: Optional[Dict[str, Any]], common_task_kwargs: Dict[str, Any]) -> Callable[[int], List]:
+    """Return a function creating the (not started) callbacks of a protocol for a given chunk size."""
+
+    def make_callbacks(nb_samples: int):
+        tasks = []
+        for cb_name, cb_params in (callback_params or {}).items():
+            task_kwargs = {**common_task_kwargs, "nb_inputsamples_per_cycle": nb_samples, **(cb_params or {})}
+            tasks.append(callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs))
+        return tasks
+
+    return make_callbacks
+
+
+def autotune_chunk_size(
+    make_task: Callable[[int], Any],
+    rate: float,
+    make_callbacks: Optional[Callable[[int], List]] = None,
+    chunk_sizes: Optional[Sequence[int]] = None,
+    margin: float = 4,
+    nb_calls: int = 20,
+    logger: Optional[logging.Logger] = logger,
+) -> Tuple[int, Dict[int, float]]:
+    """Smallest chunk size for which the input callback takes at most `1/margin` of the chunk duration.
+
+    Callbacks are fed with the chunks during the measurement but not started, so
+    the cost of sending the data (including preprocessing in the sending process) is included.
+
+    Args:
+        make_task (Callable[[int], Any]): Creates an analog input task (`IOTask` or `VirtualIOTask`) for a chunk size.
+        rate (float): Sampling rate in Hz.
+        make_callbacks (Callable[[int], List], optional): Creates the callbacks for a chunk size - see `callback_factory`. Defaults to None.
+        chunk_sizes (Sequence[int], optional): Candidates in samples. Defaults to None (`CHUNK_SECONDS` at `rate`).
+        margin (float, optional): Required ratio of chunk duration and callback cost. Defaults to 4.
+        nb_calls (int, optional): Callbacks measured per chunk size. Defaults to 20.
+
+    Returns:
+        Tuple[int, Dict[int, float]]: Chosen chunk size and the cost in seconds of each measured chunk size.
+    """
+    if chunk_sizes is None:
+        chunk_sizes = {max(1, int(seconds * rate)) for seconds in CHUNK_SECONDS}
+    chunk_sizes = sorted(chunk_sizes)
+
+    costs = {}
+    for nb_samples in chunk_sizes:
+        task = make_task(nb_samples)
+        task.data_rec = make_callbacks(nb_samples) if make_callbacks is not None else []
+        try:
+            costs[nb_samples] = measure_callback_cost(task, nb_calls)
+        finally:
+            for callback in task.data_rec:
+                callback.discard()
+        if logger is not None:
+            logger.info(f"   {nb_samples} samples per chunk: callback takes {1000 * costs[nb_samples]:1.2f} ms.")
+        if costs[nb_samples] * margin <= nb_samples / rate:
+            if logger is not None:
+                logger.warning(f"Using {nb_samples} samples per input chunk.")
+            return nb_samples, costs
+
+    if logger is not None:
+        logger.warning(f"No chunk size keeps the callback below 1/{margin} of the chunk duration. Using {chunk_sizes[-1]} samples.")
+    return chunk_sizes[-1], costs
+
+
+def autotune_metadata(nb_samples: int, costs: Dict[int, float]) -> Dict[str, Any]:
+    """Record the chosen chunk size and the measurements in the metadata of a recording."""
+    return {
+        "nb_inputsamples_per_cycle": nb_samples,
+        "autotune_chunk_sizes": list(costs.keys()),
+        "autotune_callback_seconds": list(costs.values()),
+    }
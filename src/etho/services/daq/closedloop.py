@@ -0,0 +1,140 @@
+"""Closed-loop stimulation - events detected in the analog input trigger stimuli on the analog output."""
+
+import collections
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+from ..utils.log_exceptions import for_all_methods, log_exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+@for_all_methods(log_exceptions(logger))
+class ClosedLoop:
+    """Inject a precomputed stimulus into the analog output whenever the detector fires.
+
+    Add the object to the `data_rec` of the analog input task - `send` then runs the
+    detector in the input callback - and attach `output()` as data generator to an
+    analog output task with a small buffer. Output is streamed in blocks of
+    `block_size` samples, so the stimulus starts with the next write after the event.
+    Events during a pending or playing stimulus are dropped.
+
+    The latency of each stimulus is the number of samples between the detected event
+    and the stimulus onset. Input and output share the sample clock and start trigger,
+    so this is the latency at the device.
+
+    Args:
+        stimuli (Sequence[np.ndarray]): Stimuli [samples, channels].
+        detector (Callable): Maps an input chunk [samples, channels] to the sample index
+                             (counted from the start of the input), channel and amplitude
+                             of events, like `EventDetector`.
+        rate (float): Sampling rate in Hz.
+        block_size (int): Samples per write to the output buffer.
+        prefill (int, optional): Samples of silence written before the start. Defaults to `block_size`.
+        channels (list, optional): Input channels passed to the detector. Defaults to None (all).
+        stimulus_order (Sequence[int], optional): Stimuli played for consecutive events (cycled). Defaults to None (all stimuli in order).
+        onset_log (optional): Receives `((item, stimulus, sample_offset), systemtime)` for each stimulus via `send`.
+        logger (optional): Logs the latency of each stimulus.
+    """
+
+    def __init__(
+        self,
+        stimuli: Sequence[np.ndarray],
+        detector: Callable,
+        rate: float,
+        block_size: int,
+        prefill: Optional[int] = None,
+        channels: Optional[Sequence[int]] = None,
+        stimulus_order: Optional[Sequence[int]] = None,
+        onset_log=None,
+        logger=None,
+    ):
+        self.stimuli = stimuli
+        self.detector = detector
+        self.rate = rate
+        self.block_size = block_size
+        self.prefill = prefill if prefill is not None else block_size
+        self.channels = channels
+        self.stimulus_order = list(stimulus_order) if stimulus_order is not None else list(range(len(stimuli)))
+        self.onset_log = onset_log
+        self.log = logger
+
+        self._events = collections.deque()  # samples of events waiting for output
+        self.busy = False  # stimulus pending or playing
+        self.latencies = []  # in samples
+        self.nb_dropped = 0
+
+    def start(self):
+        pass
+
+    def send(self, data):
+        """Detect events in an input chunk - `data` is `(chunk, systemtime)`."""
+        if data is None:
+            return
+        chunk, _ = data
+        if self.channels is not None:
+            chunk = chunk[:, self.channels]
+        samples, _, _ = self.detector(chunk)
+        if not len(samples):
+            return
+        if self.busy:
+            self.nb_dropped += len(samples)
+            return
+        self.busy = True
+        self._events.append(int(np.min(samples)))
+        self.nb_dropped += len(samples) - 1
+
+    def output(self):
+        """Generator of output blocks - silence until an event is detected, then the next stimulus."""
+        nb_channels = self.stimuli[self.stimulus_order[0]].shape[1]
+        dtype = self.stimuli[self.stimulus_order[0]].dtype
+        silence = np.zeros((self.block_size, nb_channels), dtype=dtype)
+        yield np.zeros((self.prefill, nb_channels), dtype=dtype)
+        sample_offset = self.prefill
+        item = 0
+        while True:
+            if not self._events:
+                yield silence
+                sample_offset += self.block_size
+                continue
+
+            event_sample = self._events.popleft()
+            stimulus = self.stimulus_order[item % len(self.stimulus_order)]
+            latency = sample_offset - event_sample
+            self.latencies.append(latency)
+            if self.onset_log is not None:
+                self.onset_log.send(((item, stimulus, sample_offset), time.time()))
+            if self.log is not None:
+                self.log.info(f"closed loop: stimulus {stimulus} at sample {sample_offset}, {1000 * latency / self.rate:1.1f} ms after event.")
+            item += 1
+
+            # pad the last block so the amount of buffered output stays constant
+            x = self.stimuli[stimulus]
+            nb_blocks = int(np.ceil(len(x) / self.block_size))
+            for block in range(nb_blocks):
+                out = x[block * self.block_size : (block + 1) * self.block_size]
+                if len(out) < self.block_size:
+                    out = np.concatenate((out, silence[: self.block_size - len(out)]))
+                yield out
+                sample_offset += self.block_size
+            self.busy = False
+
+    def summary(self) -> Dict[str, Any]:
+        """Number of stimuli and dropped events, and median and max latency in ms."""
+        latencies = 1000 * np.array(self.latencies) / self.rate
+        return {
+            "stimuli": len(latencies),
+            "dropped events": self.nb_dropped,
+            "median latency [ms]": float(np.median(latencies)) if len(latencies) else None,
+            "max latency [ms]": float(np.max(latencies)) if len(latencies) else None,
+        }
+
+    def finish(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
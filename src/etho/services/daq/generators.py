@@ -0,0 +1,56 @@
+"""Generators that supply the output blocks of DAQ tasks."""
+
+import time
+
+
+def coroutine(func):
+    """decorator that auto-initializes (calls `next(None)`) coroutines"""
+
+    def start(*args, **kwargs):
+        cr = func(*args, **kwargs)
+        next(cr)
+        return cr
+
+    return start
+
+
+@coroutine
+def data_playlist(sounds, play_order, playlist_info=None, logger=None, name="standard", onset_log=None, log_text=True):
+    """sounds - list of nparrays
+
+    onset_log - receives `((item, playlist_row, sample_offset), systemtime)` for each stimulus via `send`
+    log_text - log the playlist row of each stimulus as a warning
+    """
+    first_run = True
+    playlist_index = 0
+    playlist_cnt = 0
+    sample_offset = 0
+
+    try:
+        while play_order:
+            # duplicate first stim - otherwise we miss the first in the playlist
+            if first_run:
+                pp = 0
+                first_run = False
+            else:
+                pp = play_order[playlist_index % len(play_order)]
+                if onset_log is not None:
+                    onset_log.send(((playlist_cnt, pp, sample_offset), time.time()))
+                playlist_index += 1
+                playlist_cnt += 1
+                sample_offset += len(sounds[pp])
+                if log_text and playlist_info is not None and logger:
+                    msg = _format_playlist(playlist_info.loc[pp], playlist_cnt)
+                    logger.warning(msg)
+            stim = sounds[pp]
+            yield stim
+    except (GeneratorExit, StopIteration):
+        if logger is not None:
+            logger.warning(f"   {name} cleaning up datagen.")
+
+
+def _format_playlist(playlist, cnt):
+    string = f"cnt: {cnt}; "
+    for key, val in playlist.items():
+        string += f"{key}: {val}; "
+    return string
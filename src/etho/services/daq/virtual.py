@@ -0,0 +1,302 @@
+"""Simulated DAQ device for running and testing DAQ services without NI hardware.
+
+Select it with `device: virtual` in the DAQ block of a protocol - any device
+name starting with `virtual` is a separate virtual device. Tasks on the
+same virtual device share a sample clock that starts with the analog input task.
+Analog output channel `aoN` is looped back to analog input channel `aiN` unless
+an input signal is set for `aiN` via `get_device(name).inputs`.
+"""
+
+import collections
+import ctypes
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from ..utils.log_exceptions import for_all_methods, log_exceptions
+from ..utils.stats import CallbackStats
+
+
+logger = logging.getLogger(__name__)
+
+_devices: Dict[str, "VirtualDevice"] = {}
+
+
+class VirtualDevice:
+    """Sample clock shared by all tasks of a virtual device.
+
+    Args:
+        name (str): Device name.
+        realtime (bool, optional): Advance the clock in a background thread at the sampling rate
+                                   once the analog input task is started. If False, advance it
+                                   with `advance`. Defaults to True.
+    """
+
+    def __init__(self, name: str, realtime: bool = True):
+        self.name = name
+        self.realtime = realtime
+        self.loopback = True
+        self.inputs: Dict[str, Callable[[np.ndarray], np.ndarray]] = {}  # channel -> f(sample indices)
+        self.tasks: List["VirtualIOTask"] = []
+        self.sample = 0
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def advance(self, nb_samples: int):
+        """Clock `nb_samples` samples out of the output tasks and into the input tasks."""
+        with self._lock:
+            outputs = {}
+            for task in self.tasks:
+                if task.running and "output" in task.cha_type[0]:
+                    outputs.update(task._clock_out(nb_samples))
+            for task in self.tasks:
+                if task.running and task.cha_type[0] == "analog_input":
+                    task._clock_in(self.sample, nb_samples, outputs)
+            self.sample += nb_samples
+
+    def start(self, rate: float, tick: int):
+        self.sample = 0
+        if not self.realtime:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(rate, tick), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self, rate: float, tick: int):
+        t0 = time.perf_counter()
+        nb_samples = 0
+        while not self._stop_event.is_set():
+            self.advance(tick)
+            nb_samples += tick
+            self._stop_event.wait(max(0, t0 + nb_samples / rate - time.perf_counter()))
+
+
+def get_device(name: str = "virtual") -> VirtualDevice:
+    """Return the virtual device `name` - created on first access."""
+    if name not in _devices:
+        _devices[name] = VirtualDevice(name)
+    return _devices[name]
+
+
+@for_all_methods(log_exceptions(logger))
+class VirtualIOTask:
+    """Drop-in replacement for `IOTask` on a `VirtualDevice`.
+
+    Takes the same arguments as `IOTask`. Writes go to a simulated output buffer
+    of `num_samples_per_chan` samples which is drained by the device clock. As
+    with DAQmx, a write blocks until the buffer has room for the block, and no
+    callbacks run while it blocks. The buffer runs empty (output is zero) if the
+    data generator falls behind.
+    """
+
+    def __init__(
+        self,
+        dev_name="virtual",
+        cha_name=["ai0"],
+        limits=None,
+        rate: float = 10000.0,
+        nb_inputsamples_per_cycle=None,
+        clock_source=None,
+        terminals: Optional[List[str]] = None,
+        duration: Optional[float] = None,
+        logger=None,
+        buffer_seconds: float = 100,
+        refresh_seconds: float = 0.1,
+    ):
+        if not isinstance(cha_name, (list, tuple)):
+            raise TypeError(f"`cha_name` is {type(cha_name)}. Should be `list` or `tuple`")
+
+        self.log = logger
+        self.device = get_device(dev_name)
+        self.samples_read = ctypes.c_int32()
+        self.samples_written = ctypes.c_int32()
+        self.rate = rate
+        cha_types = {
+            "ai": "analog_input",
+            "ao": "analog_output",
+            "po": "digital_output",
+        }
+        self.cha_type = [cha_types[cha[:2]] for cha in cha_name]
+        if len(set(self.cha_type)) > 1:
+            raise ValueError("channels should all be of the same type but are {0}.".format(set(self.cha_type)))
+        self.channels = list(cha_name)
+        self.cha_names = [dev_name + "/" + ch for ch in cha_name]
+        self.cha_string = ", ".join(self.cha_names)
+        self.num_channels = len(self.cha_names)
+        if nb_inputsamples_per_cycle is None:
+            nb_inputsamples_per_cycle = int(self.rate)
+
+        self.callback = None
+        self.data_gen = None  # called at start of callback
+        self.data_rec = None  # called at end of callback
+
+        self.buffer_seconds = buffer_seconds
+        self.refresh_seconds = refresh_seconds
+        self.num_samples_per_chan = int(rate * self.buffer_seconds)
+        self.num_samples_per_event = int(rate * self.refresh_seconds)
+        if self.cha_type[0] == "analog_input":
+            self.num_samples_per_chan = nb_inputsamples_per_cycle
+            self.num_samples_per_event = nb_inputsamples_per_cycle
+
+        if "digital" in self.cha_type[0]:
+            self.dtype = np.uint8
+        else:
+            self.dtype = np.float64
+        self._data = np.zeros((self.num_samples_per_chan, self.num_channels), dtype=self.dtype)
+
+        self.running = False
+        self.underflows = 0  # samples output while the buffer was empty
+        self._buffer = collections.deque()  # blocks waiting for output or read
+        self._buffered = 0
+        self._pending = None  # output block of the last EveryNCallback that did not fit into the buffer yet
+        self._clocked = 0  # samples since the last EveryNCallback
+        self._data_lock = threading.Lock()
+        self._newdata_event = threading.Event()
+        if self.cha_type[0] == "analog_input":
+            buffer_size = self.num_samples_per_chan * self.num_channels * 4  # as for IOTask
+        else:
+            buffer_size = self.num_samples_per_chan
+        self.stats = CallbackStats(self.rate, self.num_samples_per_event, buffer_size, output="output" in self.cha_type[0], name=repr(self), logger=self.log)
+        self.device.tasks.append(self)
+
+    def __repr__(self):
+        return "{0}: {1}".format(self.cha_type[0], self.cha_string)
+
+    def set_data_generator(self, data_gen):
+        """Attach and prefill an output generator before starting the task."""
+        self.data_gen = data_gen
+        self.EveryNCallback()
+
+    def stop(self):
+        """Stop DAQ."""
+        if self.data_gen is not None:
+            self._data = self.data_gen.close()  # close data generator
+        if self.data_rec is not None:
+            for data_rec in self.data_rec:
+                data_rec.send(None)
+                data_rec.finish(verbose=True, sleepcycletimeout=2)
+                data_rec.close()
+
+    def CfgDigEdgeStartTrig(self, *args):
+        pass
+
+    def DisableStartTrig(self):
+        pass
+
+    def StartTask(self):
+        self.running = True
+        self._clocked = 0
+        if self.cha_type[0] == "analog_input":  # generates the start trigger for the output tasks
+            self._buffer.clear()
+            self._buffered = 0
+            ticks = [task.num_samples_per_event for task in self.device.tasks if task.running]
+            self.device.start(self.rate, max(1, min(ticks)))
+
+    def StopTask(self):
+        if self.running and self.cha_type[0] == "analog_input":
+            self.device.stop()
+        self.running = False
+
+    def ClearTask(self):
+        self.StopTask()
+        if self in self.device.tasks:
+            self.device.tasks.remove(self)
+
+    def IsTaskDone(self, is_done):
+        is_done.value = not self.running
+
+    def _pop(self, nb_samples: int) -> np.ndarray:
+        """Remove `nb_samples` from the buffer - zero-padded if the buffer holds fewer samples."""
+        out = np.zeros((nb_samples, self.num_channels), dtype=self.dtype)
+        filled = 0
+        while filled < nb_samples and self._buffer:
+            block = self._buffer.popleft()
+            nb_take = min(len(block), nb_samples - filled)
+            out[filled : filled + nb_take] = block[:nb_take]
+            if nb_take < len(block):
+                self._buffer.appendleft(block[nb_take:])
+            filled += nb_take
+        self._buffered -= filled
+        return out, filled
+
+    def _clock_out(self, nb_samples: int) -> Dict[str, np.ndarray]:
+        out, filled = self._pop(nb_samples)
+        if filled < nb_samples:
+            if self.underflows == 0 and self.log is not None:
+                self.log.warning(f"{self}: output buffer ran empty.")
+            self.underflows += nb_samples - filled
+        self._clocked += nb_samples
+        while self._clocked >= self.num_samples_per_event and self._write_pending():
+            self._clocked -= self.num_samples_per_event
+            self.EveryNCallback()
+        self._clocked = min(self._clocked, self.num_samples_per_event)  # events during a blocked write do not queue up
+        return {channel: out[:, cnt] for cnt, channel in enumerate(self.channels)}
+
+    def _write_pending(self) -> bool:
+        """Move the pending output block to the buffer if it fits - returns False if the write still blocks.
+
+        Blocks longer than the buffer are written once the buffer ran empty.
+        """
+        if self._pending is None:
+            return True
+        if self._buffered and self._buffered + len(self._pending) > self.num_samples_per_chan:
+            return False
+        self._buffer.append(self._pending)
+        self._buffered += len(self._pending)
+        self._pending = None
+        return True
+
+    def _clock_in(self, first_sample: int, nb_samples: int, outputs: Dict[str, np.ndarray]):
+        block = np.zeros((nb_samples, self.num_channels))
+        samples = np.arange(first_sample, first_sample + nb_samples)
+        for cnt, channel in enumerate(self.channels):
+            if channel in self.device.inputs:
+                block[:, cnt] = self.device.inputs[channel](samples)
+            elif self.device.loopback and "ao" + channel[2:] in outputs:
+                block[:, cnt] = outputs["ao" + channel[2:]]
+        self._buffer.append(block)
+        self._buffered += nb_samples
+        while self._buffered >= self.num_samples_per_event:
+            self.EveryNCallback()
+
+    def EveryNCallback(self):
+        """Call whenever there is data to be read/written from/to the buffer.
+
+        Calls `self.data_gen` or `self.data_rec` for requesting/processing data.
+        """
+        with self._data_lock:
+            start = time.perf_counter()
+            systemtime = time.time()
+            if self.data_gen is not None:
+                try:
+                    self._data = next(self.data_gen)  # get data from data generator
+                except StopIteration:
+                    if self.log is not None:
+                        self.log.warning(f"Generator out of data - stopping iteration. This is okay!")
+                    self._data = None
+
+            if self.cha_type[0] == "analog_input":
+                self._data, self.samples_read.value = self._pop(self.num_samples_per_event)
+            elif self._data is not None:
+                self._pending = np.array(self._data, dtype=self.dtype)
+                self._write_pending()
+                self.samples_written.value = len(self._data)
+
+            if self.data_rec is not None:
+                for data_rec in self.data_rec:
+                    if self._data is not None:
+                        data_rec.send((self._data, systemtime))
+            self._newdata_event.set()
+            self.stats.record(start, time.perf_counter(), 0 if self._data is None else len(self._data), self._buffered)
+
+        return 0
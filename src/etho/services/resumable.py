@@ -6,6 +6,12 @@ import numpy as np
 
 from . import camera
 from .callbacks import callbacks
+from .daq.autotune import autotune_chunk_size, autotune_metadata, callback_factory
+from .utils.concurrent_task import callback_status
+from .utils.progress import ProgressPublisher
+from .utils.service_stats import CameraStatsMixin, DAQStatsMixin
+from .utils.telemetry import TelemetryRecorder, save_telemetry, task_pids
+from ..utils.sound import PlaylistArray
 
 
 logger = logging.getLogger(__name__)
@@ -34,11 +40,48 @@ class ResumableZeroService:
     def information(self):
         return getattr(self, "info", {})
 
+    def armed(self):
+        """Whether the hardware started by `start` runs or waits for its trigger."""
+        return self.state == "running"
+
+    def publish_progress(self, name, interval=1.0):
+        """Publish `progress()` every `interval` seconds - returns the port, see `utils.progress.ProgressSubscriber`."""
+        self.stop_publishing()
+        self._progress_publisher = ProgressPublisher(name, self.progress, interval)
+        self._progress_publisher.start()
+        return self._progress_publisher.port
+
+    def stop_publishing(self):
+        publisher = getattr(self, "_progress_publisher", None)
+        if publisher is not None:
+            publisher.stop()
+            self._progress_publisher = None
+
 
 def array_generator(data):
     yield data
 
 
+def output_generator(data, min_samples=0):
+    """Stream virtual playlists block-wise, write plain arrays at once."""
+    if isinstance(data, PlaylistArray):
+        return data.blocks(min_samples)
+    return array_generator(data)
+
+
+def silence_generator(block_size, nb_channels, dtype):
+    """Stream one block of zeros until stopped - output of runs without a duration."""
+    block = np.zeros((block_size, nb_channels), dtype=dtype)
+    while True:
+        yield block
+
+
+def make_telemetry(params, sample, processes):
+    """Telemetry recorder for a run - None if `telemetry_interval` is 0."""
+    interval = params.get("telemetry_interval", 1)
+    return TelemetryRecorder(sample, processes, interval) if interval else None
+
+
 def close_callback(callback, sleep_time=0.05):
     try:
         callback.close(sleep_time=sleep_time)
@@ -46,31 +89,54 @@ def close_callback(callback, sleep_time=0.05):
         callback.close()
 
 
-class ResumableDAQ(ResumableZeroService):
+class ResumableDAQ(DAQStatsMixin, ResumableZeroService):
     def __init__(self, params):
         super().__init__()
         self.params = params
         self.callbacks = []
+        self.callback_names = []
         self.info = {}
 
     def setup_hardware(self):
         import etho.services.DAQZeroService as daq_service
 
         self.log.info("Setting up DAQ hardware.")
-        daqmx_import_error = getattr(daq_service, "daqmx_import_error", None)
-        if daqmx_import_error is not None:
-            raise ImportError(daqmx_import_error)
-        if not hasattr(daq_service, "IOTask"):
-            raise ImportError("DAQ IOTask is unavailable. Check PyDAQmx installation.")
+        self.dev_name = self.params.get("device") or "Dev1"
+        if not self.dev_name.startswith("virtual"):
+            daqmx_import_error = getattr(daq_service, "daqmx_import_error", None)
+            if daqmx_import_error is not None:
+                raise ImportError(daqmx_import_error)
+            if not hasattr(daq_service, "IOTask"):
+                raise ImportError("DAQ IOTask is unavailable. Check PyDAQmx installation.")
 
         self.fs = self.params["samplingrate"]
-        self.dev_name = self.params.get("device") or "Dev1"
         self.clock_source = self.params["clock_source"]
         self.nb_inputsamples_per_cycle = self.params["nb_inputsamples_per_cycle"]
         self.analog_chans_in = self.params["analog_chans_in"]
         self.analog_chans_out = self.params["analog_chans_out"]
         self.digital_chans_out = self.params["digital_chans_out"]
-        IOTask = daq_service.IOTask
+        IOTask = daq_service.VirtualIOTask if self.dev_name.startswith("virtual") else daq_service.IOTask
+
+        self.autotune_metadata = {}
+        if self.nb_inputsamples_per_cycle == "auto" and self.analog_chans_in:
+            self.log.info("Measuring input callback cost for choosing the chunk size.")
+            self.nb_inputsamples_per_cycle, costs = autotune_chunk_size(
+                lambda nb_samples: IOTask(
+                    dev_name=self.dev_name,
+                    cha_name=self.analog_chans_in,
+                    rate=self.fs,
+                    nb_inputsamples_per_cycle=nb_samples,
+                    clock_source=self.clock_source,
+                    logger=self.log,
+                ),
+                self.fs,
+                make_callbacks=callback_factory(
+                    self.params.get("callbacks"), {"file_name": None, "nb_analog_chans_in": len(self.analog_chans_in), "attrs": {"rate": self.fs}}
+                ),
+                margin=self.params.get("autotune_margin", 4),
+                logger=self.log,
+            )
+            self.autotune_metadata = autotune_metadata(self.nb_inputsamples_per_cycle, costs)
 
         if self.analog_chans_in:
             self.taskAI = IOTask(
@@ -118,11 +184,11 @@ class ResumableDAQ(ResumableZeroService):
         self.prev_elapsed = 0
         self.log.info(f"Preparing DAQ run: {savefilename}.")
 
-        if analog_data_out is not None:
+        if analog_data_out is not None and not isinstance(analog_data_out, PlaylistArray):
             analog_data_out = np.asarray(analog_data_out, dtype=np.float64)
             if analog_data_out.ndim == 1:
                 analog_data_out = analog_data_out.reshape(-1, 1)
-        if digital_data_out is not None:
+        if digital_data_out is not None and not isinstance(digital_data_out, PlaylistArray):
             digital_data_out = np.asarray(digital_data_out, dtype=np.uint8)
             if digital_data_out.ndim == 1:
                 digital_data_out = digital_data_out.reshape(-1, 1)
@@ -136,18 +202,27 @@ class ResumableDAQ(ResumableZeroService):
             duration = n_samples / self.fs if n_samples else self.params.get("duration", -1)
         self.duration = duration
 
+        # write at least one second per callback so the output buffer does not run dry
+        block_size = int(self.fs)
+        until_stopped = not (duration and duration > 0)
         if self.analog_chans_out:
-            if analog_data_out is None:
-                analog_data_out = np.zeros((int(duration * self.fs), len(self.analog_chans_out)), dtype=np.float64)
-            if analog_data_out.shape[1] != len(self.analog_chans_out):
-                raise ValueError("analog_data_out channel count does not match analog_chans_out")
-            self.taskAO.data_gen = array_generator(analog_data_out)
+            if analog_data_out is None and until_stopped:
+                self.taskAO.data_gen = silence_generator(block_size, len(self.analog_chans_out), np.float64)
+            else:
+                if analog_data_out is None:
+                    analog_data_out = PlaylistArray.silence(int(duration * self.fs), len(self.analog_chans_out), np.float64, block_size)
+                if analog_data_out.shape[1] != len(self.analog_chans_out):
+                    raise ValueError("analog_data_out channel count does not match analog_chans_out")
+                self.taskAO.data_gen = output_generator(analog_data_out, block_size)
         if self.digital_chans_out:
-            if digital_data_out is None:
-                digital_data_out = np.zeros((int(duration * self.fs), len(self.digital_chans_out)), dtype=np.uint8)
-            if digital_data_out.shape[1] != len(self.digital_chans_out):
-                raise ValueError("digital_data_out channel count does not match digital_chans_out")
-            self.taskDO.data_gen = array_generator(digital_data_out)
+            if digital_data_out is None and until_stopped:
+                self.taskDO.data_gen = silence_generator(block_size, len(self.digital_chans_out), np.uint8)
+            else:
+                if digital_data_out is None:
+                    digital_data_out = PlaylistArray.silence(int(duration * self.fs), len(self.digital_chans_out), np.uint8, block_size)
+                if digital_data_out.shape[1] != len(self.digital_chans_out):
+                    raise ValueError("digital_data_out channel count does not match digital_chans_out")
+                self.taskDO.data_gen = output_generator(digital_data_out, block_size)
         for task_name in ("taskAI", "taskDO", "taskAO"):
             task = getattr(self, task_name, None)
             if task is not None:
@@ -158,6 +233,8 @@ class ResumableDAQ(ResumableZeroService):
                         pass
                 if hasattr(task, "_newdata_event"):
                     task._newdata_event.clear()
+                if hasattr(task, "stats"):
+                    task.stats.reset()
 
         if self.analog_chans_in:
             attrs = {
@@ -165,6 +242,7 @@ class ResumableDAQ(ResumableZeroService):
                 "analog_chans_in": self.analog_chans_in,
                 "analog_chans_out": self.analog_chans_out,
                 "digital_chans_out": self.digital_chans_out,
+                **self.autotune_metadata,
                 **self.metadata,
             }
             common = {
@@ -174,16 +252,19 @@ class ResumableDAQ(ResumableZeroService):
                 "attrs": attrs,
             }
             self.callbacks = []
+            self.callback_names = []
             self.taskAI.data_rec = []
             for cb_name, cb_params in (self.params.get("callbacks") or {}).items():
                 task_kwargs = common if cb_params is None else {**common, **cb_params}
                 callback = callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs)
                 self.callbacks.append(callback)
+                self.callback_names.append(cb_name)
                 self.taskAI.data_rec.append(callback)
                 self.log.info(f"   callback {cb_name}.")
 
         if duration and duration > 0:
             self._thread_timer = threading.Timer(duration, self.stop_run)
+        self.telemetry = make_telemetry(self.params, self._telemetry, lambda: task_pids(self.callback_names, self.callbacks))
         self.info = {
             "job": {
                 "sample rate": f"{self.fs}Hz",
@@ -213,6 +294,8 @@ class ResumableDAQ(ResumableZeroService):
         self.prev_elapsed = 0
         if hasattr(self, "_thread_timer"):
             self._thread_timer.start()
+        if getattr(self, "telemetry", None) is not None:
+            self.telemetry.start()
         self.state = "running"
         self.log.info("DAQ run started.")
 
@@ -236,7 +319,12 @@ class ResumableDAQ(ResumableZeroService):
                 close_callback(callback)
             except Exception as e:
                 self.log.debug(e)
+        if was_active and getattr(self, "savefilename", None) is not None:
+            self._save_stats()
+            save_telemetry(getattr(self, "telemetry", None), self.savefilename + "_daq_telemetry.npz", self.log)
+        self.telemetry = None
         self.callbacks = []
+        self.callback_names = []
         if hasattr(self, "taskAI"):
             self.taskAI.data_rec = []
         if hasattr(self, "taskAO"):
@@ -270,10 +358,12 @@ class ResumableDAQ(ResumableZeroService):
             "elapsed": elapsed,
             "elapsed_delta": elapsed_delta,
             "elapsed_units": "seconds",
+            "tasks": {name: stats.summary() for name, stats in self._task_stats().items()},
+            "callbacks": callback_status(self.callback_names, self.callbacks),
         }
 
 
-class ResumableGCM(ResumableZeroService):
+class ResumableGCM(CameraStatsMixin, ResumableZeroService):
     def __init__(self, params):
         super().__init__()
         self.params = params
@@ -373,15 +463,19 @@ class ResumableGCM(ResumableZeroService):
             "frame_width": self.frame_width,
         }
         run_callbacks = {"disp_fast": None} if preview else (self.params.get("callbacks") or {})
+        trace_every = self.params.get("trace_every", 0)
+        concurrent_kwargs = {"trace_every": trace_every} if trace_every else {}
         for cb_name, cb_params in run_callbacks.items():
             task_kwargs = common if cb_params is None else {**common, **cb_params}
-            self.callbacks.append(callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs))
+            self.callbacks.append(callbacks[cb_name].make_concurrent(task_kwargs=task_kwargs, **concurrent_kwargs))
             self.callback_names.append(cb_name)
             self.log.info(f"   callback {cb_name}.")
         self._thread_stopper = threading.Event()
         self._worker_thread = threading.Thread(target=self._worker, args=(self._thread_stopper,))
+        self._camera_started = threading.Event()  # set by the worker once the camera acquires
         if duration and duration > 0:
             self._thread_timer = threading.Timer(duration, self.stop_run)
+        self.telemetry = None if preview else make_telemetry(self.params, self._telemetry, lambda: task_pids(self.callback_names, self.callbacks))
         self.info = self._information(self.savefilename, self.duration, run_callbacks)
         self.state = "prepared"
         self.log.info(f"Camera run prepared for {self.duration}s.")
@@ -397,22 +491,33 @@ class ResumableGCM(ResumableZeroService):
         self._worker_thread.start()
         if hasattr(self, "_thread_timer"):
             self._thread_timer.start()
+        if getattr(self, "telemetry", None) is not None:
+            self.telemetry.start()
         self.state = "running"
         self.log.info("Camera run started.")
 
+    def armed(self):
+        camera_started = getattr(self, "_camera_started", None)
+        return self.state == "running" and camera_started is not None and camera_started.is_set()
+
     def _worker(self, stop_event):
         self.log.info("Camera worker started.")
         self.c.enable_gpio_strobe()
         self.c.start()
+        self._camera_started.set()
         while not stop_event.is_set() and self.frameNumber < self.nFrames:
             try:
                 image, image_ts, system_ts = self.c.get()
             except Exception as e:
                 self.log.exception("Camera get failed", exc_info=e)
                 break
+            acquired = time.perf_counter()
             for callback_name, callback in zip(self.callback_names, self.callbacks):
                 package = (0, (system_ts, image_ts)) if "timestamps" in callback_name else (image, (system_ts, image_ts))
-                callback.send(package)
+                if getattr(callback, "trace", None) is None:  # custom callbacks may not trace
+                    callback.send(package)
+                else:
+                    callback.send(package, acquired)
             self.frameNumber += 1
         try:
             self.c.stop()
@@ -442,6 +547,10 @@ class ResumableGCM(ResumableZeroService):
                 close_callback(callback)
             except Exception as e:
                 self.log.debug(e)
+        if was_active and getattr(self, "savefilename", None) is not None:
+            self._save_latencies()
+            save_telemetry(getattr(self, "telemetry", None), self.savefilename + "_gcm_telemetry.npz", self.log)
+        self.telemetry = None
         self.callbacks = []
         self.callback_names = []
         if self.state != "new":
@@ -465,7 +574,7 @@ class ResumableGCM(ResumableZeroService):
         frame_delta = self.frameNumber - self.prev_framenumber
         self.prev_framenumber = self.frameNumber
         self.prev_elapsed = elapsed
-        return {
+        p = {
             "total": self.duration if getattr(self, "duration", None) else 0,
             "elapsed": elapsed,
             "elapsed_delta": elapsed_delta,
@@ -473,4 +582,9 @@ class ResumableGCM(ResumableZeroService):
             "framenumber": self.frameNumber,
             "framenumber_delta": frame_delta,
             "framenumber_units": "frames",
+            "callbacks": callback_status(self.callback_names, self.callbacks),
         }
+        latencies = self._latencies()
+        if latencies:
+            p["latency"] = {name: trace.summary() for name, trace in latencies.items()}
+        return p
@@ -2,12 +2,15 @@
 and a helper class for running tasks in independent processes."""
 from multiprocessing import Process
 import multiprocessing as mp
+import queue
 import time
 import sys
 import numpy as np
 import ctypes
 from typing import Optional, Any, Dict, Callable, Literal
 import multiprocessing.connection
+from .stats import StageLatencies
+from ...utils import profiling
 
 
 class SharedNumpyArray:
@@ -147,6 +150,116 @@ def NumpyArray(shape=(1,), ctype=ctypes.c_double):
     return sender, receiver
 
 
+class TaskMetrics:
+    """Counters of a task in shared memory - updated by the task, read by the process that started it.
+
+    Counts the items received, processed, and dropped (received but not processed,
+    for instance because of a rate limit), the errors, and the payload bytes of the
+    processed items. Keeps a moving average and the maximum of the processing time
+    per item, and the last error.
+
+    Args:
+        alpha (float, optional): Weight of the latest processing time in the moving average. Defaults to 0.1.
+        error_length (int, optional): Characters kept of the last error. Defaults to 256.
+    """
+
+    RECEIVED, PROCESSED, DROPPED, ERRORS, BYTES, LOOP_SECONDS, LOOP_MAX = range(7)
+
+    def __init__(self, alpha: float = 0.1, error_length: int = 256):
+        self.alpha = alpha
+        self._values = mp.RawArray(ctypes.c_double, 7)
+        self._error = mp.RawArray(ctypes.c_char, error_length)
+
+    def received(self):
+        self._values[self.RECEIVED] += 1
+
+    def dropped(self):
+        self._values[self.DROPPED] += 1
+
+    def processed(self, seconds: float, nb_bytes: int = 0):
+        values = self._values
+        if values[self.PROCESSED]:
+            values[self.LOOP_SECONDS] += self.alpha * (seconds - values[self.LOOP_SECONDS])
+        else:
+            values[self.LOOP_SECONDS] = seconds
+        values[self.LOOP_MAX] = max(values[self.LOOP_MAX], seconds)
+        values[self.PROCESSED] += 1
+        values[self.BYTES] += nb_bytes
+
+    def failed(self, error: BaseException):
+        self._values[self.ERRORS] += 1
+        self._error.value = repr(error).encode(errors="replace")[: len(self._error) - 1]
+
+    def summary(self) -> Dict[str, Any]:
+        values = list(self._values)
+        return {
+            "received": int(values[self.RECEIVED]),
+            "processed": int(values[self.PROCESSED]),
+            "dropped": int(values[self.DROPPED]),
+            "errors": int(values[self.ERRORS]),
+            "bytes": int(values[self.BYTES]),
+            "loop_seconds": values[self.LOOP_SECONDS] if values[self.PROCESSED] else None,
+            "loop_max": values[self.LOOP_MAX] if values[self.PROCESSED] else None,
+            "last_error": self._error.value.decode(errors="replace") or None,
+        }
+
+
+class Receiver:
+    """Receiving end of the comms as passed to the task, with the metrics of the task.
+
+    Delegates everything else to the wrapped `receiver`.
+
+    Args:
+        receiver: Receiving end of a queue, pipe or shared array.
+        metrics (TaskMetrics): Counters updated by the task.
+    """
+
+    def __init__(self, receiver, metrics: TaskMetrics):
+        self.receiver = receiver
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        if name == "receiver":  # not yet set while unpickling
+            raise AttributeError(name)
+        return getattr(self.receiver, name)
+
+    def get(self, *args, **kwargs):
+        return self.receiver.get(*args, **kwargs)
+
+
+class TracedReceiver(Receiver):
+    """Receiving end of the comms that stamps every `every`-th item.
+
+    Items are stamped when `get` returns them and when the task asks for the next
+    item. The stamps are sent back via `channel` with the sequence number of the
+    item, so the sender can match them.
+
+    Args:
+        receiver: Receiving end of a queue or pipe.
+        metrics (TaskMetrics): Counters updated by the task.
+        every (int): Stamp one in `every` items.
+        channel (mp.Queue): Back-channel for the stamps.
+    """
+
+    def __init__(self, receiver, metrics: TaskMetrics, every: int, channel):
+        super().__init__(receiver, metrics)
+        self.every = every
+        self.channel = channel
+        self.nb_received = 0
+        self._received = None  # sequence number and receive time of the traced item being processed
+
+    def get(self, *args, **kwargs):
+        if self._received is not None:
+            self.channel.put((*self._received, time.perf_counter()))
+            self._received = None
+        data = self.receiver.get(*args, **kwargs)
+        if data is not None:
+            if self.nb_received % self.every == 0:
+                self._received = (self.nb_received, time.perf_counter())
+            self.nb_received += 1
+        return data
+
+
 class ConcurrentTask:
     """Helper class for running tasks in independent
     processes with communication tools attached."""
@@ -158,6 +271,8 @@ class ConcurrentTask:
         comms: Literal["array", "pipe", "queue"] = "queue",
         comms_kwargs: Dict[str, Any] = {},
         taskstopsignal: Any = None,
+        preprocess: Optional[Callable[[Any], Any]] = None,
+        trace_every: int = 0,
     ):
         """[summary]
 
@@ -168,10 +283,16 @@ class ConcurrentTask:
                                    "array" if you want speed and don't mind loosing data (displaying data)
                                    or if you want to ensure you are always assessing fresh data (realtime feedback).
                                    "queue" is slower but great when data loss is unacceptable (saving data).
-                                   "pipe" probably never??
+                                   "pipe" sends in the calling thread and blocks once the OS pipe buffer is full.
+                                   See `benchmarks/ipc.py` for throughput and latency of each on a rig.
                                    Defaults to "queue".
             comms_kwargs (Dict[str, Any], optional): kwargs for constructing comms. Defaults to {}.
             taskstopsignal (Any, optional): Data to send over comms that tells the task to stop. Defaults to None.
+            preprocess (Callable, optional): Applied to data in the sending process before it is sent (e.g. to reduce data).
+                                             Not applied to `taskstopsignal`. Defaults to None.
+            trace_every (int, optional): Trace the latency of one in `trace_every` items from acquisition (`send(data, acquired)`)
+                                         to the task being done with them - see `collect_trace`.
+                                         Not supported for "array" comms, which drop items. Defaults to 0 (no tracing).
         Raises:
             ValueError: for unknown comms
         """
@@ -187,11 +308,79 @@ class ConcurrentTask:
             raise ValueError(f'Unknown comms {comms} - allowed values are "pipe", "queue", "array"')
 
         # delegate send calls from sender
-        self.send = self._sender.send
-
-        self._process = Process(target=task, args=(self._receiver,), kwargs=task_kwargs)
+        self.preprocess = preprocess
+        if self.preprocess is None:
+            self.send = self._sender.send
+        else:
+            self.send = self._send_preprocessed
+
+        self.trace_every = trace_every if self.comms != "array" else 0
+        self.trace = None
+        self.metrics = TaskMetrics()
+        receiver = Receiver(self._receiver, self.metrics)
+        if self.trace_every:
+            self.trace = StageLatencies()
+            self._trace_queue = mp.Queue()
+            self._nb_sent = 0
+            self._send = self.send
+            self.send = self._send_traced
+            receiver = TracedReceiver(self._receiver, self.metrics, self.trace_every, self._trace_queue)
+
+        if profiling.folder() is None:  # profiled runs set `ETHO_PROFILE` - see `etho.utils.profiling`
+            self._process = Process(target=task, args=(receiver,), kwargs=task_kwargs)
+        else:
+            name = getattr(getattr(task, "__self__", None), "__name__", None) or getattr(task, "__name__", "task")
+            self._process = Process(target=profiling.run_profiled, args=(task, name, receiver), kwargs=task_kwargs)
         self.start = self._process.start
 
+    def _send_preprocessed(self, data: Any):
+        if data is not self.taskstopsignal:
+            data = self.preprocess(data)
+        self._sender.send(data)
+
+    def _send_traced(self, data: Any, acquired: Optional[float] = None):
+        """`send` of traced tasks - `acquired` is the `time.perf_counter` of the acquisition of `data` (defaults to now)."""
+        if data is self.taskstopsignal:
+            self._send(data)
+            return
+        seq = self._nb_sent
+        self._nb_sent += 1
+        if seq % self.trace_every:
+            self._send(data)
+            return
+        start = time.perf_counter()
+        self._send(data)
+        self.trace.sent(seq, start if acquired is None else acquired, start, time.perf_counter())
+
+    def collect_trace(self) -> Optional[StageLatencies]:
+        """Add the stamps sent back by the task to the latencies - call regularly from the sending process.
+
+        Returns:
+            Optional[StageLatencies]: None if not tracing.
+        """
+        if self.trace is None:
+            return None
+        while True:
+            try:
+                seq, received, done = self._trace_queue.get_nowait()
+            except (queue.Empty, OSError, ValueError):  # empty or closed
+                break
+            self.trace.received(seq, received, done)
+        return self.trace
+
+    def status(self) -> Dict[str, Any]:
+        """Metrics of the task (see `TaskMetrics`), whether its process is alive, and the items waiting in the queue."""
+        status = self.metrics.summary()
+        process = getattr(self, "_process", None)
+        status["alive"] = process is not None and process.is_alive()
+        status["queued"] = None
+        if self.comms == "queue" and hasattr(self, "_sender"):
+            try:
+                status["queued"] = self._sender.qsize()
+            except (NotImplementedError, OSError, ValueError):  # macOS or closed queue
+                pass
+        return status
+
     def finish(
         self, verbose: bool = False, sleepduration: float = 1, sleepcycletimeout: int = 5, maxsleepcycles: int = 100000000
     ):
@@ -205,12 +394,13 @@ class ConcurrentTask:
             queuehasnotchangedcounter = 0
             while queuesize > 0 and sleepcounter < maxsleepcycles and queuehasnotchangedcounter < sleepcycletimeout:
                 time.sleep(sleepduration)
+                previous_queuesize = queuesize
                 try:
                     queuesize = self._sender.qsize()
                 except NotImplementedError:  # catch python bug on OSX
                     break
                 sleepcounter += 1
-                queuehasnotchanged = queuesize == self._sender.qsize()
+                queuehasnotchanged = queuesize == previous_queuesize
                 if queuehasnotchanged:
                     queuehasnotchangedcounter += 1
                 else:
@@ -220,6 +410,16 @@ class ConcurrentTask:
                         "\r   waiting {} seconds for {} frames to self.".format(sleepcounter, self._sender.qsize())
                     )  # frame interval in ms
 
+    def discard(self):
+        """Close the comms of a task that was never started - unread data is dropped."""
+        if self.comms == "queue":
+            self._sender.cancel_join_thread()
+        self._sender.close()
+        if self._receiver is not None and self._receiver is not self._sender:
+            self._receiver.close()
+        if self.trace is not None:
+            self._trace_queue.close()
+
     def close(self, sleep_time: float = 0.5):
         self.send(self.taskstopsignal)
         time.sleep(sleep_time)
@@ -228,9 +428,21 @@ class ConcurrentTask:
         except AttributeError:
             pass
         time.sleep(sleep_time)
+        if self.comms == "queue":
+            # data not yet read by the terminated task can no longer be delivered
+            # and would block the exit of this process
+            self._sender.cancel_join_thread()
         self._sender.close()
+        if self.trace is not None:
+            self.collect_trace()  # stamps of the items processed before the task stopped
+            self._trace_queue.close()
         del self._process
         del self._sender
         if self._receiver is not None:
             self._receiver.close()
             del self._receiver
+
+
+def callback_status(names, callbacks) -> Dict[str, Dict[str, Any]]:
+    """Status of callback tasks by name - see `ConcurrentTask.status`."""
+    return {name: callback.status() for name, callback in zip(names, callbacks) if hasattr(callback, "status")}
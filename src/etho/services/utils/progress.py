@@ -0,0 +1,101 @@
+"""Progress of services pushed over ZMQ PUB/SUB sockets.
+
+Services publish their `progress()` at a fixed interval and the head
+subscribes, instead of asking each service for its progress over RPC - a
+slow or busy service then delays its own updates, but not the head.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import zmq
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressPublisher(threading.Thread):
+    """Publishes `(name, progress())` every `interval` seconds on a PUB socket.
+
+    The socket is bound to a random free port on all interfaces - subscribe to
+    `port` with `ProgressSubscriber`. Progress that raises or is None is not
+    published.
+
+    Args:
+        name (str): Service name sent with each message.
+        progress (Callable[[], Optional[Dict[str, Any]]]): Returns the progress of the service.
+        interval (float, optional): Publishing interval in seconds. Defaults to 1.
+    """
+
+    def __init__(self, name: str, progress: Callable[[], Optional[Dict[str, Any]]], interval: float = 1.0):
+        super().__init__(daemon=True, name=f"{name}-progress")
+        self.service_name = name
+        self.progress = progress
+        self.interval = interval
+        self._context = zmq.Context()
+        self._context.LINGER = 0
+        self._socket = self._context.socket(zmq.PUB)
+        self.port = self._socket.bind_to_random_port("tcp://0.0.0.0")
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.publish()
+        while not self._stop_event.wait(self.interval):
+            self.publish()
+
+    def publish(self):
+        try:
+            progress = self.progress()
+        except Exception as e:
+            logger.debug(f"Could not get progress of {self.service_name}: {e}")
+            return
+        if progress is not None:
+            self._socket.send_pyobj((self.service_name, progress))
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self._socket.close()
+        self._context.term()
+
+
+class ProgressSubscriber:
+    """Latest progress of services published by `ProgressPublisher`s.
+
+    Args:
+        addresses (Dict[str, str]): Publisher addresses (`tcp://host:port`) by service name.
+    """
+
+    def __init__(self, addresses: Dict[str, str]):
+        self.addresses = addresses
+        self.latest: Dict[str, Dict[str, Any]] = {}
+        self.updated: Dict[str, float] = {name: time.monotonic() for name in addresses}  # `time.monotonic` of the last message
+        self._context = zmq.Context()
+        self._context.LINGER = 0
+        self._socket = self._context.socket(zmq.SUB)
+        self._socket.setsockopt(zmq.SUBSCRIBE, b"")
+        for address in addresses.values():
+            self._socket.connect(address)
+
+    def receive(self, timeout: float = 0) -> Dict[str, Dict[str, Any]]:
+        """Wait up to `timeout` seconds for progress and return the latest progress by service name."""
+        if self._socket.poll(int(1000 * timeout)):
+            while True:
+                try:
+                    name, progress = self._socket.recv_pyobj(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self.latest[name] = progress
+                self.updated[name] = time.monotonic()
+        return self.latest
+
+    def silent(self, name: str) -> float:
+        """Seconds since the last progress of service `name` (or since subscribing)."""
+        return time.monotonic() - self.updated[name]
+
+    def close(self):
+        self._socket.close()
+        self._context.term()
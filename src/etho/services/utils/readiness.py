@@ -0,0 +1,51 @@
+"""Wait for services to acknowledge that their hardware is armed.
+
+Services report through `armed()` whether the hardware started by `start()`
+is acquiring or waiting for its trigger - the head starts the next group of
+services once all services of the previous group are armed, instead of
+sleeping for a fixed time.
+"""
+
+import logging
+import time
+from typing import Any, Dict, List
+
+
+logger = logging.getLogger(__name__)
+
+ARM_TIMEOUT = 10  # seconds to wait for services to arm before starting the next group anyway
+
+
+def is_armed(service: Any) -> bool:
+    """True if `service` is armed - services without `armed` count as armed once started."""
+    armed = getattr(service, "armed", None)
+    if armed is None:
+        return True
+    try:
+        return bool(armed())
+    except Exception as e:
+        logger.debug(f"Could not check whether {service} is armed: {e}")
+        return False
+
+
+def wait_armed(services: Dict[str, Any], timeout: float = ARM_TIMEOUT, interval: float = 0.01) -> List[str]:
+    """Wait until all `services` are armed.
+
+    Args:
+        services (Dict[str, Any]): Started services by name.
+        timeout (float, optional): Seconds to wait. Defaults to 10.
+        interval (float, optional): Seconds between checks. Defaults to 0.01.
+
+    Returns:
+        List[str]: Names of the services that did not arm within `timeout`.
+    """
+    pending = dict(services)
+    deadline = time.monotonic() + timeout
+    while True:
+        pending = {name: service for name, service in pending.items() if not is_armed(service)}
+        if not pending or time.monotonic() > deadline:
+            break
+        time.sleep(interval)
+    if pending:
+        logger.warning(f"{', '.join(pending)} not armed after {timeout} seconds - continuing.")
+    return list(pending)
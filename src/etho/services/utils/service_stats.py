@@ -0,0 +1,77 @@
+"""Callback timing, stage latencies and telemetry samples of the DAQ and camera services.
+
+Shared by the classic services and their resumable counterparts.
+"""
+
+import json
+from typing import Any, Dict, List, Tuple
+
+from .concurrent_task import callback_status
+from .stats import CallbackStats, StageLatencies
+
+
+def _save_json(stats: Dict[str, Any], filename: str, log, what: str):
+    try:
+        with open(filename, "w") as f:
+            json.dump({name: value.to_dict() for name, value in stats.items()}, f, indent=2)
+    except OSError as e:
+        log.warning(f"Could not save {what}: {e}")
+
+
+class DAQStatsMixin:
+    """Callback timing of the `taskAI`, `taskAO` and `taskDO` tasks of a DAQ service.
+
+    Uses `log`, `savefilename`, `callback_names`, `callbacks` and, if set, `onset_log` of the service.
+    """
+
+    def _task_stats(self) -> Dict[str, CallbackStats]:
+        """Callback timing of each task - see `IOTask.stats`."""
+        tasks = {name: getattr(self, f"task{name}", None) for name in ("AI", "AO", "DO")}
+        return {name: task.stats for name, task in tasks.items() if getattr(task, "stats", None) is not None}
+
+    def _callback_tasks(self) -> Tuple[List[str], List[Any]]:
+        """Names and concurrent tasks of the callbacks, with the onset log."""
+        names, tasks = list(getattr(self, "callback_names", [])), list(getattr(self, "callbacks", []))
+        if getattr(self, "onset_log", None) is not None:
+            names.append("save_onsets_h5")
+            tasks.append(self.onset_log)
+        return names, tasks
+
+    def _telemetry(self) -> Dict[str, Any]:
+        tasks = {
+            name: {"calls": stats.nb_calls, "samples": stats.nb_samples, "alarms": sum(stats.alarms.values())}
+            for name, stats in self._task_stats().items()
+        }
+        return {**tasks, **callback_status(*self._callback_tasks())}
+
+    def _save_stats(self):
+        task_stats = self._task_stats()
+        if task_stats:
+            _save_json(task_stats, self.savefilename + "_daqstats.json", self.log, "callback timing")
+
+
+class CameraStatsMixin:
+    """Frame counts and stage latencies of a camera service.
+
+    Uses `log`, `savefilename`, `frameNumber`, the camera `c`, `callback_names` and `callbacks` of the service.
+    """
+
+    def _telemetry(self) -> Dict[str, Any]:
+        return {
+            "frames": self.frameNumber,
+            "camera": {"dropped": getattr(self.c, "dropped", None)},
+            **callback_status(self.callback_names, self.callbacks),
+        }
+
+    def _latencies(self) -> Dict[str, StageLatencies]:
+        """Stage latencies of the traced callbacks - see `ConcurrentTask.collect_trace`."""
+        return {
+            name: callback.collect_trace()
+            for name, callback in zip(self.callback_names, self.callbacks)
+            if getattr(callback, "trace", None) is not None
+        }
+
+    def _save_latencies(self):
+        latencies = self._latencies()
+        if latencies:
+            _save_json(latencies, self.savefilename + "_latency.json", self.log, "frame latencies")
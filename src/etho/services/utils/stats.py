@@ -0,0 +1,225 @@
+"""Fixed-size summaries of timing measurements."""
+
+import bisect
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+class LogHistogram:
+    """Histogram with logarithmically spaced buckets.
+
+    Values below `lo` are counted in the first and values above `hi` in the last
+    bucket, so the memory does not grow with the number of values.
+
+    Args:
+        lo (float, optional): Lower edge of the first bucket. Defaults to 1e-6.
+        hi (float, optional): Upper edge of the last bucket. Defaults to 1e2.
+        buckets_per_decade (int, optional): Defaults to 10.
+    """
+
+    def __init__(self, lo: float = 1e-6, hi: float = 1e2, buckets_per_decade: int = 10):
+        nb_buckets = int(round(np.log10(hi / lo) * buckets_per_decade))
+        self.edges = np.logspace(np.log10(lo), np.log10(hi), nb_buckets + 1)
+        self._edges = self.edges.tolist()  # bisect on a list is faster for single values
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)  # with under- and overflow buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_right(self._edges, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LogHistogram"):
+        """Add the values of a histogram with the same buckets."""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Histograms have different buckets.")
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper edge of the bucket containing the `q`-quantile - clipped to the min and max value."""
+        if not self.count:
+            return None
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        value = self.edges[bucket] if bucket < len(self.edges) else self.max
+        return float(min(max(value, self.min), self.max))
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.summary(), "edges": self.edges.tolist(), "counts": self.counts.tolist()}
+
+
+class CallbackStats:
+    """Timing of the `EveryNCallback` of a DAQ task, with underrun and overflow alarms.
+
+    Records the duration of each call, the interval between calls, the samples read
+    or written, and the backlog - samples written but not yet output (output tasks)
+    or acquired but not yet read (input tasks).
+
+    Args:
+        rate (float): Sampling rate in Hz.
+        nb_samples_per_event (int): Samples per callback.
+        buffer_size (int): Samples per channel in the device buffer.
+        output (bool): Output task.
+        name (str, optional): Used in alarms. Defaults to "".
+        logger (optional): Logs alarms. Defaults to None.
+        alarm_interval (float, optional): Minimal interval between alarms of one kind in seconds. Defaults to 5.
+        backlog_every (int, optional): Tasks whose backlog is costly to query sample it every `backlog_every` calls - see `backlog_due`.
+                                       Defaults to 10.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        nb_samples_per_event: int,
+        buffer_size: int,
+        output: bool,
+        name: str = "",
+        logger=None,
+        alarm_interval: float = 5,
+        backlog_every: int = 10,
+    ):
+        self.rate = rate
+        self.nb_samples_per_event = nb_samples_per_event
+        self.buffer_size = buffer_size
+        self.output = output
+        self.name = name
+        self.log = logger
+        self.alarm_interval = alarm_interval
+        self.backlog_every = max(1, int(backlog_every))
+        self.duration = LogHistogram(1e-6, 1e2)
+        self.interval = LogHistogram(1e-6, 1e2)
+        self.samples = LogHistogram(1, 1e9)
+        self.backlog = LogHistogram(1, 1e9)
+        self.reset()
+
+    def reset(self):
+        for histogram in (self.duration, self.interval, self.samples, self.backlog):
+            histogram.reset()
+        self.nb_calls = 0
+        self.nb_samples = 0
+        self.alarms = {"underrun": 0, "overflow": 0, "overrun": 0}
+        self._last_start = None
+        self._last_alarm = {}
+
+    def backlog_due(self) -> bool:
+        """Whether to query the backlog for the next call."""
+        return self.nb_calls % self.backlog_every == 0
+
+    def record(self, start: float, stop: float, nb_samples: int, backlog: Optional[int] = None):
+        """Record a call that ran from `start` to `stop` (`time.perf_counter`)."""
+        duration = stop - start
+        self.duration.add(duration)
+        if self._last_start is not None:
+            self.interval.add(start - self._last_start)
+        self._last_start = start
+        self.samples.add(nb_samples)
+        self.nb_calls += 1
+        self.nb_samples += nb_samples
+
+        if duration > self.nb_samples_per_event / self.rate:
+            self._alarm("overrun", f"callback took {1000 * duration:1.1f} ms for {1000 * self.nb_samples_per_event / self.rate:1.1f} ms of samples")
+        if backlog is not None:
+            self.backlog.add(backlog)
+            if self.output and backlog < self.nb_samples_per_event:
+                self._alarm("underrun", f"output buffer about to run empty - {backlog} samples left")
+            elif not self.output and backlog > self.buffer_size / 2:
+                self._alarm("overflow", f"input buffer about to overflow - {backlog} of {self.buffer_size} samples not read")
+
+    def _alarm(self, kind: str, message: str):
+        self.alarms[kind] += 1
+        now = time.monotonic()
+        if now - self._last_alarm.get(kind, -np.inf) >= self.alarm_interval:
+            self._last_alarm[kind] = now
+            if self.log is not None:
+                self.log.warning(f"{self.name}: {message} ({self.alarms[kind]} {kind} alarms so far).")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "calls": self.nb_calls,
+            "samples": self.nb_samples,
+            "alarms": dict(self.alarms),
+            "duration": self.duration.summary(),
+            "interval": self.interval.summary(),
+            "backlog": self.backlog.summary(),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.summary(),
+            "rate": self.rate,
+            "nb_samples_per_event": self.nb_samples_per_event,
+            "buffer_size": self.buffer_size,
+            "duration": self.duration.to_dict(),
+            "interval": self.interval.to_dict(),
+            "samples_per_call": self.samples.to_dict(),
+            "backlog": self.backlog.to_dict(),
+        }
+
+
+class StageLatencies:
+    """Latencies of sampled items on their way from a service to a concurrent task.
+
+    The service stamps when an item was acquired and when its send started and
+    returned, the task stamps when it received the item and when it was done
+    with it (asked for the next item). All stamps are `time.perf_counter`,
+    which uses a system-wide clock, so stamps from both processes can be
+    compared. Stamps of the service are kept until the stamps of the task arrive.
+
+    Args:
+        max_pending (int, optional): Stamps of sent items kept for matching - the oldest are dropped. Defaults to 1000.
+    """
+
+    STAGES = ("acquired to send", "send", "send to receive", "receive to done", "acquired to done")
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self.stages = {stage: LogHistogram(1e-6, 1e2, buckets_per_decade=50) for stage in self.STAGES}  # 5% resolution
+        self._pending: Dict[int, tuple] = {}
+
+    def sent(self, seq: int, acquired: float, send_start: float, send_stop: float):
+        if len(self._pending) >= self.max_pending:
+            del self._pending[next(iter(self._pending))]
+        self._pending[seq] = (acquired, send_start, send_stop)
+
+    def received(self, seq: int, receive: float, done: float):
+        stamps = self._pending.pop(seq, None)
+        if stamps is None:
+            return
+        acquired, send_start, send_stop = stamps
+        self.stages["acquired to send"].add(send_start - acquired)
+        self.stages["send"].add(send_stop - send_start)
+        self.stages["send to receive"].add(receive - send_stop)
+        self.stages["receive to done"].add(done - receive)
+        self.stages["acquired to done"].add(done - acquired)
+
+    def summary(self) -> Dict[str, Any]:
+        return {stage: histogram.summary() for stage, histogram in self.stages.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {stage: histogram.to_dict() for stage, histogram in self.stages.items()}
@@ -0,0 +1,161 @@
+"""Time series of the health of a service, saved with each recording."""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import psutil
+
+
+logger = logging.getLogger(__name__)
+
+# columns ending in these names count up - summarized as totals and rates
+COUNTERS = {"frames", "dropped", "received", "processed", "errors", "bytes", "calls", "samples", "alarms", "write_bytes"}
+
+
+def flatten(metrics: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """Numeric values of nested dicts by dotted name - None becomes NaN, other values are dropped."""
+    flat = {}
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=f"{name}."))
+        elif value is None:
+            flat[name] = np.nan
+        elif isinstance(value, (bool, int, float, np.number)):
+            flat[name] = float(value)
+    return flat
+
+
+def task_pids(names: Iterable[str], tasks: Iterable[Any]) -> Dict[str, int]:
+    """Process ids of started concurrent tasks by name."""
+    pids = {}
+    for name, task in zip(names, tasks):
+        pid = getattr(getattr(task, "_process", None), "pid", None)
+        if pid is not None:
+            pids[name] = pid
+    return pids
+
+
+class TelemetryRecorder(threading.Thread):
+    """Samples the metrics of a service, and CPU, memory and disk writes of its processes.
+
+    Each sample is a row with the time, the flattened output of `sample`, and per
+    process `<name>.cpu` (percent), `<name>.rss` (bytes) and `<name>.write_bytes`
+    (bytes written since the process started - not available on macOS). Columns
+    missing from a row, for instance of processes that already stopped, are NaN.
+
+    Args:
+        sample (Callable[[], Dict[str, Any]]): Returns the metrics of the service - counters like frames or levels like queue sizes.
+        processes (Callable[[], Dict[str, int]], optional): Returns the ids of the processes to sample by name.
+                                                            Defaults to None (only this process, as "service").
+        interval (float, optional): Sampling interval in seconds. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        sample: Callable[[], Dict[str, Any]],
+        processes: Optional[Callable[[], Dict[str, int]]] = None,
+        interval: float = 1.0,
+    ):
+        super().__init__(daemon=True)
+        self.sample = sample
+        self.processes = processes
+        self.interval = interval
+        self.rows: List[Dict[str, float]] = []
+        self._processes: Dict[int, psutil.Process] = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.record()
+        while not self._stop_event.wait(self.interval):
+            self.record()
+
+    def stop(self):
+        """Stop sampling after a last sample."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.record()
+
+    def record(self):
+        row = {"time": time.time()}
+        try:
+            row.update(flatten(self.sample()))
+        except Exception as e:
+            logger.debug(f"Could not sample service metrics: {e}")
+
+        pids = {"service": os.getpid()}
+        if self.processes is not None:
+            try:
+                pids.update(self.processes())
+            except Exception as e:
+                logger.debug(f"Could not list processes: {e}")
+        for name, pid in pids.items():
+            try:
+                if pid not in self._processes:
+                    self._processes[pid] = psutil.Process(pid)
+                    self._processes[pid].cpu_percent()  # first call starts the measurement
+                process = self._processes[pid]
+                with process.oneshot():
+                    row[f"{name}.cpu"] = process.cpu_percent()
+                    row[f"{name}.rss"] = process.memory_info().rss
+                    if hasattr(process, "io_counters"):
+                        row[f"{name}.write_bytes"] = process.io_counters().write_bytes
+            except psutil.Error:  # process finished
+                continue
+        self.rows.append(row)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        names = list(dict.fromkeys(name for row in self.rows for name in row))
+        return {name: np.array([row.get(name, np.nan) for row in self.rows], dtype=np.float64) for name in names}
+
+    def save(self, filename: str):
+        """Save the columns to an npz file - load with `np.load(filename)`."""
+        np.savez_compressed(filename, **self.columns())
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals and rates of counters and mean and max of all other columns."""
+        columns = self.columns()
+        if not columns:
+            return {"samples": 0}
+        times = columns.pop("time")
+        duration = times[-1] - times[0]
+        summary = {"samples": len(times), "duration": duration, "columns": {}}
+        for name, values in columns.items():
+            valid = values[np.isfinite(values)]
+            if not len(valid):
+                continue
+            if name.rsplit(".", 1)[-1] in COUNTERS:
+                total = valid[-1] - valid[0]
+                summary["columns"][name] = {"total": total, "rate": total / duration if duration else None}
+            else:
+                summary["columns"][name] = {"mean": float(np.mean(valid)), "max": float(np.max(valid))}
+        return summary
+
+    def log_summary(self, log: logging.Logger):
+        summary = self.summary()
+        if not summary["samples"]:
+            return
+        log.info(f"Telemetry of {summary['duration']:1.1f} s ({summary['samples']} samples):")
+        for name, stats in summary["columns"].items():
+            if "total" in stats:
+                rate = f" ({stats['rate']:1.2f}/s)" if stats["rate"] is not None else ""
+                log.info(f"   {name}: {stats['total']:g}{rate}")
+            else:
+                log.info(f"   {name}: mean {stats['mean']:g}, max {stats['max']:g}")
+
+
+def save_telemetry(recorder: Optional[TelemetryRecorder], filename: str, log: logging.Logger):
+    """Stop `recorder`, save its samples to `filename` and log the summary - runs that never started are not saved."""
+    if recorder is None or recorder.ident is None:
+        return
+    recorder.stop()
+    try:
+        recorder.save(filename)
+    except OSError as e:
+        log.warning(f"Could not save telemetry: {e}")
+    recorder.log_summary(log)
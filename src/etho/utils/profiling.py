@@ -0,0 +1,234 @@
+"""Sampling profiler for the service and callback processes of a run.
+
+Profiling is switched on for all processes of a run through the `ETHO_PROFILE`
+environment variable, which holds the folder for the profiles and is inherited
+by the service and callback processes. Each process samples the stacks of all
+its threads and saves them to `<folder>/<name>-<pid>.pstats` (open with
+`pstats.Stats` or snakeviz) and `<folder>/<name>-<pid>.collapsed` (collapsed
+stacks for flamegraph.pl or speedscope). `merge` combines the collapsed stacks
+of all processes into one file.
+"""
+
+import atexit
+import collections
+import glob
+import logging
+import marshal
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Any, Callable, Counter, Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+ENV_VAR = "ETHO_PROFILE"
+INTERVAL = 0.01  # seconds between stack samples
+DUMP_INTERVAL = 10  # seconds between saves - processes that are killed keep the profile up to the last save
+
+Frame = Tuple[str, int, str]  # pstats function key - filename, first line, name
+
+_profiler: Optional["StackSampler"] = None
+
+
+def _label(function: Frame) -> str:
+    filename, line, name = function
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path + os.sep):
+            filename = filename[len(path) + 1 :]
+            break
+    return f"{name} ({filename}:{line})".replace(";", ":")
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of all threads of this process.
+
+    Call counts in the pstats files are sample counts and times are sample
+    counts times the mean interval between samples - they show where the
+    process spends time, not how often functions are called.
+
+    Args:
+        name (str): Process name used in the file names - for instance the service or callback.
+        folder (str): Folder for the profiles - created if it does not exist.
+        interval (float, optional): Seconds between samples. Defaults to 0.01.
+        dump_interval (float, optional): Seconds between saves of the profiles. Defaults to 10.
+    """
+
+    def __init__(self, name: str, folder: str, interval: float = INTERVAL, dump_interval: float = DUMP_INTERVAL):
+        super().__init__(daemon=True, name="etho-profiler")
+        self.pid = os.getpid()
+        self.interval = interval
+        self.dump_interval = dump_interval
+        os.makedirs(folder, exist_ok=True)
+        self.filename = os.path.join(folder, f"{name}-{self.pid}")
+        self.stacks: Counter[Tuple[str, Tuple[Frame, ...]]] = collections.Counter()
+        self.nb_samples = 0
+        self.seconds = 0.0  # from the start to the last sample
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = last_dump = time.monotonic()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+            self.seconds = time.monotonic() - start
+            if time.monotonic() - last_dump > self.dump_interval:
+                self.dump()
+                last_dump = time.monotonic()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with self._lock:
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+            self.nb_samples += 1
+
+    def stop(self):
+        """Stop sampling and save the profiles."""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.dump()
+
+    def stats(self) -> Dict[Frame, Tuple[int, int, float, float, Dict[Frame, Tuple[int, int, float, float]]]]:
+        """Samples in the format of `pstats` - `{function: (calls, calls, self time, cumulative time, callers)}`."""
+        own: Counter[Frame] = collections.Counter()
+        cumulative: Counter[Frame] = collections.Counter()
+        callers: Dict[Frame, Counter[Frame]] = collections.defaultdict(collections.Counter)
+        with self._lock:
+            stacks = list(self.stacks.items())
+            # the interval can be longer than `interval` if other threads hold the GIL
+            seconds_per_sample = self.seconds / self.nb_samples if self.nb_samples else self.interval
+        for (_, stack), count in stacks:
+            own[stack[-1]] += count
+            for function in set(stack):  # count recursive functions once
+                cumulative[function] += count
+            for caller, function in set(zip(stack[:-1], stack[1:])):
+                callers[function][caller] += count
+        stats = {}
+        for function, count in cumulative.items():
+            stats[function] = (
+                count,
+                count,
+                own[function] * seconds_per_sample,
+                count * seconds_per_sample,
+                {caller: (n, n, 0.0, n * seconds_per_sample) for caller, n in callers[function].items()},
+            )
+        return stats
+
+    def collapsed(self) -> Dict[str, int]:
+        """Sample counts by collapsed stack - `thread;outer function;...;inner function`."""
+        with self._lock:
+            stacks = list(self.stacks.items())
+        collapsed: Counter[str] = collections.Counter()
+        for (thread, stack), count in stacks:
+            collapsed[";".join([thread.replace(";", ":"), *map(_label, stack)])] += count
+        return collapsed
+
+    def dump(self):
+        """Save the profiles - `<name>-<pid>.pstats` and `<name>-<pid>.collapsed`."""
+        try:
+            with open(self.filename + ".pstats", "wb") as f:
+                marshal.dump(self.stats(), f)
+            with open(self.filename + ".collapsed", "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in self.collapsed().items())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not save profile {self.filename}: {e}")
+
+
+def folder() -> Optional[str]:
+    """Profile folder of the run - None if not profiling."""
+    return os.environ.get(ENV_VAR) or None
+
+
+def enable(profile_folder: str):
+    """Profile this process and all service and callback processes started after this call."""
+    os.environ[ENV_VAR] = os.path.abspath(profile_folder)
+
+
+def start(name: str) -> Optional[StackSampler]:
+    """Start profiling this process if profiling is enabled - the profiles are saved at exit or with `stop`.
+
+    Args:
+        name (str): Process name used in the file names.
+
+    Returns:
+        Optional[StackSampler]: None if not profiling.
+    """
+    global _profiler
+    profile_folder = folder()
+    if profile_folder is None:
+        return None
+    if _profiler is not None and _profiler.pid == os.getpid():
+        return _profiler
+    _profiler = StackSampler(name, profile_folder)  # replaces the profiler inherited by forked processes
+    _profiler.start()
+    atexit.register(stop)
+    logger.info(f"Profiling {name} (pid {_profiler.pid}) to {profile_folder}.")
+    return _profiler
+
+
+def stop():
+    """Stop profiling this process and save the profiles."""
+    global _profiler
+    if _profiler is None or _profiler.pid != os.getpid():
+        return
+    profiler, _profiler = _profiler, None
+    profiler.stop()
+
+
+def _exit(signum, frame):
+    sys.exit(128 + signum)
+
+
+def run_profiled(target: Callable, name: str, *args, **kwargs) -> Any:
+    """Run `target(*args, **kwargs)` profiled - the process target of profiled `ConcurrentTask`s.
+
+    Terminating the process ends `target` with `SystemExit`, so the profiles are saved.
+    """
+    start(name)
+    signal.signal(signal.SIGTERM, _exit)
+    try:
+        return target(*args, **kwargs)
+    finally:
+        stop()
+
+
+def merge(profile_folder: str, filename: str) -> int:
+    """Merge the collapsed stacks of all processes in `profile_folder` into `filename`.
+
+    Stacks start with the process (`<name>-<pid>`) and the thread.
+
+    Returns:
+        int: Number of merged processes.
+    """
+    files = sorted(glob.glob(os.path.join(profile_folder, "*.collapsed")))
+    with open(filename, "w") as merged:
+        for path in files:
+            process = os.path.splitext(os.path.basename(path))[0]
+            with open(path) as f:
+                merged.writelines(f"{process};{line}" for line in f if line.strip())
+    return len(files)
+
+
+def finish(filename: str):
+    """Stop profiling this process and merge the collapsed stacks of all processes of the run into `filename`.
+
+    Processes started after this call are not profiled.
+    """
+    profile_folder = folder()
+    os.environ.pop(ENV_VAR, None)
+    stop()
+    if profile_folder is None:
+        return
+    nb_processes = merge(profile_folder, filename)
+    logger.info(f"Merged profiles of {nb_processes} processes into {filename}.")
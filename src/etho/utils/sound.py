@@ -1,4 +1,6 @@
-from typing import Callable, List, Union, Dict
+from typing import Callable, List, Union, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
 import os
 import random
 import numpy as np
@@ -6,6 +8,10 @@ import pandas as pd
 import scipy.io.wavfile as wav
 import scipy.signal
 import h5py
+from .stimcache import StimulusCache
+
+
+logger = logging.getLogger(__name__)
 
 
 PLAYLIST_COLUMNS = ["stimFileName", "silencePre", "silencePost", "intensity", "freq"]
@@ -24,6 +30,87 @@ def parse_cell(cell, dtype: Callable = None) -> List:
     return token
 
 
+# Parsed playlist files, keyed by path, modification time, size and parse args.
+_parsed_tables: Dict[tuple, pd.DataFrame] = {}
+_PARSED_TABLES_MAX = 32
+
+# Columns of a parsed table as flat values plus number of values per row.
+Columns = Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+def _parse_column(column: pd.Series, dtype: Callable = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized `parse_cell` for a whole column.
+
+    Returns:
+        values (np.ndarray): all values of the column, row after row.
+        counts (np.ndarray): number of values in each row.
+    """
+    if not (pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)):
+        # numeric columns hold a single value per cell - do not cast, like `parse_cell`
+        return column.to_numpy(dtype=object), np.ones(len(column), dtype=np.intp)
+
+    cells = column.to_numpy(dtype=object)
+    is_str = np.fromiter((isinstance(cell, str) for cell in cells), dtype=bool, count=len(cells))
+    counts = np.ones(len(cells), dtype=np.intp)
+    values = np.empty(len(cells), dtype=object)
+    if is_str.any():
+        strs = np.char.strip(cells[is_str].astype(str))
+        strs = np.char.rstrip(np.char.lstrip(strs, "["), "]")
+        counts[is_str] = np.char.count(strs, ",") + 1
+        # splitting the joined cells in one go yields the tokens of all cells in order
+        tokens = np.array(",".join(strs.tolist()).split(","))
+        tokens = np.char.strip(np.char.strip(tokens), "'\"")
+        if dtype is float:
+            tokens = tokens.astype(float)
+        elif dtype is not None and dtype is not str:
+            tokens = [dtype(token) for token in tokens.tolist()]
+        values = np.empty(counts.sum(), dtype=object)
+        values[np.repeat(is_str, counts)] = tokens
+    # non-string cells are kept as is
+    values[np.repeat(~is_str, counts)] = cells[~is_str]
+    return values, counts
+
+
+def _normalize_columns(columns: Columns) -> Columns:
+    """Repeat the first value of cells with fewer values than stimFileName."""
+    nchans = columns["stimFileName"][1]
+    normalized = {}
+    for name, (values, counts) in columns.items():
+        fill = counts < nchans
+        new_counts = np.where(fill, nchans, counts)
+        starts = np.repeat(np.cumsum(counts) - counts, new_counts)
+        within = np.arange(new_counts.sum()) - np.repeat(np.cumsum(new_counts) - new_counts, new_counts)
+        within[np.repeat(fill, new_counts)] = 0
+        normalized[name] = (values[starts + within], new_counts)
+    return normalized
+
+
+def _columns_to_table(columns: Columns, index=None) -> pd.DataFrame:
+    """Split flat column values into one list per cell."""
+    data = {}
+    for name, (values, counts) in columns.items():
+        values = values.tolist()
+        bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+        data[name] = pd.Series([values[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])], dtype=object, index=index)
+    return pd.DataFrame(data, index=index)
+
+
+def _table_to_columns(table: pd.DataFrame) -> Columns:
+    columns = {}
+    for name, column in table.items():
+        cells = column.tolist()
+        counts = np.fromiter((len(cell) for cell in cells), dtype=np.intp, count=len(cells))
+        values = np.empty(counts.sum(), dtype=object)
+        values[:] = [value for cell in cells for value in cell]
+        columns[name] = (values, counts)
+    return columns
+
+
+def _copy_table(table: pd.DataFrame) -> pd.DataFrame:
+    """Copy of a parsed table whose list cells are not shared with `table`."""
+    return table.apply(lambda column: column.map(list))
+
+
 def parse_table(
     table: Union[pd.DataFrame, str],
     dtypes: List[Callable] = [str, float, float, float, float],
@@ -31,22 +118,33 @@ def parse_table(
 ) -> pd.DataFrame:
     """Parse table to desired types.
 
+    Parsed playlist files are cached until the file changes.
+
     Args:
         table - either string (filepath pointing to playlist file) or dataframe
         dtypes - types each col to cast to - methods which return the desired type
     Returns:
         table (dataframe)
     """
+    cache_key = None
     if isinstance(table, str):
+        stat = os.stat(table)
+        cache_key = (os.path.abspath(table), stat.st_mtime_ns, stat.st_size, tuple(dtypes), normalize)
+        if cache_key in _parsed_tables:
+            return _copy_table(_parsed_tables[cache_key])
         table = pd.read_table(table, dtype=None, delimiter="\t", decimal=".")
+
     table = table[PLAYLIST_COLUMNS]
-    tb = table.to_numpy(dtype=object, copy=True)
-    for row, row_values in enumerate(tb):
-        for col, cell in enumerate(row_values):
-            tb[row, col] = parse_cell(cell, dtypes[col])
-    df = pd.DataFrame(tb, columns=table.columns)
+    columns = {name: _parse_column(table[name], dtype) for name, dtype in zip(table.columns, dtypes)}
     if normalize:
-        df = normalize_table(df)
+        columns = _normalize_columns(columns)
+    df = _columns_to_table(columns)
+
+    if cache_key is not None:
+        if len(_parsed_tables) >= _PARSED_TABLES_MAX:
+            _parsed_tables.pop(next(iter(_parsed_tables)))
+        _parsed_tables[cache_key] = df
+        df = _copy_table(df)
     return df
 
 
@@ -55,15 +153,7 @@ def normalize_table(table: pd.DataFrame) -> pd.DataFrame:
 
     E.g. if two stimFileName but only one intensity, will duplicate the intensity entries.
     """
-    # strict - throw error in case of inconsistencies
-    tb = table.to_numpy(dtype=object, copy=True)
-    for row, row_values in enumerate(tb):
-        nchans = len(row_values[0])  # 1. get n stim channels from len(stimFileName)
-        for col, cell in enumerate(row_values[1:]):
-            if len(cell) < nchans:
-                tb[row, col + 1] = [cell[0]] * nchans  # 2. fill remaining cols to match len(stimFileName)
-    df = pd.DataFrame(tb, columns=table.columns)
-    return df
+    return _columns_to_table(_normalize_columns(_table_to_columns(table)), index=table.index)
 
 
 def select_channels_from_playlist(playlist: pd.DataFrame, channels_to_keep: List[str]):
@@ -76,15 +166,17 @@ def select_channels_from_playlist(playlist: pd.DataFrame, channels_to_keep: List
     Returns:
         pd.DataFrame: playlist with selected channels
     """
+
+    def select(cell):
+        if isinstance(cell, (list, tuple)):
+            return [cell[channel] for channel in channels_to_keep]
+        if isinstance(cell, np.ndarray):
+            return cell[channels_to_keep]
+        return cell
+
     playlist_new = playlist.copy()
-    for col_name, col_data in playlist_new.iteritems():
-        for row_name, row_data in col_data.iteritems():
-            if isinstance(row_data, (list, tuple)):
-                # playlist_new.set_value(row_name, col_name, [row_data[channel] for channel in channels_to_keep])
-                playlist_new.at[row_name, col_name] = [row_data[channel] for channel in channels_to_keep]
-            if isinstance(row_data, np.ndarray):
-                # playlist_new.set_value(row_name, col_name, np.array(row_data)[channels_to_keep])
-                playlist_new.at[row_name, col_name] = np.array(row_data)[channels_to_keep]
+    for col_name in playlist_new.columns:
+        playlist_new[col_name] = playlist_new[col_name].map(select).astype(object)
     return playlist_new
 
 
@@ -175,34 +267,309 @@ def build_playlist(
     fs: float,
     shuffle=False,
     sound_order=None,
+    seed: Optional[int] = None,
+    return_onsets: bool = False,
 ):
-    """Block-shuffle playlist and concatenate to duration."""
+    """Block-shuffle playlist and concatenate to duration.
+
+    Args:
+        soundlist (List[np.ndarray]): stimuli - only their lengths are used.
+        duration (float): Duration of the playlist in seconds.
+                          Blocks of `sound_order` are repeated until the duration is reached.
+                          -1 plays `sound_order` once.
+        fs (float): Sampling rate.
+        shuffle (bool, optional): Randomize the order within each block. Defaults to False.
+        sound_order (Sequence[int], optional): Indices into soundlist that make up a block.
+                                               Defaults to None (all sounds in order).
+        seed (int, optional): Seed for shuffling. Defaults to None (drawn from the global `np.random` state,
+                              so `np.random.seed` makes shuffled playlists reproducible).
+        return_onsets (bool, optional): Also return the onset of each item in samples. Defaults to False.
+
+    Returns:
+        playlist_items (List[int]): index into `soundlist` for each item.
+        totallen (float): duration of the playlist in seconds.
+        onsets (np.ndarray): onset sample of each item - only if `return_onsets`.
+    """
     if sound_order is None:
         sound_order = np.arange(len(soundlist))
+    sound_order = np.asarray(sound_order, dtype=np.intp)
+    lengths = np.array([len(sound) for sound in soundlist], dtype=np.int64)
+    if shuffle and seed is None:  # keeps playlists reproducible with `np.random.seed`
+        seed = np.random.randint(2**32, dtype=np.uint32)
+    rng = np.random.default_rng(seed)
 
-    totallen = 0
     if duration > 0:
-        playlist_items = list()
+        block_len = lengths[sound_order].sum()
+        if block_len == 0:
+            raise ValueError("Cannot fill playlist - all stimuli are empty.")
+        # one spare block guards against rounding at the cut point
+        nb_blocks = int(np.ceil(duration * fs / block_len)) + 1
+        blocks = np.tile(sound_order, (nb_blocks, 1))
+        if shuffle:  # re-shuffle each block
+            blocks = rng.permuted(blocks, axis=1)
+        items = blocks.ravel()
         # add sounds to list as long as total duration is shorter than max duration
-        while totallen < duration:
-            # re-shuffle at the end of each block
-            if shuffle and len(playlist_items) % len(sound_order) == 0:
-                sound_order = np.random.permutation(sound_order)
-
-            next_item = sound_order[len(playlist_items) % len(sound_order)]
-            playlist_items.append(next_item)
-            totallen += len(soundlist[playlist_items[-1]]) / fs
+        ends = np.cumsum(lengths[items])
+        nb_items = min(int(np.searchsorted(ends, duration * fs, side="left")) + 1, len(items))
+        items = items[:nb_items]
     elif duration == -1:  # play sound_order once
-        if shuffle:
-            sound_order = np.random.permutation(sound_order)
-        playlist_items = sound_order.tolist()
-
-        # get total duration of playlist
-        for item in playlist_items:
-            totallen += len(soundlist[item]) / fs
+        items = rng.permutation(sound_order) if shuffle else sound_order
+    else:
+        raise ValueError(f"Duration should be positive or -1 but is {duration}.")
+
+    ends = np.cumsum(lengths[items])
+    totallen = float(ends[-1] / fs) if len(ends) else 0
+    playlist_items = items.tolist()
+    if return_onsets:
+        onsets = np.concatenate(([0], ends[:-1])).astype(np.int64)
+        return playlist_items, totallen, onsets
     return playlist_items, totallen
 
 
+class PlaylistArray:
+    """Virtual concatenation of stimuli in play order.
+
+    Stores each unique stimulus once plus the play order instead of the
+    concatenated session, so memory scales with the stimulus set and not with
+    the session duration. Exposes `shape`, `ndim` and `dtype` like the
+    concatenated array and streams the session in blocks via `blocks`.
+    """
+
+    ndim = 2
+
+    def __init__(
+        self,
+        sounds: List[np.ndarray],
+        play_order,
+        columns: slice = slice(None),
+        dtype=None,
+    ):
+        """
+        Args:
+            sounds (List[np.ndarray]): Unique stimuli (time x channels).
+            play_order: Indices into `sounds` in the order they are played.
+            columns (slice, optional): Channels to keep from each stimulus. Defaults to all channels.
+            dtype (optional): Cast stimuli to this type. Defaults to None (keep the type of the stimuli).
+        """
+        self.sounds = [np.ascontiguousarray(np.asarray(sound)[:, columns], dtype=dtype) for sound in sounds]
+        self.play_order = np.asarray(play_order, dtype=np.intp).reshape(-1)
+        lengths = np.array([len(sound) for sound in self.sounds], dtype=np.int64)
+        self.offsets = np.zeros(len(self.play_order) + 1, dtype=np.int64)
+        np.cumsum(lengths[self.play_order], out=self.offsets[1:])
+        nb_channels = self.sounds[0].shape[1] if self.sounds else 0
+        self.shape = (int(self.offsets[-1]), nb_channels)
+        self.dtype = self.sounds[0].dtype if self.sounds else np.dtype(dtype)
+
+    @classmethod
+    def silence(cls, nb_samples: int, nb_channels: int, dtype=np.float64, block_size: int = 10_000):
+        """Zeros of shape (nb_samples, nb_channels) that only allocate a single block."""
+        nb_samples = max(0, int(nb_samples))
+        block_size = max(1, min(int(block_size), nb_samples))
+        nb_blocks, remainder = divmod(nb_samples, block_size)
+        sounds = [np.zeros((block_size, nb_channels), dtype=dtype), np.zeros((remainder, nb_channels), dtype=dtype)]
+        play_order = [0] * nb_blocks + ([1] if remainder else [])
+        return cls(sounds, play_order, dtype=dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        if not len(self.play_order):
+            return np.zeros(self.shape, dtype=dtype or self.dtype)
+        return np.concatenate([self.sounds[item] for item in self.play_order], axis=0).astype(dtype or self.dtype, copy=False)
+
+    def blocks(self, min_samples: int = 0):
+        """Yield the session in play order.
+
+        Consecutive stimuli are joined until a block has at least `min_samples` samples.
+
+        Args:
+            min_samples (int, optional): Minimal number of samples per block. Defaults to 0 (one block per stimulus).
+        """
+        pending = []
+        nb_pending = 0
+        for item in self.play_order:
+            pending.append(self.sounds[item])
+            nb_pending += len(self.sounds[item])
+            if nb_pending >= min_samples:
+                yield pending[0] if len(pending) == 1 else np.concatenate(pending, axis=0)
+                pending = []
+                nb_pending = 0
+        if pending:
+            yield pending[0] if len(pending) == 1 else np.concatenate(pending, axis=0)
+
+
+def _load_file(stimName: str, fs: float, stimfolder: str = "./", stim_key: str = "stimulus") -> np.ndarray:
+    """Load stimulus from a WAV or HDF5 file and resample WAV files to fs."""
+    x = np.zeros((0, 1))
+    if stimName.endswith(".wav"):  # WAV file
+        # return time x channels
+        wav_rate, x = wav.read(os.path.join(stimfolder, stimName))
+        x = x.astype(np.float32) / 32768
+        if wav_rate != fs:  # resample to fs
+            x = scipy.signal.resample_poly(x, int(fs), int(wav_rate), axis=0)
+    elif stimName.endswith(".h5"):  # HDF5 file
+        with h5py.File(os.path.join(stimfolder, stimName), "r") as f:
+            try:
+                x = f[stim_key][:].astype(np.float32)
+            except KeyError as e:
+                print(e)
+    return x
+
+
+def _load_files(
+    stimNames: List[str],
+    fs: float,
+    stimfolder: str = "./",
+    stim_key: str = "stimulus",
+    num_workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, np.ndarray]:
+    """Load and resample stimulus files concurrently.
+
+    Reading and resampling release the GIL, so threads suffice.
+    """
+    loaded = {}
+    if not stimNames:
+        return loaded
+
+    logger.info(f"Loading {len(stimNames)} stimulus files.")
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(_load_file, stimName, fs, stimfolder, stim_key): stimName for stimName in stimNames}
+        for cnt, future in enumerate(as_completed(futures)):
+            loaded[futures[future]] = future.result()
+            logger.debug(f"   loaded {futures[future]} ({cnt + 1}/{len(futures)}).")
+            if progress is not None:
+                progress(cnt + 1, len(futures))
+    return loaded
+
+
+def _render_row(
+    listitem: pd.Series,
+    last_row: bool,
+    fs: float,
+    attenuation: Dict[float, float] = None,
+    stimfolder: str = "./",
+    stim_key: str = "stimulus",
+    ignore_stop: bool = False,
+    loaded: Optional[Dict[str, np.ndarray]] = None,
+    dtype: np.dtype = np.float64,
+) -> np.ndarray:
+    """Render a single playlist row to a [time, channels] array.
+
+    Stimulus files are taken from `loaded` if present there.
+    """
+    xx = [None] * len(listitem.stimFileName)
+    for stimIdx, stimName in enumerate(listitem.stimFileName):
+        x = np.zeros((0, 1))
+        # These all acknowledge the pre/post stim silence: SIN, PUL, *.wav, *.h5
+        if stimName[:3] == "SIN":  # SIN_FREQ_PHASE_DURATION
+            # print('sine')
+            token = stimName[4:].split("_")
+            token = [float(item) for item in token]
+            freq, phase, duration = token[:3]
+            x = make_sine(freq, phase, duration, fs)
+        elif stimName[:3] == "PUL":  # PUL_DUR_PAU_NUM_DEL
+            # print('pulse')
+            token = stimName[4:].split("_")
+            token = [float(item) for item in token]
+            pulsedur, pulsepause, pulsenumber, pulsedelay = token[:4]
+            x = make_pulse(pulsedur, pulsepause, pulsenumber, pulsedelay, fs)
+        elif stimName.endswith((".wav", ".h5")):
+            if loaded is not None and stimName in loaded:
+                x = loaded[stimName]
+            else:
+                x = _load_file(stimName, fs, stimfolder, stim_key)
+
+        xx[stimIdx] = np.ravel(x)
+
+    # pre/post pend silence to channels with a waveform
+    spans = []
+    for stimIdx, x in enumerate(xx):
+        sample_start, sample_end = 0, 0
+        if len(x):
+            sample_start = np.intp(listitem.silencePre[stimIdx] / 1000 * fs)
+            sample_end = np.intp(listitem.silencePost[stimIdx] / 1000 * fs)
+        spans.append((sample_start, sample_start + len(x), sample_start + len(x) + sample_end))
+
+    # allocate the row once at its final length - shorter channels are zero-padded
+    max_len = max([span[-1] for span in spans])
+    out = np.zeros((max_len, len(xx)), dtype=dtype)
+    for stimIdx, (x, (start, stop, _)) in enumerate(zip(xx, spans)):
+        # if `attenuation` arg is provided:
+        gain = float(attenuation[listitem.freq[stimIdx]]) if attenuation else 1.0
+        if len(x):
+            chan = out[start:stop, stimIdx]
+            chan[:] = x
+            chan *= gain
+            # set_volume
+            chan *= float(listitem.intensity[stimIdx])  # "* 20" NOT USED FOR DAQ
+
+    for cnt, stimName in enumerate(listitem.stimFileName):
+        x = out[:, cnt]
+        # These DO NOT acknowledge silencePre/Post - will start at the first sample (during pre stim silence) and end at the last sample (end of post stim silence:
+        # SI_START, SI_STOP, SI_NEXT, CLOCK_durMS_pauMS
+        if stimName == "SI_START":
+            x[:20] = 1
+        elif stimName == "SI_NEXT":
+            x[-20:-2] = 1
+        elif stimName == "SI_STOP":
+            # if playlist is not shuffled, add STOP trigger to last stimulus in the playlist
+            if not ignore_stop and last_row:
+                x[-20:-2] = 1
+        elif stimName[:5] == "CLOCK":
+            token = stimName[5:].split("_")
+            token = [float(item) for item in token]
+            pulsedur, pulsepause = token[:2]
+            pulseperiod = pulsedur + pulsepause
+            pulsenumber = (len(x) / fs * 1000) // pulseperiod + 1
+            tmp_x = make_pulse(
+                pulsedur,
+                pulsepause,
+                pulseNumber=pulsenumber,
+                pulseDelay=0,
+                samplingrate=fs,
+            )
+            x[:] = tmp_x[: len(x)]
+
+    return out
+
+
+def _row_key(
+    listitem: pd.Series,
+    last_row: bool,
+    fs: float,
+    attenuation: Dict[float, float] = None,
+    stimfolder: str = "./",
+    stim_key: str = "stimulus",
+    ignore_stop: bool = False,
+    dtype: np.dtype = np.float64,
+    cache: StimulusCache = None,
+) -> str:
+    """Key identifying the rendered row.
+
+    Stimulus files are identified by content hash if a cache is used and by path otherwise.
+    """
+    channels = []
+    for stimIdx, stimName in enumerate(listitem.stimFileName):
+        content = None
+        if stimName.endswith((".wav", ".h5")):
+            path = os.path.join(stimfolder, stimName)
+            content = cache.file_hash(path) if cache is not None else os.path.abspath(path)
+        channels.append(
+            (
+                stimName,
+                content,
+                repr(attenuation[listitem.freq[stimIdx]]) if attenuation else None,
+                float(listitem.intensity[stimIdx]),
+                float(listitem.silencePre[stimIdx]),
+                float(listitem.silencePost[stimIdx]),
+            )
+        )
+    stop_trigger = "SI_STOP" in listitem.stimFileName and not ignore_stop and last_row
+    return StimulusCache.key(tuple(channels), float(fs), stim_key, stop_trigger, np.dtype(dtype).str)
+
+
 def load_sounds(
     playlist: pd.DataFrame,
     fs: float,
@@ -212,88 +579,62 @@ def load_sounds(
     aslist: bool = False,
     stim_key: str = "stimulus",
     ignore_stop: bool = False,
+    cache_dir: str = None,
+    cache_size: float = None,
+    num_workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    dtype: np.dtype = np.float64,
 ):
-    sounddata = []
-    for row_number, (row_name, listitem) in enumerate(playlist.iterrows()):
-        xx = [None] * len(listitem.stimFileName)
-        for stimIdx, stimName in enumerate(listitem.stimFileName):
-            x = np.zeros((0, 1))
-            # These all acknowledge the pre/post stim silence: SIN, PUL, *.wav, *.h5
-            if stimName[:3] == "SIN":  # SIN_FREQ_PHASE_DURATION
-                # print('sine')
-                token = stimName[4:].split("_")
-                token = [float(item) for item in token]
-                freq, phase, duration = token[:3]
-                x = make_sine(freq, phase, duration, fs)
-            elif stimName[:3] == "PUL":  # PUL_DUR_PAU_NUM_DEL
-                # print('pulse')
-                token = stimName[4:].split("_")
-                token = [float(item) for item in token]
-                pulsedur, pulsepause, pulsenumber, pulsedelay = token[:4]
-                x = make_pulse(pulsedur, pulsepause, pulsenumber, pulsedelay, fs)
-            elif stimName.endswith(".wav"):  # WAV file
-                # return time x channels
-                wav_rate, x = wav.read(os.path.join(stimfolder, stimName))
-                x = x.astype(np.float32) / 32768
-                if wav_rate != fs:  # resample to fs
-                    x = scipy.signal.resample_poly(x, int(fs), int(wav_rate), axis=0)
-            elif stimName.endswith(".h5"):  # HDF5 file
-                with h5py.File(os.path.join(stimfolder, stimName), "r") as f:
-                    try:
-                        x = f[stim_key][:].astype(np.float32)
-                    except KeyError as e:
-                        print(e)
-
-            # if `attenuation` arg is provided:
-            if attenuation:
-                x = x * float(attenuation[listitem.freq[stimIdx]])
-            # set_volume
-            if len(x):
-                x = x * float(listitem.intensity[stimIdx])  # "* 20" NOT USED FOR DAQ
-
-                # pre/post pend silence
-                sample_start = np.intp(listitem.silencePre[stimIdx] / 1000 * fs)
-                sample_end = np.intp(listitem.silencePost[stimIdx] / 1000 * fs)
+    """Render each row of the playlist to a [time, channels] array.
 
-                x = np.insert(x, 0, np.zeros((sample_start,)))
-                x = np.insert(x, x.shape[0], np.zeros((sample_end,)))
-                x = x.reshape((x.shape[0], 1))
+    Identical rows are rendered once and share the same array.
+    Each stimulus file is loaded and resampled once, concurrently across files.
 
-            xx[stimIdx] = x
+    Args:
+        cache_dir (str, optional): Folder for caching rendered rows across runs.
+                                   Cached rows are returned as read-only memory maps.
+                                   Defaults to None (no caching).
+        cache_size (float, optional): Size cap of the cache in GB. Defaults to None (no cap).
+        num_workers (int, optional): Number of threads for loading stimulus files.
+                                     Defaults to None (chosen by `ThreadPoolExecutor`).
+        progress (Callable[[int, int], None], optional): Called with the number of loaded and total stimulus files.
+        dtype (np.dtype, optional): dtype of the rendered rows. Use np.float32 to halve stimulus memory.
+                                    Defaults to np.float64.
+    """
+    cache = None
+    if cache_dir is not None:
+        max_bytes = int(cache_size * 1e9) if cache_size is not None else None
+        cache = StimulusCache(cache_dir, max_bytes)
 
-        # make sure each channel in xx has the same length
-        max_len = max([len(ii) for ii in xx])
-        xx = [np.insert(ii, ii.shape[0], np.zeros((max_len - len(ii),))) for ii in xx]
-        xx = [x.reshape((x.shape[0], 1)) for x in xx]
-
-        for cnt, (x, stimName) in enumerate(zip(xx, listitem.stimFileName)):
-            # These DO NOT acknowledge silencePre/Post - will start at the first sample (during pre stim silence) and end at the last sample (end of post stim silence:
-            # SI_START, SI_STOP, SI_NEXT, CLOCK_durMS_pauMS
-            if stimName == "SI_START":
-                x[:20] = 1
-            elif stimName == "SI_NEXT":
-                x[-20:-2] = 1
-            elif stimName == "SI_STOP":
-                # if playlist is not shuffled, add STOP trigger to last stimulus in the playlist
-                last_stim = row_number == len(playlist) - 1
-                if not ignore_stop and last_stim:
-                    x[-20:-2] = 1
-            elif stimName[:5] == "CLOCK":
-                token = stimName[5:].split("_")
-                token = [float(item) for item in token]
-                pulsedur, pulsepause = token[:2]
-                pulseperiod = pulsedur + pulsepause
-                pulsenumber = (len(x) / fs * 1000) // pulseperiod + 1
-                tmp_x = make_pulse(
-                    pulsedur,
-                    pulsepause,
-                    pulseNumber=pulsenumber,
-                    pulseDelay=0,
-                    samplingrate=fs,
-                )
-                x = tmp_x[: len(x)]
-
-        x = np.concatenate(xx, axis=1)
+    rows = []
+    rendered = {}
+    for row_number, (row_name, listitem) in enumerate(playlist.iterrows()):
+        row_args = (listitem, row_number == len(playlist) - 1, fs, attenuation, stimfolder, stim_key, ignore_stop)
+        key = _row_key(*row_args, dtype=dtype, cache=cache)
+        rows.append((key, row_args))
+        if cache is not None and key not in rendered:
+            x = cache.get(key)
+            if x is not None:
+                rendered[key] = x
+
+    # load each stimulus file needed for the uncached rows only once
+    stimNames = {
+        stimName
+        for key, row_args in rows
+        if key not in rendered
+        for stimName in row_args[0].stimFileName
+        if stimName.endswith((".wav", ".h5"))
+    }
+    loaded = _load_files(sorted(stimNames), fs, stimfolder, stim_key, num_workers, progress)
+
+    sounddata = []
+    for key, row_args in rows:
+        if key not in rendered:
+            x = _render_row(*row_args, loaded=loaded, dtype=dtype)
+            if cache is not None:
+                x = cache.put(key, x)
+            rendered[key] = x
+        x = rendered[key]
         if aslist:
             x = x.tolist()
         sounddata.append(x)
@@ -0,0 +1,153 @@
+"""Content-addressed on-disk cache for rendered stimuli."""
+
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# content hashes of stimulus files, keyed by (path, mtime, size)
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+# used for sharing stimuli between processes if no cache folder is configured
+DEFAULT_STORE_FOLDER = os.path.join(tempfile.gettempdir(), "etho_stimcache")
+DEFAULT_STORE_SIZE = 4  # GB
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA1 of the file contents."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class StimulusCache:
+    """Folder of rendered stimuli stored as `.npy` files named by a content key.
+
+    Entries are memory-mapped on load. The least recently used entries are
+    deleted once the folder exceeds `max_bytes`.
+
+    Args:
+        folder (str): Cache folder - created if it does not exist.
+        max_bytes (int, optional): Size cap in bytes. Defaults to None (no cap).
+    """
+
+    def __init__(self, folder: str, max_bytes: Optional[int] = None):
+        self.folder = str(folder)
+        self.max_bytes = max_bytes
+        os.makedirs(self.folder, exist_ok=True)
+
+    def file_hash(self, path: str) -> str:
+        """Content hash of a stimulus file - only rehashed if the file changed."""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if memo_key not in _file_hashes:
+            _file_hashes[memo_key] = file_hash(path)
+        return _file_hashes[memo_key]
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash arbitrary (repr-able) parts into a cache key."""
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the memory-mapped entry or None."""
+        path = self.path(key)
+        try:
+            x = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return x
+
+    def put(self, key: str, x: np.ndarray, keep: Sequence[str] = ()) -> np.ndarray:
+        """Store the entry and return it memory-mapped from the cache.
+
+        Args:
+            key (str): Cache key.
+            x (np.ndarray): Entry.
+            keep (Sequence[str], optional): Paths of entries that must not be evicted to make room. Defaults to ().
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            # write to a temporary file first so concurrent readers never see partial entries
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(x), allow_pickle=False)
+            os.replace(tmp_path, path)
+            self.evict(keep=[path, *keep])
+        cached = self.get(key)
+        return x if cached is None else cached
+
+    def share(self, arrays: Sequence[np.ndarray]) -> List[str]:
+        """Store arrays under their content hash.
+
+        Arrays of one call are never evicted to make room for each other - the
+        cache exceeds its cap if they do not fit.
+
+        Returns:
+            List[str]: Paths of the stored arrays - memory-map them with `attach`.
+        """
+        paths = []
+        for x in arrays:
+            x = np.ascontiguousarray(x)
+            key = self.key(hashlib.sha1(x.data).hexdigest(), x.dtype.str, x.shape)
+            paths.append(self.path(key))
+            self.put(key, x, keep=paths)
+        self.evict(keep=paths)  # entries of earlier calls
+        return paths
+
+    def evict(self, keep: Sequence[str] = ()):
+        """Delete least recently used entries, except those in `keep`, until the cache fits `max_bytes`."""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".npy") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        keep = {os.path.normcase(os.path.abspath(path)) for path in keep}
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.normcase(os.path.abspath(path)) in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:  # still memory-mapped somewhere (windows)
+                continue
+            total -= size
+            logger.debug(f"Evicted {path} from stimulus cache.")
+
+
+def stimulus_store(folder: Optional[str] = None, size: Optional[float] = None) -> StimulusCache:
+    """Cache for sharing stimuli between processes on this host.
+
+    Args:
+        folder (str, optional): Defaults to None (a folder in the system's temp dir).
+        size (float, optional): Size cap in GB. Defaults to None (`DEFAULT_STORE_SIZE`).
+    """
+    folder = folder if folder is not None else DEFAULT_STORE_FOLDER
+    size = size if size is not None else DEFAULT_STORE_SIZE
+    return StimulusCache(folder, int(size * 1e9))
+
+
+def attach(arrays: Optional[Sequence[Union[str, np.ndarray]]]) -> Optional[List[np.ndarray]]:
+    """Memory-map arrays stored with `StimulusCache.share` - arrays are passed through."""
+    if arrays is None:
+        return None
+    return [np.load(x, mmap_mode="r") if isinstance(x, str) else x for x in arrays]
@@ -2,7 +2,7 @@ import rich
 from rich.panel import Panel
 from rich.console import Console
 from rich.table import Table
-from typing import Optional
+from typing import Any, Dict, Optional
 import pandas as pd
 import time
 
@@ -73,6 +73,27 @@ def rich_information(info, prefix=""):
             rich.print(Panel(df_to_table(val), title=f"{prefix}: {key}"))
 
 
+def callback_health(status: Dict[str, Dict[str, Any]]) -> str:
+    """One-line summary of the callback status in the progress of a service - see `ConcurrentTask.status`."""
+    parts = []
+    for name, callback in status.items():
+        if callback.get("last_error"):
+            state = "[red]error[/]"
+        elif not callback.get("alive"):
+            state = "[red]stopped[/]"
+        else:
+            state = "[green]ok[/]"
+        part = f"{name} {state}"
+        if callback.get("queued"):
+            part += f" {callback['queued']} queued"
+        if callback.get("dropped"):
+            part += f" {callback['dropped']} dropped"
+        if callback.get("loop_seconds") is not None:
+            part += f" {1000 * callback['loop_seconds']:1.1f} ms"
+        parts.append(part)
+    return ", ".join(parts)
+
+
 class CameraProgress:
     def __init__(self, nbFrames: int):
         self.prev_t: Optional[float] = None
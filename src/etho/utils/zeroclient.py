@@ -35,6 +35,7 @@ class ZeroClient(zerorpc.Client):
 
         self.sr = Runner(host, python_exe=python_exe)
         self.pid = None  # pid of local server process
+        self.server_name = None  # command line of local server process
 
     def _init_network_logger(self, log_level: int = logging.INFO):
         # TODO: set log levels of logger and handler
@@ -69,6 +70,7 @@ class ZeroClient(zerorpc.Client):
     def start_server(self, server_name, warmup=2, timeout=5, new_console: bool = False):
         self.log.info(f"   {self.SERVICE_NAME} starting")
         self.sr.run(server_name, timeout=timeout, new_console=new_console, disown=True)
+        self.server_name = server_name
         self.pid = self.sr.pid(query=server_name)
         self.log.info(f"   {self.SERVICE_NAME} warmup")
         time.sleep(warmup)  # wait for server to warm up
@@ -76,6 +78,37 @@ class ZeroClient(zerorpc.Client):
         self.log.info(f"   {self.SERVICE_NAME} done")
         return status
 
+    def wait_ready(self, timeout: float = 30, interval: float = 0.5) -> bool:
+        """Wait until the connected server answers a ping.
+
+        The ping is queued until the server is up, so this returns as soon as the server runs.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to 30.
+            interval (float, optional): Seconds between checks whether the server process still runs. Defaults to 0.5.
+
+        Returns:
+            bool: False if the server did not answer within `timeout` or its process ended.
+        """
+        pong = self.ping(timeout=timeout, **{"async": True})
+        started = time.monotonic()
+        deadline = started + timeout
+        seen = False  # processes in new consoles can take a moment to show up
+        while time.monotonic() < deadline:
+            pong.wait(interval)
+            if pong.ready():
+                try:
+                    return pong.get() == "pong"
+                except zerorpc.TimeoutExpired:
+                    break
+            if self.server_name is not None:
+                if self.sr.pid(query=self.server_name):
+                    seen = True
+                elif seen or time.monotonic() - started > 5:
+                    break  # server process ended
+        self.log.warning(f"   {self.SERVICE_NAME} not ready")
+        return False
+
     def stop_server(self):
         self.log.info(f"   {self.SERVICE_NAME} finish and cleanup")
         self.finish()
@@ -0,0 +1,50 @@
+import logging
+import time
+
+import numpy as np
+
+from etho.services.DAQZeroService import DAQ
+from etho.services.daq.autotune import autotune_chunk_size
+from etho.services.daq.virtual import VirtualIOTask
+
+
+class SlowSink:
+    discarded = 0
+
+    def send(self, data):
+        time.sleep(0.002)
+
+    def discard(self):
+        SlowSink.discarded += 1
+
+
+def test_autotune_picks_smallest_chunk_with_margin():
+    def make_task(nb_samples):
+        return VirtualIOTask(dev_name="virtual_autotune", cha_name=["ai0"], rate=10_000, nb_inputsamples_per_cycle=nb_samples)
+
+    nb_samples, costs = autotune_chunk_size(make_task, 10_000, make_callbacks=lambda _: [SlowSink()], chunk_sizes=[50, 100, 200, 400], margin=4, nb_calls=5)
+
+    assert nb_samples == 100
+    assert list(costs) == [50, 100]
+    assert all(cost >= 0.002 for cost in costs.values())
+    assert SlowSink.discarded == 2
+
+
+def test_daq_setup_records_autotuned_chunk_size():
+    service = type("Service", (), {})()
+    service.log = logging.getLogger(__name__)
+    DAQ.setup(
+        service,
+        fs=10_000,
+        dev_name="virtual_autotune",
+        nb_inputsamples_per_cycle="auto",
+        analog_chans_in=["ai0", "ai1"],
+        params={"callbacks": {"plot_fast": {"channels_to_plot": [0]}}},
+    )
+
+    assert service.metadata["nb_inputsamples_per_cycle"] == service.taskAI.num_samples_per_event == 50
+    assert service.metadata["autotune_chunk_sizes"] == [50]
+    assert service.callbacks[0]._process._kwargs["attrs"]["nb_inputsamples_per_cycle"] == 50
+    for callback in service.callbacks:
+        callback.discard()
+    service.taskAI.ClearTask()
@@ -0,0 +1,17 @@
+import json
+
+from etho import bench
+
+
+def test_bench_reports_throughput(tmp_path):
+    output = tmp_path / "bench.json"
+    results = bench.run(width=64, height=48, fps=50, duration=1, callbacks=["save_timestamps"], save_folder=str(tmp_path), output=str(output), show=False)
+
+    with open(output) as f:
+        assert json.load(f) == json.loads(json.dumps(results))
+    assert results["frames"] >= 45
+    assert 45 < results["fps"] < 55
+    assert results["dropped_frames"] == 0
+    assert results["bytes_written"] > 0
+    assert results["latency"]["send save_timestamps"]["count"] > 0
+    assert set(results["processes"]) == {"camera", "save_timestamps"}
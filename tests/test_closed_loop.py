@@ -0,0 +1,114 @@
+import logging
+
+import numpy as np
+import pytest
+
+from etho.services.DAQZeroService import DAQ
+from etho.services.callbacks import callbacks
+from etho.services.daq.generators import data_playlist
+from etho.services.daq.virtual import VirtualIOTask, get_device
+
+
+class Recorder:
+    def __init__(self):
+        self.chunks = []
+
+    def start(self):
+        pass
+
+    def send(self, data):
+        if data is not None:
+            self.chunks.append(data[0].copy())
+
+    def finish(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_closed_loop_injects_stimulus_after_detected_event():
+    rate = 10_000
+    device = get_device("virtual_closed_loop")
+    device.realtime = False
+    events = [2_000, 2_010, 6_000]  # second event arrives while the first stimulus is pending
+    device.inputs["ai0"] = lambda samples: np.isin(samples, events).astype(float)
+
+    service = type("Service", (), {})()
+    service.log = logging.getLogger(__name__)
+    DAQ.setup(
+        service,
+        play_order=[0],
+        fs=rate,
+        dev_name="virtual_closed_loop",
+        nb_inputsamples_per_cycle=50,
+        analog_chans_in=["ai0", "ai1"],
+        analog_chans_out=["ao1"],
+        analog_data_out=[np.ones((100, 1))],
+        params={"closed_loop": {"channels": [0], "threshold": 0.5, "buffer_seconds": 0.02, "refresh_seconds": 0.005}},
+    )
+    recorder = Recorder()
+    service.taskAI.data_rec.append(recorder)
+    DAQ.start(service)
+    for _ in range(200):
+        device.advance(50)
+
+    latencies = service.closed_loop.latencies
+    assert len(latencies) == 2 and service.closed_loop.nb_dropped == 1
+    assert all(200 <= latency <= 300 for latency in latencies)  # buffer plus at most one input and one output chunk
+    assert max(service.closed_loop.summary()["max latency [ms]"], 0) < 50
+
+    recorded = np.concatenate(recorder.chunks)  # ao1 is looped back to ai1
+    onsets = np.flatnonzero(np.diff(recorded[:, 1]) > 0) + 1
+    np.testing.assert_array_equal(onsets, [events[0] + latencies[0], events[2] + latencies[1]])
+    assert service.taskAO.underflows == 0
+
+    service.taskAI.StopTask()
+    for task in (service.taskAI, service.taskAO):
+        task.ClearTask()
+
+
+def test_virtual_output_buffer_blocks_writes_when_full():
+    rate = 10_000
+    device = get_device("virtual_ao_buffer")
+    device.realtime = False
+    taskAO = VirtualIOTask(dev_name="virtual_ao_buffer", cha_name=["ao0"], rate=rate, buffer_seconds=2, refresh_seconds=0.1)
+    taskAI = VirtualIOTask(dev_name="virtual_ao_buffer", cha_name=["ai0"], rate=rate, nb_inputsamples_per_cycle=1_000)
+    taskAO.set_data_generator(data_playlist([np.ones((rate, 1))], play_order=[0] * 100))
+    taskAO.StartTask()
+    taskAI.StartTask()
+
+    buffered = []
+    for _ in range(300):  # 30 s of a 100 s playlist of 1 s stimuli
+        device.advance(1_000)
+        buffered.append(taskAO._buffered)
+
+    assert max(buffered) <= taskAO.num_samples_per_chan
+    assert taskAO.underflows == 0
+
+    taskAI.StopTask()
+    for task in (taskAI, taskAO):
+        task.ClearTask()
+
+
+def test_closed_loop_rejects_digital_outputs_before_setting_up(monkeypatch, tmp_path):
+    device = get_device("virtual_closed_loop_digital")
+    monkeypatch.setattr(callbacks["save_onsets_h5"], "make_concurrent", lambda *args, **kwargs: pytest.fail("started the onset log"))
+
+    service = type("Service", (), {})()
+    service.log = logging.getLogger(__name__)
+    with pytest.raises(ValueError, match="digital outputs"):
+        DAQ.setup(
+            service,
+            savefilename=str(tmp_path / "run"),
+            play_order=[0],
+            dev_name="virtual_closed_loop_digital",
+            nb_inputsamples_per_cycle="auto",
+            analog_chans_in=["ai0"],
+            analog_chans_out=["ao0"],
+            digital_chans_out=["po0"],
+            analog_data_out=[np.ones((100, 1))],
+            digital_data_out=[np.ones((100, 1))],
+            params={"closed_loop": {"channels": [0]}},
+        )
+    assert device.tasks == []
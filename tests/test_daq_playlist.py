@@ -1,6 +1,7 @@
 import pickle
 
 import numpy as np
+import pandas as pd
 
 from etho.services.DAQZeroService import DAQ
 
@@ -78,3 +79,61 @@ def test_setup_prefills_output_with_first_playlist_item(monkeypatch):
 
     assert service.taskAO.data_gen is not None
     np.testing.assert_array_equal(service.taskAO.prefilled, sounds[1])
+
+
+def test_setup_client_shares_rendered_stimuli_between_daqs(monkeypatch, tmp_path):
+    import etho
+    from etho.utils.stimcache import attach
+
+    class RecordingService(FakeService):
+        def setup(self, *args, **kwargs):
+            self.analog_data_out = kwargs["analog_data_out"]
+            self.digital_data_out = kwargs["digital_data_out"]
+
+    services = []
+    loads = []
+
+    def make(*args, **kwargs):
+        services.append(RecordingService())
+        return services[-1]
+
+    def fake_load_sounds(*args, **kwargs):
+        loads.append(args)
+        return [np.ones((3, 2), dtype=np.float32), np.zeros((2, 2), dtype=np.float32)]
+
+    playlistfile = tmp_path / "playlist.txt"
+    playlistfile.write_text("")
+    stimfile = tmp_path / "stim.wav"
+    stimfile.write_bytes(b"1")
+    monkeypatch.setattr(DAQ, "make", make)
+    monkeypatch.setattr("etho.services.DAQZeroService.parse_table", lambda _: pd.DataFrame({"stimFileName": [["stim.wav"], ["SIN_100_0_1"]]}))
+    monkeypatch.setattr("etho.services.DAQZeroService.load_sounds", fake_load_sounds)
+    monkeypatch.setitem(etho.config, "ATTENUATION", {})
+    monkeypatch.setitem(etho.config, "stimcachefolder", str(tmp_path / "store"))
+    monkeypatch.setitem(etho.config, "stimfolder", str(tmp_path))
+
+    daq = {
+        "samplingrate": 1,
+        "shuffle": False,
+        "analog_chans_in": [],
+        "analog_chans_out": ["ao0"],
+        "digital_chans_out": ["port0/line0"],
+    }
+    prot = {"DAQ": dict(daq), "DAQ2": dict(daq), "maxduration": 1}
+    defaults = {"host": "localhost", "serializer": "default", "python_exe": "python", "savefolder": str(tmp_path)}
+    for index, key in enumerate(["DAQ", "DAQ2"]):
+        prot[key] = etho.utils.config.defaultify(prot[key])
+        DAQ.setup_client(key, index, prot, defaults, str(playlistfile), "run", False, False)
+
+    assert len(loads) == 1
+    assert services[0].analog_data_out == services[1].analog_data_out
+    assert all(isinstance(path, str) for path in services[0].analog_data_out)
+    analog = attach(services[0].analog_data_out)
+    digital = attach(services[0].digital_data_out)
+    assert isinstance(analog[0], np.memmap)
+    np.testing.assert_array_equal(analog[0], np.ones((3, 1), dtype=np.float32))
+    assert digital[1].dtype == np.uint8 and digital[1].shape == (2, 1)
+
+    stimfile.write_bytes(b"12")  # edited stimulus file of the same playlist
+    DAQ.setup_client("DAQ", 0, prot, defaults, str(playlistfile), "run", False, False)
+    assert len(loads) == 2
@@ -0,0 +1,50 @@
+import numpy as np
+import scipy.signal
+import tables
+
+from etho.services.callbacks._trace import DetectEvents, EventDetector
+
+
+def _pulse_train(rate=10_000, nb_samples=20_000):
+    x = np.zeros((nb_samples, 2))
+    x[[1000, 5003, 12000], 0] = 1
+    x[[7000, 15999], 1] = 1
+    pulse = np.sin(2 * np.pi * 500 * np.arange(40) / rate) * np.hanning(40)
+    return scipy.signal.lfilter(pulse, 1, x, axis=0)
+
+
+def test_event_detector_matches_offline_detection_for_any_chunking():
+    rate = 10_000
+    x = _pulse_train(rate) + 0.01 * np.random.default_rng(0).standard_normal((20_000, 2))
+    offline = EventDetector(2, rate, threshold=0.3, mode="pulse", band=[200, 1000], min_interval=0.01)
+    expected = offline(x)
+
+    for chunk_size in [1, 333, 4096]:
+        online = EventDetector(2, rate, threshold=0.3, mode="pulse", band=[200, 1000], min_interval=0.01)
+        events = [online(x[start : start + chunk_size]) for start in range(0, len(x), chunk_size)]
+        for detected, reference in zip(map(np.concatenate, zip(*events)), expected):
+            np.testing.assert_allclose(np.sort(detected), np.sort(reference))
+
+    samples, channels, _ = expected
+    assert sorted(zip(channels.tolist(), (samples // 100).tolist())) == [(0, 10), (0, 50), (0, 120), (1, 70), (1, 160)]
+
+
+def test_event_detector_threshold_crossings():
+    detector = EventDetector(1, rate=1, threshold=0.5)
+    assert detector(np.array([[0.0], [1.0], [1.0]]))[0].tolist() == [1]
+    assert detector(np.array([[1.0], [0.0], [2.0]]))[0].tolist() == [5]
+
+
+def test_detect_events_writes_event_table(tmp_path):
+    x = _pulse_train()
+    cb = DetectEvents(None, file_name=str(tmp_path / "run"), threshold=0.3, mode="pulse", channels=[1], min_interval=0.01, attrs={"rate": 10_000})
+    for start in range(0, len(x), 1000):
+        cb._loop((x[start : start + 1000], float(start)))
+    cb._cleanup()
+
+    with tables.open_file(str(tmp_path / "run_events.h5"), mode="r") as f:
+        events = f.root.events
+        assert events.attrs["mode"] == "pulse"
+        assert events.col("channel").tolist() == [1, 1]
+        assert (events.col("sample") // 100).tolist() == [70, 160]
+        assert events.col("systemtime").tolist() == [7000.0, 16000.0]
@@ -186,14 +186,16 @@ def test_client_wires_gov_service(monkeypatch):
             self.started = True
 
     instances = []
+    launched = []
 
-    def fake_make(cls, serializer, host, python_exe, port=None, new_console=False):
+    def fake_make(cls, serializer, host, python_exe, port=None, new_console=False, local=False):
         instance = FakeService()
-        instance.make_args = (serializer, host, python_exe, port, new_console)
+        instance.make_args = (serializer, host, python_exe, port, new_console, local)
         instances.append(instance)
         return instance
 
     monkeypatch.setattr(GOV, "make", classmethod(fake_make))
+    monkeypatch.setattr(GOV, "launch", classmethod(lambda cls, *args, port=None, **kwargs: launched.append(port)))
     monkeypatch.setattr(client, "rich_information", lambda *args, **kwargs: None)
 
     protocol = {
@@ -210,6 +212,8 @@ def test_client_wires_gov_service(monkeypatch):
     assert services["GOV"] is service
     assert service.make_args[3] == GOV.SERVICE_PORT
     assert service.make_args[4] is False
+    assert service.make_args[5] is False
+    assert launched == [GOV.SERVICE_PORT]  # server process launched before the setup
     assert service.setup_args == ("AA:BB:CC:DD:EE:FF", 60, 15)
     assert service.started is True
     assert service.log_path.endswith("testgov/testgov_gov.log")
@@ -0,0 +1,18 @@
+import tables
+
+from etho.services.callbacks._trace import SaveOnsetsHDF
+
+
+def test_onset_log_writes_structured_table(tmp_path):
+    onsets = SaveOnsetsHDF(None, file_name=str(tmp_path / "run"), attrs={"rate": 10}, flush_every=2)
+    for item, (playlist_row, sample_offset) in enumerate([(1, 0), (0, 20), (1, 30)]):
+        onsets._loop(((item, playlist_row, sample_offset), 100.0 + item))
+    onsets._cleanup()
+
+    with tables.open_file(str(tmp_path / "run_onsets.h5"), mode="r") as f:
+        table = f.root.onsets
+        assert table.attrs["rate"] == 10
+        assert table.col("item").tolist() == [0, 1, 2]
+        assert table.col("playlist_row").tolist() == [1, 0, 1]
+        assert table.col("sample_offset").tolist() == [0, 20, 30]
+        assert table.col("systemtime").tolist() == [100.0, 101.0, 102.0]
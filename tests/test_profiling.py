@@ -0,0 +1,56 @@
+import pstats
+import time
+
+from etho.services.callbacks import callbacks
+from etho.services.utils.concurrent_task import ConcurrentTask
+from etho.utils import profiling
+
+
+def busy_wait(seconds):
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        pass
+
+
+def test_stack_sampler_saves_pstats_and_collapsed_stacks(tmp_path):
+    sampler = profiling.StackSampler("test", str(tmp_path), interval=0.001)
+    sampler.start()
+    busy_wait(0.3)
+    sampler.stop()
+
+    stats = pstats.Stats(sampler.filename + ".pstats")
+    busy = [function for function in stats.stats if function[2] == "busy_wait"]
+    assert len(busy) == 1
+    assert stats.stats[busy[0]][3] > 0.1  # cumulative sampled time
+
+    with open(sampler.filename + ".collapsed") as f:
+        lines = f.read().splitlines()
+    assert any(line.startswith("MainThread;") and "busy_wait (" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_profiled_callback_processes_are_merged(tmp_path, monkeypatch):
+    profile_folder = tmp_path / "profile"
+    monkeypatch.setenv(profiling.ENV_VAR, str(profile_folder))
+
+    task = ConcurrentTask(task=callbacks["save_timestamps"].make_run, task_kwargs={"file_name": str(tmp_path / "run")})
+    task.start()
+    for cnt in range(20):
+        task.send((0, (1000.0 + cnt / 100, cnt / 100)))
+    time.sleep(0.2)  # sampled while waiting for data
+    task.close()
+
+    assert len(list(profile_folder.glob("TimestampWriterHDF-*.pstats"))) == 1
+    merged = tmp_path / "run_profile.collapsed"
+    assert profiling.merge(str(profile_folder), str(merged)) == 1
+    lines = merged.read_text().splitlines()
+    assert lines and all(line.startswith("TimestampWriterHDF-") for line in lines)
+
+
+def test_finish_disables_profiling(tmp_path, monkeypatch):
+    monkeypatch.delenv(profiling.ENV_VAR, raising=False)  # restored after the test
+    profiling.enable(str(tmp_path / "profile"))
+    assert profiling.folder() == str(tmp_path / "profile")
+
+    profiling.finish(str(tmp_path / "run_profile.collapsed"))
+    assert profiling.folder() is None
@@ -0,0 +1,58 @@
+import time
+
+from etho.resumable import ResumableExperimentRunner
+from etho.services.resumable import ResumableZeroService
+from etho.services.utils.progress import ProgressPublisher, ProgressSubscriber
+
+
+def test_subscriber_receives_latest_progress():
+    calls = []
+
+    def progress():
+        calls.append(time.monotonic())
+        return {"elapsed": len(calls)}
+
+    publisher = ProgressPublisher("GCM", progress, interval=0.02)
+    subscriber = ProgressSubscriber({"GCM": f"tcp://127.0.0.1:{publisher.port}"})
+    publisher.start()
+    try:
+        deadline = time.monotonic() + 5
+        while subscriber.receive(timeout=0.1).get("GCM", {}).get("elapsed", 0) < 5 and time.monotonic() < deadline:
+            pass
+        assert subscriber.latest["GCM"]["elapsed"] >= 5
+        assert subscriber.silent("GCM") < 1
+    finally:
+        publisher.stop()
+        subscriber.close()
+
+
+def test_publisher_skips_failing_progress():
+    publisher = ProgressPublisher("DAQ", lambda: 1 / 0, interval=0.01)
+    publisher.publish()  # logged, not raised
+    publisher.stop()
+
+
+class TimedService(ResumableZeroService):
+    def __init__(self, duration):
+        super().__init__()
+        self.params = {"progress_interval": 0.05}
+        self.duration = duration
+        self._time_started = time.time()
+        self.calls = 0
+
+    def progress(self):
+        self.calls += 1
+        return {"total": self.duration, "elapsed": time.time() - self._time_started, "elapsed_delta": 0.05}
+
+
+def test_monitor_progress_subscribes_to_services():
+    runner = ResumableExperimentRunner(protocol={})
+    service = TimedService(duration=0.5)
+    runner.services = {"DAQ": service}
+
+    start = time.monotonic()
+    runner.monitor_progress(show_progress=False)
+
+    assert time.monotonic() - start < 5
+    assert service.calls > 5  # published every 50 ms
+    assert service._progress_publisher is None
@@ -1,10 +1,14 @@
 import importlib
+import json
+import time
+from types import SimpleNamespace
 
 import numpy as np
 import pandas as pd
 
 from etho.resumable import ResumableExperimentRunner, playlist_arrays
 from etho.services.resumable import ResumableDAQ, ResumableGCM
+from etho.utils.sound import PlaylistArray
 
 
 class FakeCallback:
@@ -50,7 +54,8 @@ class FakeTask:
         self.cleared += 1
 
 
-def test_resumable_daq_reuses_tasks_and_restarts_callbacks(monkeypatch):
+def test_resumable_daq_reuses_tasks_and_restarts_callbacks(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # runs write telemetry files
     daq_module = importlib.import_module("etho.services.DAQZeroService")
     monkeypatch.setattr(daq_module, "daqmx_import_error", None, raising=False)
     monkeypatch.setattr(daq_module, "IOTask", FakeTask, raising=False)
@@ -92,6 +97,63 @@ def test_resumable_daq_reuses_tasks_and_restarts_callbacks(monkeypatch):
     assert service.state == "closed"
 
 
+def test_resumable_daq_streams_virtual_playlist(monkeypatch):
+    daq_module = importlib.import_module("etho.services.DAQZeroService")
+    monkeypatch.setattr(daq_module, "daqmx_import_error", None, raising=False)
+    monkeypatch.setattr(daq_module, "IOTask", FakeTask, raising=False)
+    monkeypatch.setattr("etho.services.resumable.callbacks", {})
+
+    params = {
+        "samplingrate": 4,
+        "device": "Dev1",
+        "clock_source": None,
+        "nb_inputsamples_per_cycle": 2,
+        "analog_chans_in": ["ai0"],
+        "analog_chans_out": ["ao0"],
+        "digital_chans_out": ["po0"],
+        "callbacks": {},
+    }
+    sounds = [np.ones((3, 2)), np.full((2, 2), 2.0)]
+    analog = PlaylistArray(sounds, [0, 1, 0], columns=slice(None, -1), dtype=np.float64)
+
+    service = ResumableDAQ(params).setup_hardware()
+    service.prepare_run("run1", analog_data_out=analog, duration=2)
+
+    blocks = list(service.taskAO.data_gen)
+    assert [len(block) for block in blocks] == [5, 3]
+    np.testing.assert_array_equal(np.concatenate(blocks), np.asarray(analog))
+    digital = list(service.taskDO.data_gen)
+    assert sum(len(block) for block in digital) == 8
+    assert all(block.dtype == np.uint8 and not block.any() for block in digital)
+    service.close()
+
+
+def test_resumable_daq_without_duration_outputs_silence_until_stopped(monkeypatch):
+    daq_module = importlib.import_module("etho.services.DAQZeroService")
+    monkeypatch.setattr(daq_module, "daqmx_import_error", None, raising=False)
+    monkeypatch.setattr(daq_module, "IOTask", FakeTask, raising=False)
+    monkeypatch.setattr("etho.services.resumable.callbacks", {})
+
+    params = {
+        "samplingrate": 4,
+        "device": "Dev1",
+        "clock_source": None,
+        "nb_inputsamples_per_cycle": 2,
+        "analog_chans_in": ["ai0"],
+        "analog_chans_out": ["ao0"],
+        "digital_chans_out": ["po0"],
+        "callbacks": {},
+    }
+
+    service = ResumableDAQ(params).setup_hardware()
+    service.prepare_run("run1", duration=-1)
+
+    for task, dtype in ((service.taskAO, np.float64), (service.taskDO, np.uint8)):
+        blocks = [next(task.data_gen) for _ in range(100)]  # does not run out
+        assert all(block.shape == (4, 1) and block.dtype == dtype and not block.any() for block in blocks)
+    service.close()
+
+
 class FakeCamera:
     made = 0
 
@@ -157,7 +219,8 @@ class FakeCamera:
             self.__dict__[name] = value
 
 
-def test_resumable_gcm_reuses_camera_and_restarts_callbacks(monkeypatch):
+def test_resumable_gcm_reuses_camera_and_restarts_callbacks(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # runs write telemetry files
     monkeypatch.setitem(importlib.import_module("etho.services.camera").make, "Fake", FakeCamera)
     monkeypatch.setattr("etho.services.resumable.callbacks", {"save_avi": FakeCallback})
 
@@ -457,6 +520,32 @@ def test_playlist_arrays_reuses_loaded_stimuli_but_rebuilds_playlist(monkeypatch
     assert calls == {"load": 1, "build": 2}
 
 
+def test_playlist_arrays_keeps_stimulus_dtype(monkeypatch):
+    def fake_load_sounds(*args, dtype=np.float64, **kwargs):
+        return [np.ones((2, 2), dtype=dtype)]
+
+    monkeypatch.setattr("etho.resumable.parse_table", lambda playlistfile: pd.DataFrame({"stimFileName": ["a"]}))
+    monkeypatch.setattr("etho.resumable.load_sounds", fake_load_sounds)
+    monkeypatch.setattr("etho.resumable.build_playlist", lambda *args, **kwargs: ([0, 0], 4))
+    monkeypatch.setitem(importlib.import_module("etho").config, "ATTENUATION", None)
+
+    protocol = {
+        "maxduration": 1,
+        "use_services": ["DAQ"],
+        "DAQ": {
+            "samplingrate": 1,
+            "shuffle": False,
+            "digital_chans_out": ["po0"],
+            "stimulus_dtype": "float32",
+        },
+    }
+    analog, digital, duration = playlist_arrays(protocol, "playlist.txt")
+
+    assert analog.dtype == np.float32
+    assert analog.shape == (4, 1)
+    assert digital.dtype == np.uint8
+
+
 def test_resumable_gui_reuses_existing_gui():
     import etho.app
     import etho.res_app
@@ -476,7 +565,7 @@ def test_cli_exposes_resumable_commands(monkeypatch):
     import etho.cli as cli
 
     subcommands = {}
-    monkeypatch.setattr(cli.defopt, "run", lambda commands, show_defaults=False: subcommands.update(commands))
+    monkeypatch.setattr(cli.defopt, "run", lambda commands, **kwargs: subcommands.update(commands))
 
     cli.main()
 
@@ -506,4 +595,62 @@ def test_res_run_calls_resumable_runner(monkeypatch):
         "show_progress": False,
         "debug": True,
         "preview": True,
+        "profile": False,
     }
+
+
+def run_synthetic_camera(tmp_path, name, params, duration=1, progress_after=0.5):
+    """Record `duration` seconds from a synthetic camera with `params`.
+
+    Returns the closed service, the save file name, and the progress and callbacks of the service `progress_after` seconds into the run.
+    """
+    params = {"cam_type": "Synthetic", "cam_serialnumber": name, "frame_width": 64, "frame_height": 48, "shutter_speed": 1000, "frame_rate": 100, **params}
+    savefilename = str(tmp_path / name)
+    service = ResumableGCM(params).setup_hardware()
+    try:
+        service.prepare_run(savefilename, duration)
+        service.start()
+        time.sleep(progress_after)
+        progress, callbacks = service.progress(), list(service.callbacks)
+        while service.state != "stopped":
+            time.sleep(0.05)
+    finally:
+        service.close()
+    return SimpleNamespace(service=service, savefilename=savefilename, progress=progress, callbacks=callbacks)
+
+
+def test_resumable_gcm_traces_frame_latencies(tmp_path):
+    run = run_synthetic_camera(tmp_path, "trace", {"trace_every": 10, "callbacks": {"save_timestamps": None}})
+
+    assert set(run.progress["latency"]) == {"save_timestamps"}
+    with open(run.savefilename + "_latency.json") as f:
+        latency = json.load(f)["save_timestamps"]
+    nb_traced = latency["acquired to done"]["count"]
+    assert 5 <= nb_traced <= run.service.frameNumber // 10 + 1
+    for stage in ("acquired to send", "send", "send to receive", "receive to done"):
+        assert latency[stage]["count"] == nb_traced
+        assert 0 <= latency[stage]["min"] <= latency[stage]["max"] < 1
+
+
+def test_resumable_gcm_reports_callback_status(tmp_path):
+    run = run_synthetic_camera(tmp_path, "status", {"callbacks": {"saveimg_h5": {"rate": 0.05}}})
+
+    status = run.progress["callbacks"]["saveimg_h5"]
+    assert status["alive"] and status["processed"] > 0
+    status = run.callbacks[0].status()  # final counts
+    assert not status["alive"]
+    assert status["processed"] >= 5 and status["dropped"] > 0  # rate limited
+    assert status["received"] == status["processed"] + status["dropped"]
+    assert status["bytes"] == status["processed"] * 64 * 48 * 3
+    assert status["loop_seconds"] > 0 and status["errors"] == 0 and status["last_error"] is None
+
+
+def test_resumable_gcm_saves_telemetry(tmp_path):
+    run = run_synthetic_camera(tmp_path, "telemetry", {"telemetry_interval": 0.1, "callbacks": {"save_timestamps": None}})
+
+    telemetry = np.load(run.savefilename + "_gcm_telemetry.npz")
+    assert len(telemetry["time"]) >= 5
+    assert np.all(np.diff(telemetry["time"]) > 0)
+    assert telemetry["frames"][-1] == run.service.frameNumber
+    assert telemetry["save_timestamps.processed"][-1] == run.service.frameNumber
+    assert "service.cpu" in telemetry and "save_timestamps.rss" in telemetry
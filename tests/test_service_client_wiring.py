@@ -1,7 +1,10 @@
+import time
+
 import pytest
 
 import etho.client as client
 from etho import services as service_module
+from etho.services.utils import readiness
 
 
 def test_service_registry_resolves_suffixed_names():
@@ -90,3 +93,104 @@ def test_client_uses_service_owned_setup_and_start_groups(monkeypatch):
 
     assert list(result) == ["DAQ", "PRE", "TRG"]
     assert started == ["PRE", "TRG", "DAQ"]
+
+
+def test_client_launches_servers_first_and_waits_for_armed_groups(monkeypatch):
+    events = []
+
+    class FakeService:
+        def __init__(self, name, arm_after):
+            self.name = name
+            self.arm_after = arm_after  # checks of `armed` until the hardware is armed
+
+        def start(self):
+            events.append(("start", self.name))
+
+        def armed(self):
+            self.arm_after -= 1
+            if self.arm_after <= 0:
+                events.append(("armed", self.name))
+            return self.arm_after <= 0
+
+    def fake_class(name, group, arm_after):
+        class Fake:
+            SERVICE_NAME = name
+            CLIENT_START_GROUP = group
+
+            @classmethod
+            def launch_client(cls, service_key, service_index, prot, defaults, new_console):
+                events.append(("launch", service_key))
+
+            @classmethod
+            def setup_client(cls, service_key, service_index, prot, defaults, playlistfile, save_prefix, preview, new_console):
+                events.append(("setup", service_key))
+                return FakeService(service_key, arm_after)
+
+        return Fake
+
+    service_classes = {"CAM": fake_class("CAM", "pre", 3), "TRG": fake_class("TRG", "trigger", 2), "DAQ": fake_class("DAQ", "daq", 1)}
+    monkeypatch.setattr(client.service_module, "service_class_for", lambda service_name: service_classes[service_name])
+    monkeypatch.setattr(client.time, "sleep", lambda *args, **kwargs: None)
+
+    prot = {"use_services": ["DAQ", "CAM", "TRG"]}
+    services, classes = client._setup_services(prot, {}, None, "test", False, False)
+    client._start_services(services, classes)
+
+    assert events[:3] == [("launch", "DAQ"), ("launch", "CAM"), ("launch", "TRG")]
+    assert events[3:6] == [("setup", "DAQ"), ("setup", "CAM"), ("setup", "TRG")]
+    assert events[6:] == [("start", "CAM"), ("armed", "CAM"), ("start", "TRG"), ("armed", "TRG"), ("start", "DAQ")]
+
+
+def test_wait_armed_gives_up_on_services_that_do_not_arm():
+    class Service:
+        def armed(self):
+            return False
+
+    assert readiness.wait_armed({"CAM": Service(), "TRG": object()}, timeout=0.05) == ["CAM"]
+
+
+def test_trigger_service_is_armed_once_started():
+    from etho.services.ScanImageTriggerZeroService import SIT
+
+    service = SIT.__new__(SIT)  # skip the zerorpc server and the DAQmx task
+    service.local = True  # nothing to clean up on deletion
+    service._time_started = None
+    assert not service.armed()
+
+    service.start()
+    assert service.armed()
+
+
+def test_local_client_runs_services_in_process(monkeypatch, tmp_path):
+    from etho.services.GCMZeroService import GCM
+
+    monkeypatch.setitem(client.config, "savefolder", str(tmp_path))
+    monkeypatch.setattr(GCM, "launch", classmethod(lambda cls, *args, **kwargs: pytest.fail("launched a server process")))
+    protocol = {
+        "maxduration": 1,
+        "use_services": ["GCM"],
+        "GCM": {
+            "cam_type": "Synthetic",
+            "cam_serialnumber": "local",
+            "frame_width": 64,
+            "frame_height": 48,
+            "frame_offx": 0,
+            "frame_offy": 0,
+            "frame_rate": 50,
+            "shutter_speed": 1000,
+            "callbacks": {"save_timestamps": None},
+            "telemetry_interval": 0,
+        },
+    }
+
+    services = client.client(None, protocol=protocol, save_prefix="local", show_progress=False, local=True)
+
+    service = services["GCM"]
+    assert isinstance(service, GCM) and service.local
+    assert service.armed()
+    time.sleep(0.5)
+    service.finish(stop_service=True)  # stops the service, but must not kill the head
+
+    assert service.finished
+    assert service.frameNumber > 0
+    assert (tmp_path / "local" / "local_timestamps.h5").is_file()
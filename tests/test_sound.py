@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
-from etho.utils.sound import parse_table, load_sounds
+from etho.utils.sound import PlaylistArray, build_playlist, parse_table, load_sounds, normalize_table, select_channels_from_playlist
+from etho.utils.stimcache import StimulusCache
 # import matplotlib.pyplot as plt
 
 
@@ -50,3 +52,230 @@ def test_parse_table_accepts_quoted_bracketed_stimulus_name():
     )
 
     assert parse_table(playlist).loc[0, "stimFileName"] == ["SIN_100_0_3000"]
+
+
+def test_playlist_array_streams_stimuli_in_play_order():
+    sounds = [np.full((2, 2), 1.0), np.full((3, 2), 2.0)]
+    data = PlaylistArray(sounds, [1, 0, 1], columns=slice(None, -1))
+
+    assert data.shape == (8, 1)
+    np.testing.assert_array_equal(np.asarray(data)[:, 0], [2, 2, 2, 1, 1, 2, 2, 2])
+    assert [len(block) for block in data.blocks()] == [3, 2, 3]
+    assert [len(block) for block in data.blocks(min_samples=4)] == [5, 3]
+
+
+def test_playlist_array_silence_allocates_one_block():
+    silence = PlaylistArray.silence(25, 2, np.uint8, block_size=10)
+
+    assert silence.shape == (25, 2)
+    assert silence.dtype == np.uint8
+    assert sum(sound.size for sound in silence.sounds) == 2 * (10 + 5)
+    assert [len(block) for block in silence.blocks()] == [10, 10, 5]
+
+
+def _sine_playlist(nb_rows=2):
+    return parse_table(
+        pd.DataFrame(
+            {
+                "stimFileName": ["SIN_100_0_100"] * nb_rows,
+                "silencePre": [10] * nb_rows,
+                "silencePost": [10] * nb_rows,
+                "intensity": [1.0] * nb_rows,
+                "freq": [100] * nb_rows,
+            }
+        )
+    )
+
+
+def test_load_sounds_dedupes_identical_rows():
+    sounds = load_sounds(_sine_playlist(), fs=1000)
+
+    assert sounds[0] is sounds[1]
+    assert sounds[0].shape == (120, 1)
+
+
+def test_load_sounds_caches_rendered_rows(tmp_path):
+    uncached = load_sounds(_sine_playlist(), fs=1000)
+    cached = load_sounds(_sine_playlist(), fs=1000, cache_dir=str(tmp_path))
+    reloaded = load_sounds(_sine_playlist(), fs=1000, cache_dir=str(tmp_path))
+
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+    assert isinstance(reloaded[0], np.memmap)
+    np.testing.assert_array_equal(cached[0], uncached[0])
+    np.testing.assert_array_equal(reloaded[1], uncached[1])
+
+
+def test_load_sounds_cache_key_tracks_file_content(tmp_path):
+    import scipy.io.wavfile as wav
+
+    stimfolder = tmp_path / "stim"
+    stimfolder.mkdir()
+    playlist = parse_table(
+        pd.DataFrame({"stimFileName": ["stim.wav"], "silencePre": [0], "silencePost": [0], "intensity": [1.0], "freq": [100]})
+    )
+    wav.write(stimfolder / "stim.wav", 1000, np.full(10, 16384, dtype=np.int16))
+    first = load_sounds(playlist, fs=1000, stimfolder=str(stimfolder), cache_dir=str(tmp_path / "cache"))
+    wav.write(stimfolder / "stim.wav", 1000, np.full(12, 8192, dtype=np.int16))
+    second = load_sounds(playlist, fs=1000, stimfolder=str(stimfolder), cache_dir=str(tmp_path / "cache"))
+
+    assert first[0].shape == (10, 1)
+    assert second[0].shape == (12, 1)
+    np.testing.assert_allclose(second[0], 0.25)
+
+
+def test_stimulus_cache_evicts_least_recently_used(tmp_path):
+    import os
+
+    x = np.zeros(100)
+    cache = StimulusCache(tmp_path, max_bytes=2.5 * (x.nbytes + 128))
+    for cnt, key in enumerate(["a", "b"]):
+        cache.put(key, x)
+        os.utime(cache.path(key), ns=(cnt * 10**9, cnt * 10**9))
+    cache.get("a")  # now more recently used than "b"
+    cache.put("c", x)
+
+    assert sorted(path.stem for path in tmp_path.glob("*.npy")) == ["a", "c"]
+
+
+def test_stimulus_cache_keeps_shared_arrays_over_cap(tmp_path):
+    import os
+
+    from etho.utils.stimcache import attach
+
+    arrays = [np.full(100, cnt, dtype=np.float64) for cnt in range(4)]
+    cache = StimulusCache(tmp_path, max_bytes=2 * (arrays[0].nbytes + 128))
+    cache.share([np.full(100, -1.0)])  # older entry, evicted first
+    paths = cache.share(arrays)
+
+    for x, attached in zip(arrays, attach(paths)):
+        np.testing.assert_array_equal(attached, x)
+    assert len(list(tmp_path.glob("*.npy"))) == 4  # over the cap, but the older entry is evicted
+
+    cache.share(arrays[:1])  # shared again - now the most recently used
+    assert (tmp_path / os.path.basename(paths[0])).exists()
+    assert len(list(tmp_path.glob("*.npy"))) <= 2
+
+
+def test_load_sounds_resamples_each_file_once(tmp_path, monkeypatch):
+    import scipy.io.wavfile as wav
+    import scipy.signal
+
+    for cnt, name in enumerate(["a.wav", "b.wav", "c.wav"]):
+        wav.write(tmp_path / name, 2000, np.full(20 * (cnt + 1), 16384, dtype=np.int16))
+    playlist = parse_table(
+        pd.DataFrame(
+            {
+                "stimFileName": ["a.wav", "b.wav", "a.wav", "c.wav"],
+                "silencePre": [0] * 4,
+                "silencePost": [0] * 4,
+                "intensity": [1.0, 1.0, 2.0, 1.0],
+                "freq": [100] * 4,
+            }
+        )
+    )
+    resampled = []
+    resample_poly = scipy.signal.resample_poly
+
+    def counting_resample_poly(x, *args, **kwargs):
+        resampled.append(len(x))
+        return resample_poly(x, *args, **kwargs)
+
+    monkeypatch.setattr(scipy.signal, "resample_poly", counting_resample_poly)
+    progress = []
+    sounds = load_sounds(playlist, fs=1000, stimfolder=str(tmp_path), num_workers=3, progress=lambda *args: progress.append(args))
+
+    assert sorted(resampled) == [20, 40, 60]
+    assert [len(sound) for sound in sounds] == [10, 20, 10, 30]
+    assert sorted(progress) == [(1, 3), (2, 3), (3, 3)]
+    np.testing.assert_allclose(sounds[2], 2 * sounds[0])
+
+
+def test_load_sounds_renders_requested_dtype():
+    sounds = load_sounds(_sine_playlist(1), fs=1000, dtype=np.float32)
+    reference = load_sounds(_sine_playlist(1), fs=1000)
+
+    assert sounds[0].dtype == np.float32
+    assert reference[0].dtype == np.float64
+    np.testing.assert_allclose(sounds[0], reference[0], atol=1e-6)
+
+
+def test_parse_table_caches_playlist_file_until_modified(tmp_path):
+    import os
+
+    playlistfile = tmp_path / "playlist.txt"
+    playlistfile.write_text("stimFileName\tsilencePre\tsilencePost\tintensity\tfreq\n[SIN_100_0_100, SI_START]\t[10, 0]\t10\t1.0\t100\n")
+    first = parse_table(str(playlistfile))
+    first.loc[0, "intensity"] = [3.0]  # callers own the returned table
+    first.loc[0, "stimFileName"].append("SI_STOP")  # including the list cells
+    parse_table(str(playlistfile)).loc[0, "silencePre"][0] = 20.0
+
+    cached = parse_table(str(playlistfile))
+    assert cached.loc[0, "stimFileName"] == ["SIN_100_0_100", "SI_START"]
+    assert cached.loc[0, "silencePre"] == [10.0, 0.0]
+    assert cached.loc[0, "intensity"] == [1.0, 1.0]
+
+    playlistfile.write_text("stimFileName\tsilencePre\tsilencePost\tintensity\tfreq\nSIN_200_0_100\t0\t0\t2.0\t200\n")
+    os.utime(playlistfile, ns=(0, 10**9))
+    assert parse_table(str(playlistfile)).loc[0, "intensity"] == [2.0]
+
+
+def test_normalize_and_select_channels_from_playlist():
+    playlist = pd.DataFrame(
+        {
+            "stimFileName": [["a.wav", "SI_START"], ["b.wav"]],
+            "silencePre": [[0.0], [10.0]],
+            "silencePost": [[5.0, 6.0], [0.0]],
+            "intensity": [[1.0], [2.0]],
+            "freq": [[100.0], [100.0]],
+        }
+    )
+
+    normalized = normalize_table(playlist)
+    assert normalized.loc[0, "silencePre"] == [0.0, 0.0]
+    assert normalized.loc[0, "silencePost"] == [5.0, 6.0]
+    assert normalized.loc[1, "intensity"] == [2.0]
+
+    selected = select_channels_from_playlist(normalized.iloc[:1], [1])
+    assert selected.loc[0].tolist() == [["SI_START"], [0.0], [6.0], [1.0], [100.0]]
+
+
+def test_build_playlist_cuts_after_duration_is_reached():
+    sounds = [np.zeros(n) for n in (3, 5, 7)]
+
+    items, totallen, onsets = build_playlist(sounds, duration=2.0, fs=10, return_onsets=True)
+
+    assert items == [0, 1, 2, 0, 1]
+    assert totallen == 2.3
+    np.testing.assert_array_equal(onsets, [0, 3, 8, 15, 18])
+    assert build_playlist(sounds, duration=-1, fs=10) == ([0, 1, 2], 1.5)
+
+
+def test_build_playlist_shuffles_blocks_reproducibly():
+    sounds = [np.zeros(1)] * 5
+
+    items, totallen = build_playlist(sounds, duration=10, fs=1, shuffle=True, seed=42)
+
+    assert len(items) == 10 and totallen == 10
+    assert sorted(items[:5]) == sorted(items[5:]) == [0, 1, 2, 3, 4]
+    assert build_playlist(sounds, duration=10, fs=1, shuffle=True, seed=42)[0] == items
+
+
+def test_build_playlist_without_seed_follows_global_random_state():
+    sounds = [np.zeros(1)] * 5
+
+    np.random.seed(1)
+    items = build_playlist(sounds, duration=20, fs=1, shuffle=True)[0]
+    np.random.seed(1)
+    assert build_playlist(sounds, duration=20, fs=1, shuffle=True)[0] == items
+
+
+def test_load_sounds_writes_clock_channel():
+    playlist = pd.DataFrame(
+        [["['SIN_100_0_100', 'CLOCK10_10']", "[0, 0]", "[0, 0]", "[1.0, 1.0]", "[100, 0]"]],
+        columns=["stimFileName", "silencePre", "silencePost", "intensity", "freq"],
+    )
+
+    sound = load_sounds(parse_table(playlist), fs=1000)[0]
+
+    # 10 ms pulses and pauses over the 100 ms of the sine on the first channel
+    np.testing.assert_array_equal(sound[:, 1], np.tile(np.r_[np.ones(10), np.zeros(10)], 5))
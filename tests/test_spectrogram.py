@@ -0,0 +1,36 @@
+import numpy as np
+import tables
+
+from etho.services.callbacks._trace import PlotSpectrogram, StreamingSTFT
+
+
+def test_streaming_stft_matches_stft_of_whole_trace():
+    x = np.random.default_rng(0).standard_normal((5000, 2))
+    starts, power = StreamingSTFT(nfft=256, hop=100)(x)
+
+    stft = StreamingSTFT(nfft=256, hop=100)
+    chunks = [stft(x[start : start + 731]) for start in range(0, len(x), 731)]
+    np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), starts)
+    np.testing.assert_allclose(np.concatenate([chunk[1] for chunk in chunks]), power)
+
+    assert power.shape == (48, 2, 129)
+    window = stft.window
+    np.testing.assert_allclose(power[3, 1], np.abs(np.fft.rfft(x[300:556, 1] * window)) ** 2)
+
+
+def test_spectrogram_saves_decimated_frames(tmp_path):
+    rate = 10_000
+    x = np.sin(2 * np.pi * 1000 * np.arange(10_000) / rate)[:, np.newaxis] * [0, 1]
+    spec = PlotSpectrogram(
+        None, file_name=str(tmp_path / "run"), attrs={"rate": rate}, channels_to_plot=[1], nfft=100, freq_range=[500, 2000], display=False, save=True, save_decimation=4
+    )
+    for start in range(0, len(x), 1000):
+        spec._loop((x[start : start + 1000], 0.0))
+    spec._cleanup()
+
+    with tables.open_file(str(tmp_path / "run_spec.h5"), mode="r") as f:
+        freqs = f.root.spectrogram.attrs["freqs"]
+        assert freqs[0] == 500 and freqs[-1] == 2000
+        assert f.root.spectrogram.shape == (50, 1, len(freqs))  # 199 frames
+        assert f.root.samples[:3].tolist() == [0, 200, 400]
+        assert np.all(freqs[np.argmax(f.root.spectrogram[:, 0], axis=1)] == 1000)
@@ -0,0 +1,93 @@
+import json
+import logging
+
+import numpy as np
+import pytest
+
+from etho.services.DAQZeroService import DAQ
+from etho.services.daq.virtual import get_device
+from etho.services.utils.stats import CallbackStats, LogHistogram
+
+
+def test_log_histogram_quantiles_have_bucket_resolution():
+    histogram = LogHistogram(1e-3, 1e1, buckets_per_decade=10)
+    values = np.random.default_rng(0).uniform(0.01, 0.02, 1000)
+    for value in values:
+        histogram.add(value)
+    histogram.add(100)  # beyond the last bucket
+
+    assert histogram.count == 1001 and histogram.max == 100
+    assert histogram.counts[-1] == 1
+    for q in [0.1, 0.5, 0.9]:
+        assert np.quantile(values, q) <= histogram.quantile(q) <= 10 ** 0.1 * np.quantile(values, q)
+
+
+def test_log_histogram_merge_adds_counts():
+    first, second = LogHistogram(1e-3, 1e1), LogHistogram(1e-3, 1e1)
+    for value in [0.01, 0.02]:
+        first.add(value)
+    second.add(5)
+    first.merge(second)
+
+    assert first.count == 3 and first.counts.sum() == 3
+    assert first.min == 0.01 and first.max == 5
+
+    with pytest.raises(ValueError):
+        first.merge(LogHistogram(1e-3, 1e2))
+
+
+def test_callback_stats_warns_before_underrun(caplog):
+    stats = CallbackStats(rate=1000, nb_samples_per_event=100, buffer_size=1000, output=True, name="AO", logger=logging.getLogger(__name__))
+    with caplog.at_level(logging.WARNING):
+        for backlog in [500, 300, 50, 20]:
+            stats.record(0.0, 0.001, 100, backlog)
+
+    assert stats.alarms == {"underrun": 2, "overflow": 0, "overrun": 0}
+    assert len([record for record in caplog.records if "run empty" in record.getMessage()]) == 1  # rate limited
+
+
+def test_callback_stats_samples_backlog_every_few_calls():
+    stats = CallbackStats(rate=1000, nb_samples_per_event=100, buffer_size=1000, output=True, backlog_every=3)
+    due = []
+    for _ in range(7):
+        due.append(stats.backlog_due())
+        stats.record(0.0, 0.001, 100, 500 if due[-1] else None)
+
+    assert due == [True, False, False, True, False, False, True]
+    assert stats.nb_calls == 7 and sum(stats.backlog.counts) == 3
+
+
+def test_daq_saves_callback_stats(tmp_path):
+    device = get_device("virtual_stats")
+    device.realtime = False
+    service = DAQ.__new__(DAQ)  # skip the zerorpc server
+    service.log = logging.getLogger(__name__)
+    service.prev_elapsed = 0
+    service.duration = 1
+    service._time_elapsed = lambda: 0.5
+    service.setup(
+        savefilename=str(tmp_path / "run"),
+        play_order=[0, 0, 0],
+        fs=1000,
+        dev_name="virtual_stats",
+        nb_inputsamples_per_cycle=100,
+        analog_chans_in=["ai0"],
+        analog_chans_out=["ao0"],
+        analog_data_out=[np.ones((50, 1))],
+        params={"save_onsets": False},
+    )
+    service.start()
+    for _ in range(10):
+        device.advance(100)
+
+    progress = service.progress()
+    assert progress["tasks"]["AI"]["calls"] == 10
+    assert progress["tasks"]["AI"]["samples"] == 1000
+    assert progress["tasks"]["AO"]["alarms"]["underrun"] > 0  # writes 50 samples per 100 clocked out
+
+    service.service_stop = lambda: None
+    service.finish()
+    with open(tmp_path / "run_daqstats.json") as f:
+        stats = json.load(f)
+    assert set(stats) == {"AI", "AO"}
+    assert sum(stats["AI"]["duration"]["counts"]) == 10
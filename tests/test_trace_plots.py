@@ -0,0 +1,36 @@
+import numpy as np
+
+from etho.services.callbacks._trace import PlotPQG, ScrollingHistory, minmax_envelope
+
+
+def test_minmax_envelope_keeps_extremes_of_each_bin():
+    data = np.array([[0, 5], [3, 1], [-2, 4], [7, 0], [1, 1]], dtype=float)
+
+    envelope = minmax_envelope(data, bin_size=2)
+
+    np.testing.assert_array_equal(envelope[:, 0], [0, 3, -2, 7, 1, 1])
+    np.testing.assert_array_equal(envelope[:, 1], [1, 5, 0, 4, 1, 1])
+
+
+def test_scrolling_history_keeps_most_recent_points():
+    history = ScrollingHistory(4, 1)
+    history.push(np.arange(3)[:, None])
+    history.push(np.arange(3, 5)[:, None])
+    np.testing.assert_array_equal(history.data[:, 0], [1, 2, 3, 4])
+
+    history.push(np.arange(10)[:, None])
+    np.testing.assert_array_equal(history.data[:, 0], [6, 7, 8, 9])
+
+
+def test_plot_decimates_data_before_sending():
+    task_kwargs = {"channels_to_plot": [1], "history_seconds": 2, "width": 100, "attrs": {"rate": 1000}}
+    task = PlotPQG.make_concurrent(task_kwargs=task_kwargs)
+    data = np.random.default_rng(0).standard_normal((400, 3))
+    task.send((data, 1.5))
+    task.send(None)
+
+    envelope, systemtime = task._receiver.get(timeout=5)
+    assert systemtime == 1.5
+    assert envelope.shape == (2 * 400 // 20, 1)
+    np.testing.assert_array_equal(envelope[1::2, 0], data[:, 1].reshape(-1, 20).max(axis=1))
+    assert task._receiver.get(timeout=5) is None
@@ -0,0 +1,48 @@
+import numpy as np
+import tables
+import zarr
+
+from etho.services.callbacks._trace import SaveHDF, SaveZarr, time_to_sample
+
+
+def _write(writer):
+    chunks = [np.full((100, 2), cnt, dtype=np.float64) for cnt in range(10)]
+    for cnt, chunk in enumerate(chunks):
+        writer._loop((chunk, 1000.0 + cnt))
+    writer._cleanup()
+    return np.concatenate(chunks)
+
+
+def test_save_h5_buffers_chunks_and_writes_index(tmp_path):
+    writer = SaveHDF(None, file_name=str(tmp_path / "run"), chunk_bytes=4 * 100 * 2 * 8)
+    data = _write(writer)
+
+    with tables.open_file(str(tmp_path / "run_daq.h5")) as f:
+        assert f.root.samples.chunkshape == (400, 2)
+        np.testing.assert_array_equal(f.root.samples[:], data)
+        index = f.root.index.read()
+        systemtime, samplenumber = f.root.systemtime[:], f.root.samplenumber[:]
+    np.testing.assert_array_equal(index["sample_offset"], np.arange(0, 1000, 100))
+    np.testing.assert_array_equal(index["nb_samples"], 100)
+    np.testing.assert_array_equal(index["systemtime"], 1000.0 + np.arange(10))
+    # arrays of files written before the index table
+    np.testing.assert_array_equal(systemtime, 1000.0 + np.arange(10)[:, np.newaxis])
+    np.testing.assert_array_equal(samplenumber, np.full((10, 1), 100))
+
+
+def test_save_zarr_writes_index(tmp_path):
+    writer = SaveZarr(None, file_name=str(tmp_path / "run"), chunk_bytes=4 * 100 * 2 * 8)
+    data = _write(writer)
+
+    group = zarr.open_group(str(tmp_path / "run_daq.zarr"), mode="r")
+    np.testing.assert_array_equal(group["samples"][:], data)
+    np.testing.assert_array_equal(group["index"][:]["sample_offset"], np.arange(0, 1000, 100))
+    np.testing.assert_array_equal(group["systemtime"][:], 1000.0 + np.arange(10)[:, np.newaxis])
+    np.testing.assert_array_equal(group["samplenumber"][:], np.full((10, 1), 100))
+
+
+def test_time_to_sample():
+    index = np.array([(0, 100, 1.0), (100, 100, 2.0), (200, 50, 3.0)], dtype=[("sample_offset", np.int64), ("nb_samples", np.int64), ("systemtime", np.float64)])
+    assert time_to_sample(index, 0.5) == 0
+    assert time_to_sample(index, 2.0) == 200
+    np.testing.assert_array_equal(time_to_sample(index, np.array([1.5, 10.0])), [100, 250])